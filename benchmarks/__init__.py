@@ -0,0 +1,5 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+'''
\ No newline at end of file
@@ -0,0 +1,111 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Corpora for the benchmarks. Everything here is deterministic for a given seed, so runs are comparable.
+'''
+
+import bisect
+import bz2
+import itertools
+import random
+import re
+from collections import Counter
+from xml.etree.ElementTree import iterparse
+
+
+def make_vocab(vocab_size: int, seed: int = 0) -> list:
+    '''
+    Generates pronounceable pseudo-words, so they go through the stemmer like real words would,
+    but don't collide with stopwords. The ith word is the ith most frequent one.
+    '''
+    rand = random.Random(seed)
+    consonants, vowels = "bcdfgklmnprstvz", "aeiou"
+    vocab, seen = [], set()
+    while len(vocab) < vocab_size:
+        word = "".join(rand.choice(consonants) + rand.choice(vowels) for _ in range(rand.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            vocab.append(word)
+    return vocab
+
+
+class ZipfCorpus:
+    '''
+    Synthetic corpus whose word frequencies follow Zipf's law (the word of rank r has frequency ~ 1/r^s),
+    like natural language text does.
+    '''
+    def __init__(self, num_docs: int, vocab_size: int = 20000, doc_len: int = 300, s: float = 1.0, seed: int = 0):
+        self.num_docs = num_docs
+        self.doc_len = doc_len
+        self.seed = seed
+        self.vocab = make_vocab(vocab_size, seed)
+        self.cum_weights = list(itertools.accumulate(1.0 / (rank + 1) ** s for rank in range(vocab_size)))
+
+    def sample_words(self, rand, n: int) -> list:
+        total = self.cum_weights[-1]
+        return [self.vocab[bisect.bisect(self.cum_weights, rand.random() * total)] for _ in range(n)]
+
+    def docs(self):
+        '''
+        Generates the documents.
+        :return: Generator of dicts with keys doc_id, doc_title, doc_body, like index_wikiquote.get_next_doc.
+        '''
+        rand = random.Random(self.seed)
+        for i in range(self.num_docs):
+            title = " ".join(self.sample_words(rand, 3)).title()
+            body = " ".join(self.sample_words(rand, max(1, int(rand.gauss(self.doc_len, self.doc_len / 4)))))
+            yield {"doc_id": "doc" + str(i), "doc_title": title, "doc_body": body}
+
+
+def make_queries(docs: list, num_queries: int, seed: int = 1) -> dict:
+    '''
+    Generates the query mixes for a corpus, by name. Each query is a list of words.
+    "head" queries use the most frequent words of the corpus and "tail" queries words that occur once.
+    Phrases are cut out of the documents so they always match something.
+    :param docs: List of document dicts.
+    :param num_queries: Number of queries per mix.
+    :param seed: int
+    :return: Dict of query mix name to list of queries.
+    '''
+    rand = random.Random(seed)
+    counts = Counter()
+    for doc in docs:
+        counts.update(re.findall(r'[a-z0-9]{4,}', doc["doc_body"].lower()))
+    head = [word for word, count in counts.most_common(50)]
+    tail = sorted(word for word, count in counts.items() if count == 1) or head
+    phrases = []
+    while len(phrases) < num_queries:
+        words = re.findall(r'[a-z0-9]+', rand.choice(docs)["doc_body"].lower())
+        if len(words) >= 3:
+            start = rand.randrange(len(words) - 2)
+            phrases.append(words[start:start + rand.randint(2, 3)])
+    return {
+        "free_text_head": [rand.sample(head, 2) for _ in range(num_queries)],
+        "free_text_tail": [rand.sample(tail, min(2, len(tail))) for _ in range(num_queries)],
+        "free_text_mixed": [[rand.choice(head), rand.choice(tail)] for _ in range(num_queries)],
+        "phrase": phrases,
+    }
+
+
+def wikiquote_sample(filename: str, limit: int = None):
+    '''
+    Reads documents out of a wikiquote dump, e.g. enwikiquote-20170801-pages-meta-current.xml.bz2.
+    :param filename: Path to the (optionally bz2 compressed) dump.
+    :param limit: Max number of documents to read.
+    :return: Generator of dicts with keys doc_id, doc_title, doc_body.
+    '''
+    from index_wikiquote import get_next_doc
+    opener = bz2.open if filename.endswith(".bz2") else open
+    with opener(filename, 'rb') as f:
+        xml_iter = iterparse(f, events=("start", "end"))
+        count = 0
+        while limit is None or count < limit:
+            try:
+                doc = get_next_doc(xml_iter)
+            except StopIteration:
+                return
+            if doc is not None:
+                yield doc
+                count += 1
@@ -0,0 +1,262 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Benchmark runner. Measures Index.add_document throughput, Index.save latency at several memory segment sizes,
+query latency percentiles for several query mixes (against the memory segment and against the disk segment),
+the throughput of the same queries run as one batch, top-k query latency with and without high-impact tiers,
+the time to reopen the index and answer a first query,
+peak memory and the size of the files on disk, and writes the results as JSON.
+Run from the repository root:
+    python -m benchmarks.run --docs 5000 --out bench.json
+    python -m benchmarks.run --docs 5000 --compare bench.json
+    python -m benchmarks.run --corpus wikiquote --wikiquote-file enwikiquote-20170801-pages-meta-current.xml.bz2
+With --compare, exits with status 1 if any metric is worse than the baseline by more than --tolerance.
+'''
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from benchmarks.corpus import ZipfCorpus, make_queries, wikiquote_sample
+from naive_dynamic_ix.index import Index
+
+
+def percentiles(samples: list) -> dict:
+    '''
+    :param samples: List of latencies in seconds.
+    :return: Dict of summary stats, in milliseconds.
+    '''
+    samples = sorted(samples)
+    def at(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return {"p50_ms": at(0.5), "p90_ms": at(0.9), "p99_ms": at(0.99), "mean_ms": sum(samples) / len(samples) * 1000}
+
+
+def file_sizes(directory: str) -> dict:
+    return {name: os.path.getsize(os.path.join(directory, name)) for name in sorted(os.listdir(directory))}
+
+
+def open_index(directory: str) -> Index:
+    ix = Index.open(directory)
+    ix.memory_limit = float("inf")  # only flush when the benchmark says so
+    return ix
+
+
+def bench_ingest(ix: Index, docs: list) -> dict:
+    nbytes = sum(len(doc["doc_title"]) + len(doc["doc_body"]) for doc in docs)
+    start = time.perf_counter()
+    for doc in docs:
+        ix.add_document(**doc)
+    secs = time.perf_counter() - start
+    return {"docs_per_sec": len(docs) / secs, "mb_per_sec": nbytes / secs / 1e6,
+            "segment_bytes": ix.memory_segment.get_size()}
+
+
+def bench_queries(ix: Index, mixes: dict) -> dict:
+    metrics = {}
+    for name, queries in sorted(mixes.items()):
+        method = ix.do_phrase_query if name.startswith("phrase") else ix.do_free_text_query
+        latencies = []
+        for terms in queries:
+            start = time.perf_counter()
+            method(terms)
+            latencies.append(time.perf_counter() - start)
+        metrics[name] = percentiles(latencies)
+    return metrics
+
+
+def bench_top_k(ix: Index, mixes: dict, k: int = 10) -> dict:
+    '''
+    Times top-k queries for the free text queries of common terms, reading the high-impact tiers first and
+    reading every posting list in full.
+    '''
+    metrics = {}
+    for name, tiered in (("tiered", True), ("exhaustive", False)):
+        latencies = []
+        for terms in mixes["free_text_head"]:
+            start = time.perf_counter()
+            ix.do_top_k_query(terms, k, tiered=tiered)
+            latencies.append(time.perf_counter() - start)
+        metrics[name] = percentiles(latencies)
+    return metrics
+
+
+def bench_batch(ix: Index, mixes: dict) -> dict:
+    '''
+    Times running every query of every mix as one Index.run_queries batch.
+    '''
+    batch = [("phrase" if name.startswith("phrase") else "free_text", terms)
+             for name, queries in sorted(mixes.items()) for terms in queries]
+    start = time.perf_counter()
+    ix.run_queries(batch)
+    return {"queries_per_sec": len(batch) / (time.perf_counter() - start)}
+
+
+def bench_suggest(ix: Index, mixes: dict, k: int = 10) -> dict:
+    '''
+    Times type-ahead suggestions for the first one, two and three letters of the words of the mixed queries.
+    '''
+    metrics = {}
+    for length in (1, 2, 3):
+        latencies = []
+        for terms in mixes["free_text_mixed"]:
+            for term in terms:
+                start = time.perf_counter()
+                ix.suggest(term[:length], k)
+                latencies.append(time.perf_counter() - start)
+        metrics["prefix_" + str(length)] = percentiles(latencies)
+    return metrics
+
+
+def bench_flush(docs: list, sizes: list) -> dict:
+    '''
+    For each segment size, times saving a memory segment of that many documents into an empty disk segment,
+    then saving another one of the same size into the now non-empty disk segment.
+    '''
+    metrics = {}
+    for size in sizes:
+        if 2 * size > len(docs):
+            continue
+        directory = tempfile.mkdtemp()
+        try:
+            ix = open_index(directory)
+            result = {}
+            for label, batch in (("into_empty", docs[:size]), ("into_existing", docs[size:2 * size])):
+                for doc in batch:
+                    ix.add_document(**doc)
+                start = time.perf_counter()
+                ix.save()
+                result[label + "_ms"] = (time.perf_counter() - start) * 1000
+            ix.close()
+        finally:
+            shutil.rmtree(directory)
+        metrics[str(size)] = result
+    return metrics
+
+
+def run(docs: list, num_queries: int, flush_sizes: list) -> dict:
+    mixes = make_queries(docs, num_queries)
+    directory = tempfile.mkdtemp()
+    try:
+        ix = open_index(directory)
+        ingest = bench_ingest(ix, docs)
+        memory_queries = bench_queries(ix, mixes)
+        start = time.perf_counter()
+        ix.save()
+        ingest["save_ms"] = (time.perf_counter() - start) * 1000
+        disk_queries = bench_queries(ix, mixes)
+        batch_queries = bench_batch(ix, mixes)
+        top_k_queries = bench_top_k(ix, mixes)
+        suggest_queries = bench_suggest(ix, mixes)
+        ix.close()
+        start = time.perf_counter()
+        ix = Index.open(directory)
+        ix.do_free_text_query(mixes["free_text_tail"][0])
+        ingest["open_and_first_query_ms"] = (time.perf_counter() - start) * 1000
+        ix.close()
+        disk = file_sizes(directory)
+    finally:
+        shutil.rmtree(directory)
+    return {
+        "ingest": ingest,
+        "query_memory": memory_queries,
+        "query_disk": disk_queries,
+        "query_batch": batch_queries,
+        "query_top_k": top_k_queries,
+        "query_suggest": suggest_queries,
+        "flush": bench_flush(docs, flush_sizes),
+        "memory": {"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024},
+        "disk_bytes": disk,
+    }
+
+
+def flatten(metrics: dict, prefix: str = "") -> dict:
+    '''
+    Flattens nested metric dicts into {"a.b.c": value}.
+    '''
+    flat = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "."))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(metrics: dict, baseline: dict, tolerance: float, min_delta_ms: float = 0.1) -> list:
+    '''
+    Compares the metrics of a run against a baseline run. Throughputs ("_per_sec") are better when higher,
+    everything else (latencies, sizes, memory) is better when lower. Latency changes smaller than
+    min_delta_ms are timer noise and never count as regressions.
+    :return: List of (metric, baseline value, new value, relative change) for metrics that regressed by
+        more than the tolerance.
+    '''
+    regressions = []
+    new, old = flatten(metrics), flatten(baseline)
+    for name in sorted(set(new) & set(old)):
+        if not old[name]:
+            continue
+        if name.endswith("_ms") and abs(new[name] - old[name]) < min_delta_ms:
+            continue
+        change = (new[name] - old[name]) / old[name]
+        if name.endswith("_per_sec"):
+            change = -change
+        if change > tolerance:
+            regressions.append((name, old[name], new[name], change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Indexing, flushing and query benchmarks.")
+    parser.add_argument("--corpus", choices=["zipf", "wikiquote"], default="zipf")
+    parser.add_argument("--wikiquote-file", default="enwikiquote-20170801-pages-meta-current.xml.bz2")
+    parser.add_argument("--docs", type=int, default=5000, help="number of documents to index")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200, help="number of queries per query mix")
+    parser.add_argument("--flush-sizes", type=int, nargs="+", default=[500, 1000, 2500],
+                        help="memory segment sizes, in documents, to time flushes at")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare the results against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (default 0.2)")
+    args = parser.parse_args(argv)
+
+    if args.corpus == "zipf":
+        docs = list(ZipfCorpus(args.docs, seed=args.seed).docs())
+    else:
+        docs = list(wikiquote_sample(args.wikiquote_file, args.docs))
+
+    results = {
+        "meta": {
+            "corpus": args.corpus, "docs": len(docs), "seed": args.seed, "queries": args.queries,
+            "python": platform.python_version(), "platform": platform.platform(), "time": time.time(),
+        },
+        "metrics": run(docs, args.queries, args.flush_sizes),
+    }
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results["metrics"], baseline["metrics"], args.tolerance)
+        for name, old, new, change in regressions:
+            print("REGRESSION %s: %.4g -> %.4g (%+.1f%%)" % (name, old, new, change * 100), file=sys.stderr)
+        if regressions:
+            return 1
+        print("No regressions against " + args.compare, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
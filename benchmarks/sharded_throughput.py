@@ -0,0 +1,55 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Measures query throughput of a ShardedIndex against the number of shards on one machine.
+Run from the repository root:
+    python -m benchmarks.sharded_throughput --docs 20000 --shards 1 2 4 8
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from benchmarks.corpus import ZipfCorpus, make_queries
+from naive_dynamic_ix.sharded_index import ShardedIndex
+
+
+def run(num_docs, shard_counts, num_queries):
+    docs = list(ZipfCorpus(num_docs).docs())
+    queries = make_queries(docs, num_queries)["free_text_mixed"]
+    print("shards\tindex_s\tqueries/s\tphrase_queries/s")
+    for num_shards in shard_counts:
+        directory = tempfile.mkdtemp()
+        try:
+            ix = ShardedIndex(os.path.join(directory, "ix.db"), os.path.join(directory, "docs.db"), num_shards)
+            start = time.perf_counter()
+            for doc in docs:
+                ix.add_document(**doc)
+            ix.save()
+            index_secs = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for terms in queries:
+                ix.do_free_text_query(terms)
+            free_text_qps = num_queries / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for terms in queries:
+                ix.do_phrase_query(terms)
+            phrase_qps = num_queries / (time.perf_counter() - start)
+            ix.close()
+        finally:
+            shutil.rmtree(directory)
+        print("%d\t%.2f\t%.1f\t%.1f" % (num_shards, index_secs, free_text_qps, phrase_qps))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query throughput of ShardedIndex vs. shard count.")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    run(args.docs, args.shards, args.queries)
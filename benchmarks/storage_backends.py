@@ -0,0 +1,79 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Compares the storage backends of naive_dynamic_ix.storage: ingest throughput (adding the documents and saving the
+index), query throughput against the disk segment for several query mixes, and the size of the files on disk.
+Backends whose module is not installed are skipped.
+Run from the repository root:
+    python -m benchmarks.storage_backends --docs 5000 --backends bsddb sqlite
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from benchmarks.corpus import ZipfCorpus, make_queries
+from naive_dynamic_ix.index import Index
+from naive_dynamic_ix.storage import BACKENDS, BSDDB, bsddb3
+
+MIXES = ("free_text_head", "free_text_tail", "free_text_mixed", "phrase")
+
+
+def run_mix(ix: Index, mix: str, queries: list) -> float:
+    '''
+    :return: Queries per second of the mix.
+    '''
+    start = time.perf_counter()
+    for terms in queries:
+        if mix == "phrase":
+            ix.do_phrase_query(terms)
+        else:
+            ix.do_free_text_query(terms)
+    return len(queries) / (time.perf_counter() - start)
+
+
+def run(num_docs: int, backends: list, num_queries: int, flush_docs: int):
+    docs = list(ZipfCorpus(num_docs).docs())
+    queries = make_queries(docs, num_queries)
+    print("backend\tdocs/s\tsave_s\tMB\t" + "\t".join(mix + "/s" for mix in MIXES))
+    for backend in backends:
+        if backend == BSDDB and bsddb3 is None:
+            print(backend + "\tskipped, bsddb3 is not installed")
+            continue
+        directory = tempfile.mkdtemp()
+        try:
+            ix = Index.open(directory, storage=backend)
+            ix.memory_limit = float("inf")
+            ix.background_flush = False
+            start = time.perf_counter()
+            for i, doc in enumerate(docs):
+                ix.add_document(**doc)
+                if (i + 1) % flush_docs == 0:
+                    ix.save()  # several merges, so that posting lists are rewritten like in a long-running index
+            ix.save()
+            ingest_secs = time.perf_counter() - start
+            start = time.perf_counter()
+            ix.close()
+            close_secs = time.perf_counter() - start
+            nbytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+            ix = Index.open(directory, read_only=True)
+            throughputs = [run_mix(ix, mix, queries[mix]) for mix in MIXES]
+            ix.close()
+        finally:
+            shutil.rmtree(directory)
+        print("%s\t%.1f\t%.2f\t%.1f\t%s" % (backend, len(docs) / ingest_secs, close_secs, nbytes / 1e6,
+                                            "\t".join("%.1f" % qps for qps in throughputs)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest and query throughput of the storage backends.")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200, help="number of queries per query mix")
+    parser.add_argument("--flush-docs", type=int, default=1000, help="documents added between saves")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    args = parser.parse_args()
+    run(args.docs, args.backends, args.queries, args.flush_docs)
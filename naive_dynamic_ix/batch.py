@@ -0,0 +1,55 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+'''
+
+from naive_dynamic_ix.memory_segment import PostingList
+from naive_dynamic_ix import metrics
+
+FREE_TEXT = "free_text"
+PHRASE = "phrase"
+QUERY_TYPES = (FREE_TEXT, PHRASE)
+
+
+class CachedSegment:
+    '''
+    Read-only view of a MemorySegment or DiskSegment that fetches and decodes each posting list at most once,
+    so a batch of queries over the same terms shares the work.
+    '''
+    def __init__(self, segment):
+        self.segment = segment
+        self.posting_lists = {}
+
+    def get_posting_list(self, term: str) -> PostingList:
+        posting_list = self.posting_lists.get(term)
+        if posting_list is None:
+            posting_list = self.segment.get_posting_list(term)
+            self.posting_lists[term] = posting_list
+        else:
+            metrics.count("posting_list_cache_hits")
+        return posting_list
+
+    def doc_frequency(self, term: str) -> int:
+        return self.segment.doc_frequency(term)
+
+    def search_vocabulary(self, term: str, max_edits: int) -> list:
+        return self.segment.search_vocabulary(term, max_edits)
+
+    def do_one_word_query(self, term: str) -> list:
+        return [posting.doc_id for posting in self.get_posting_list(term).postings]
+
+    def do_phrase_query(self, terms: list) -> list:
+        posting_lists = [self.get_posting_list(term) for term in terms]
+        if not posting_lists or any(not posting_list.postings for posting_list in posting_lists):
+            return []
+        with metrics.timer("find_phrases"):
+            return [posting.doc_id for posting in PostingList.find_phrases(posting_lists).postings]
+
+    def do_proximity_query(self, terms: list, max_distance: int, ordered: bool = False) -> list:
+        posting_lists = [self.get_posting_list(term) for term in terms]
+        if any(not posting_list.postings for posting_list in posting_lists):
+            return []
+        with metrics.timer("find_near"):
+            near_postings = PostingList.find_near(posting_lists, max_distance, ordered).postings
+        return [posting.doc_id for posting in near_postings]
@@ -0,0 +1,85 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+'''
+
+import hashlib
+import math
+import os
+import struct
+
+_HEADER = struct.Struct("<QII")  # num_bits, num_hashes, count
+
+
+class BloomFilter:
+    '''
+    Set of strings that may answer "maybe" for strings that were never added (with probability about
+    false_positive_rate while the filter holds at most its capacity), but never answers "no" for added strings.
+    '''
+    def __init__(self, num_bits: int, num_hashes: int, bits: bytearray = None, count: int = 0):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+        self.count = count  # number of add() calls, to tell when the filter is full
+
+    @classmethod
+    def for_capacity(cls, capacity: int, false_positive_rate: float = 0.01):
+        '''
+        :param capacity: Number of strings the filter should hold.
+        :param false_positive_rate: Desired false positive rate at capacity.
+        :return: An empty BloomFilter of the optimal size.
+        '''
+        capacity = max(capacity, 64)
+        num_bits = int(math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        return cls(num_bits, num_hashes)
+
+    @property
+    def capacity(self) -> int:
+        return int(self.num_bits * math.log(2) / self.num_hashes)
+
+    def is_full(self) -> bool:
+        return self.count >= self.capacity
+
+    def _positions(self, key: str):
+        # double hashing: the ith bit is h1 + i * h2
+        h1, h2 = struct.unpack("<QQ", hashlib.md5(key.encode("utf-8")).digest())
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    @classmethod
+    def from_file(cls, filename: str):
+        '''
+        Reads in a filter written by save().
+        :param filename: str
+        :return: BloomFilter object, or None if the file does not exist.
+        '''
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as f:
+            num_bits, num_hashes, count = _HEADER.unpack(f.read(_HEADER.size))
+            return cls(num_bits, num_hashes, bytearray(f.read()), count)
+
+    def save(self, filename: str):
+        '''
+        Writes the filter to the given file, replacing it atomically.
+        :param filename: str
+        :return: None
+        '''
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, 'wb') as f:
+            f.write(_HEADER.pack(self.num_bits, self.num_hashes, self.count))
+            f.write(self.bits)
+        os.replace(tmp_filename, filename)
@@ -0,0 +1,146 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Near-duplicate detection with MinHash and locality sensitive hashing (LSH).
+A document is represented by its set of shingles (runs of SHINGLE_SIZE consecutive terms). The MinHash signature
+of a set holds, for each of num_perm hash functions, the smallest hash of any member; two documents agree on a
+signature entry with probability equal to the Jaccard similarity of their shingle sets. Signatures are cut into
+bands of rows entries, and documents sharing any whole band become candidates, which are then kept if the
+fraction of agreeing signature entries is at least the threshold.
+'''
+
+import os
+import random
+import struct
+import zlib
+from array import array
+from pickle import dump, load, HIGHEST_PROTOCOL
+from naive_dynamic_ix.posting_arrays import np
+
+SHINGLE_SIZE = 3
+_MASK = (1 << 64) - 1
+
+SKIP = "skip"  # duplicates are dropped
+LINK = "link"  # duplicates are not indexed, but remembered as duplicates of the original document
+ACTIONS = (SKIP, LINK)
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        '''
+        :param num_perm: Number of hash functions, i.e. the length of the signatures.
+        :param seed: Seed of the hash functions. Signatures are only comparable between equally seeded MinHashers.
+        '''
+        rand = random.Random(seed)
+        self.num_perm = num_perm
+        # multiply-shift hashing: h -> ((a * h + b) mod 2^64) >> 32, with a odd
+        self.perms = [(rand.getrandbits(64) | 1, rand.getrandbits(64)) for _ in range(num_perm)]
+        if np is not None:
+            self._a = np.array([a for a, b in self.perms], dtype=np.uint64)
+            self._b = np.array([b for a, b in self.perms], dtype=np.uint64)
+
+    def signature(self, terms: list, shingle_size: int = SHINGLE_SIZE) -> array:
+        '''
+        :param terms: List of the document's terms.
+        :param shingle_size: Number of consecutive terms per shingle; 1 to compare the sets of terms.
+        :return: MinHash signature of the document's shingles, as an array of num_perm unsigned ints.
+        '''
+        n = max(1, len(terms) - shingle_size + 1)
+        hashes = set(zlib.crc32(" ".join(terms[i:i + shingle_size]).encode("utf-8")) for i in range(n))
+        if np is not None:
+            # uint64 arithmetic wraps around, which is the mod 2^64
+            h = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+            mins = ((np.outer(self._a, h) + self._b[:, None]) >> np.uint64(32)).min(axis=1)
+            return array('I', mins.astype(np.uint32).tobytes())
+        return array('I', [min(((a * h + b) & _MASK) >> 32 for h in hashes) for a, b in self.perms])
+
+
+class Deduplicator:
+    '''
+    LSH table over the MinHash signatures of the documents indexed so far.
+    '''
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: int = 16, action: str = SKIP):
+        '''
+        :param threshold: Min estimated Jaccard similarity of the shingle sets of two near-duplicates.
+        :param num_perm: Length of the MinHash signatures.
+        :param bands: Number of LSH bands; must divide num_perm. More bands find more candidates at lower similarity.
+        :param action: SKIP or LINK.
+        '''
+        if num_perm % bands:
+            raise ValueError("bands must divide num_perm")
+        if action not in ACTIONS:
+            raise ValueError("Unknown action: " + repr(action))
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.action = action
+        self.hasher = MinHasher(num_perm)
+        self.buckets = {}  # band number + band bytes -> doc id of the first document with that band
+        self.signatures = {}  # doc id -> signature
+        self.links = {}  # doc id of a linked duplicate -> doc id of the original document
+
+    @classmethod
+    def from_file(cls, filename: str, threshold: float = 0.8, num_perm: int = 64, bands: int = 16,
+                  action: str = SKIP):
+        '''
+        Reads in an LSH table written by save(), or creates an empty one if the file does not exist.
+        The threshold and action can be changed between runs, the signature length and bands can not.
+        :return: Deduplicator object.
+        '''
+        dedup = cls(threshold, num_perm, bands, action)
+        if os.path.isfile(filename):
+            with open(filename, 'rb') as f:
+                saved_num_perm, saved_bands, dedup.buckets, dedup.signatures, dedup.links = load(f)
+            if (saved_num_perm, saved_bands) != (num_perm, bands):
+                raise ValueError("LSH table in " + filename + " was built with num_perm=" + str(saved_num_perm) +
+                                 " and bands=" + str(saved_bands))
+        return dedup
+
+    def save(self, filename: str):
+        '''
+        Writes the LSH table to the given file, replacing it atomically.
+        :param filename: str
+        :return: None
+        '''
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, 'wb') as f:
+            dump((self.hasher.num_perm, self.bands, self.buckets, self.signatures, self.links), f, HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+
+    def _band_keys(self, signature: array) -> list:
+        data = signature.tobytes()
+        width = self.rows * signature.itemsize
+        return [struct.pack("<H", i) + data[i * width:(i + 1) * width] for i in range(self.bands)]
+
+    def check(self, doc_id, terms: list):
+        '''
+        Looks for an earlier near-duplicate of a new document. If there is none, the document is added to the table.
+        If there is one and the action is LINK, the link is recorded.
+        :param doc_id: Doc id of the new document.
+        :param terms: List of the document's terms.
+        :return: Doc id of the original document, or None if the document is not a near-duplicate.
+        '''
+        signature = self.hasher.signature(terms)
+        band_keys = self._band_keys(signature)
+        for key in band_keys:
+            candidate = self.buckets.get(key)
+            if candidate is None or candidate == doc_id:
+                continue
+            other = self.signatures[candidate]
+            similarity = sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+            if similarity >= self.threshold:
+                if self.action == LINK:
+                    self.links[doc_id] = candidate
+                return candidate
+        for key in band_keys:
+            self.buckets.setdefault(key, doc_id)
+        self.signatures[doc_id] = signature
+        return None
+
+    def duplicates_of(self, doc_id) -> list:
+        '''
+        :return: Doc ids of the documents linked as duplicates of the given one.
+        '''
+        return [dup for dup, original in self.links.items() if original == doc_id]
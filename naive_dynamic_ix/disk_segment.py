@@ -4,23 +4,214 @@ Contact: andrewkchan@berkeley.edu
 License: MIT License
 '''
 
-import bsddb3
+import threading
+from heapq import nlargest
 from pickle import dumps, loads
 from naive_dynamic_ix.memory_segment import PostingList
+from naive_dynamic_ix.term_stats import TermStats
+from naive_dynamic_ix.bloom_filter import BloomFilter
+from naive_dynamic_ix.vocabulary import Vocabulary
+from naive_dynamic_ix.suggest import Suggester
+from naive_dynamic_ix.terms import is_plain_term, is_tier_key, tier_key
+from naive_dynamic_ix.storage import Storage, open_storage
+from naive_dynamic_ix import metrics
+
+TIER_THRESHOLD = 1024  # min number of postings of a posting list with a high-impact tier
+TIER_SIZE = 128  # number of postings in a high-impact tier
 
 class DiskSegment:
-    def __init__(self, bsddb):
-        self.index = bsddb
+    def __init__(self, storage: Storage, filename: str = None, read_only: bool = False,
+                 tier_threshold: int = TIER_THRESHOLD, tier_size: int = TIER_SIZE):
+        '''
+        :param storage: The open Storage holding the pickled posting lists by term.
+        :param filename: Filename of the database. The term stats are kept next to it, in "<filename>.stats",
+            a Bloom filter over the terms in "<filename>.bloom", a Vocabulary for fuzzy matching in "<filename>.vocab"
+            and a Suggester for type-ahead suggestions in "<filename>.suggest".
+        :param read_only: Whether the database was opened read-only, in which case nothing is written back on sync.
+        :param tier_threshold: Posting lists with at least this many postings also get a high-impact tier, see
+            get_impacts. None to write no tiers.
+        :param tier_size: Number of postings in a high-impact tier.
+        '''
+        self.index = storage
+        self.filename = filename
+        self.read_only = read_only
+        self.tier_threshold = tier_threshold
+        self.tier_size = tier_size
+        # serializes access to the database and the term dictionaries between queries and a background flush
+        self.lock = threading.RLock()
+        self._term_stats = None  # loaded on first use, most queries don't need it
+        self._bloom_filter = None
+        self._vocabulary = None
+        self._suggester = None
+        self._suggester_stale = False  # whether the suggester file is out of date, it is rebuilt on sync
+
+    @property
+    def term_stats(self) -> TermStats:
+        with self.lock:
+            return self._load_term_stats()
+
+    def _load_term_stats(self) -> TermStats:
+        if self._term_stats is None:
+            if self.filename is not None:
+                self._term_stats = TermStats.from_file(self.filename + ".stats")
+            if self._term_stats is None:
+                self._term_stats = self._scan_term_stats()
+        return self._term_stats
+
+    @property
+    def bloom_filter(self) -> BloomFilter:
+        if self._bloom_filter is not None:
+            return self._bloom_filter
+        with self.lock:
+            return self._load_bloom_filter()
+
+    def _load_bloom_filter(self) -> BloomFilter:
+        if self._bloom_filter is None:
+            if self.filename is not None:
+                self._bloom_filter = BloomFilter.from_file(self.filename + ".bloom")
+            if self._bloom_filter is None:
+                self._bloom_filter = self._build_bloom_filter()
+        return self._bloom_filter
+
+    @property
+    def vocabulary(self) -> Vocabulary:
+        with self.lock:
+            return self._load_vocabulary()
+
+    def _load_vocabulary(self) -> Vocabulary:
+        if self._vocabulary is None:
+            if self.filename is not None:
+                self._vocabulary = Vocabulary.from_file(self.filename + ".vocab")
+            if self._vocabulary is None:
+                self._vocabulary = Vocabulary()
+                for term in self.keys():
+                    if is_plain_term(term):
+                        self._vocabulary.add(term)
+        return self._vocabulary
+
+    def _load_suggester(self) -> Suggester:
+        if self._suggester is None:
+            if self.filename is not None and not self._suggester_stale:
+                self._suggester = Suggester.from_file(self.filename + ".suggest")
+            if self._suggester is None:
+                self._suggester = Suggester.build((term, stats[0]) for term, stats in self.term_stats.stats.items()
+                                                  if is_plain_term(term))
+                self._suggester_stale = True
+        return self._suggester
+
+    def _build_bloom_filter(self) -> BloomFilter:
+        '''
+        Builds a Bloom filter over the terms in the segment, with room for as many new terms.
+        '''
+        terms = self.keys()
+        bloom_filter = BloomFilter.for_capacity(2 * len(terms))
+        for term in terms:
+            bloom_filter.add(term)
+        return bloom_filter
 
     @classmethod
-    def from_file(cls, filename: str):
+    def from_file(cls, filename: str, read_only: bool = False, tier_threshold: int = TIER_THRESHOLD,
+                  expected_keys: int = None, backend: str = None):
         '''
         Reads in an index file to create a new disk segment, or creates the file if it does not exist.
         :param filename: str - the filename of the index.
+        :param read_only: Open an existing file read-only, e.g. a file of a snapshot.
+        :param tier_threshold: Min number of postings of the posting lists that get a high-impact tier.
+        :param expected_keys: Number of keys a new file will hold, to size its hash table up front.
+        :param backend: Storage backend of a new file, see naive_dynamic_ix.storage.open_storage.
         :return: DiskSegment object.
         '''
-        bsddb = bsddb3.hashopen(filename, 'c')
-        return cls(bsddb)
+        return cls(open_storage(filename, read_only, backend, expected_keys), filename, read_only, tier_threshold)
+
+    def _scan_term_stats(self) -> TermStats:
+        '''
+        Rebuilds the term stats by reading every posting list. Only needed for segments written without a stats file.
+        '''
+        term_stats = TermStats()
+        for term in self.keys():
+            if is_tier_key(term):
+                continue
+            value = self.index[term]
+            posting_list = loads(value)
+            term_stats.set(term, len(posting_list.postings),
+                           sum(len(posting.positions) for posting in posting_list.postings), len(value))
+        return term_stats
+
+    def _read_posting_list(self, term: str):
+        '''
+        Reads and unpickles the posting list of the term.
+        :param term: str
+        :return: PostingList, or None if the term is not in the index.
+        '''
+        if term not in self.bloom_filter:
+            metrics.count("bloom_filter_negatives")
+            return None
+        with metrics.timer("disk_segment.lookup"), self.lock:
+            try:
+                value = self.index[term]
+            except KeyError:
+                return None
+        with metrics.timer("disk_segment.unpickle"):
+            posting_list = loads(value)
+        metrics.count("bytes_read", len(value))
+        metrics.count("postings_decoded", len(posting_list.postings))
+        return posting_list
+
+    def get_posting_list(self, term: str) -> PostingList:
+        '''
+        :param term: str
+        :return: The PostingList of the term, or an empty PostingList if the term is not in the index.
+        '''
+        return self._read_posting_list(term) or PostingList()
+
+    def doc_frequency(self, term: str) -> int:
+        '''
+        :param term: str
+        :return: Number of documents containing the term.
+        '''
+        return self.term_stats.doc_frequency(term)
+
+    def search_vocabulary(self, term: str, max_edits: int) -> list:
+        '''
+        :return: List of (distance, term) pairs for the terms within max_edits edits of the given term, see
+            Vocabulary.search.
+        '''
+        with self.lock:
+            return self.vocabulary.search(term, max_edits)
+
+    def suggest(self, prefix: str, k: int = 10) -> list:
+        '''
+        :return: List of (term, document frequency) pairs of the k most frequent terms starting with the prefix,
+            see Suggester.suggest.
+        '''
+        with self.lock:
+            return self._load_suggester().suggest(prefix, k)
+
+    def get_impacts(self, term: str, tiered: bool = True) -> tuple:
+        '''
+        Reads the (doc_id, impact) pairs of a term's postings, the impact being the term frequency in the document.
+        Long posting lists also have a high-impact tier: a copy of the doc ids and impacts of their tier_size postings
+        with the highest impact, stored apart from the full list. If tiered and the term has an up to date tier,
+        only the tier is read, and the other postings' impacts are bounded by the returned max.
+        :param term: str
+        :param tiered: Read the high-impact tier if there is one.
+        :return: (list of (doc_id, impact) pairs, max impact of the postings that are not in the list)
+        '''
+        key = tier_key(term)
+        if tiered and key in self.bloom_filter:
+            with metrics.timer("disk_segment.lookup"), self.lock:
+                try:
+                    value = self.index[key]
+                except KeyError:
+                    value = None
+            if value is not None:
+                doc_frequency, max_tail_impact, impacts = loads(value)
+                # skip a tier left behind by a merge that did not rewrite it, e.g. with a higher tier_threshold
+                if doc_frequency == self.doc_frequency(term):
+                    metrics.count("bytes_read", len(value))
+                    metrics.count("postings_decoded", len(impacts))
+                    return impacts, max_tail_impact
+        return self.get_posting_list(term).impacts(), 0
 
     def do_one_word_query(self, term: str) -> list:
         '''
@@ -28,12 +219,10 @@ class DiskSegment:
         :param term: str
         :return: List of matching doc ids.
         '''
-        try:
-            posting_list = loads(self.index[dumps(term)])
-            doc_ids = [posting.doc_id for posting in posting_list.postings]
-            return doc_ids
-        except KeyError:
+        posting_list = self._read_posting_list(term)
+        if posting_list is None:
             return []
+        return [posting.doc_id for posting in posting_list.postings]
 
     def do_phrase_query(self, terms: list) -> list:
         '''
@@ -41,26 +230,59 @@ class DiskSegment:
         :param terms: List of strings representing the exact phrase in order.
         :return: List of matching doc ids.
         '''
-        posting_lists = [loads(self.index[dumps(t)]) if self.has_key(t) else PostingList()
-                         for t in terms]
-        result_pl = PostingList.find_phrases(posting_lists)
+        if not all(t in self.bloom_filter for t in terms):
+            return []
+        posting_lists = [self.get_posting_list(t) for t in terms]
+        with metrics.timer("find_phrases"):
+            result_pl = PostingList.find_phrases(posting_lists)
         doc_ids = [posting.doc_id for posting in result_pl.postings]
         return doc_ids
 
+    def do_proximity_query(self, terms: list, max_distance: int, ordered: bool = False) -> list:
+        '''
+        Executes a proximity query on the index: finds documents where all the terms occur within max_distance
+        positions of each other (in order, if ordered).
+        :param terms: List of strings.
+        :param max_distance: int
+        :param ordered: Whether the terms must occur in the given order.
+        :return: List of matching doc ids.
+        '''
+        # don't load any posting list unless every term may be present.
+        if not all(t in self.bloom_filter for t in terms):
+            return []
+        posting_lists = [self._read_posting_list(t) for t in terms]
+        if None in posting_lists:
+            return []
+        with metrics.timer("find_near"):
+            result_pl = PostingList.find_near(posting_lists, max_distance, ordered)
+        return [posting.doc_id for posting in result_pl.postings]
+
     def has_key(self, term: str):
         '''
         :param term: The term to search for the index
         :return: term is in the index or not.
         '''
-        return self.index.has_key(dumps(term))
+        if term not in self.bloom_filter:
+            return False
+        with self.lock:
+            return self.index.has_key(term)
+
+    def keys(self) -> list:
+        '''
+        :return: List of the keys in the disk segment: the terms, and the tier keys of their high-impact tiers.
+        '''
+        with self.lock:
+            return self.index.keys()
 
-    def keys(self):
+    def scan(self, start: str = None, stop: str = None) -> list:
         '''
-        Supplies a generator over the keys in the disk segment.
-        Note that all keys are pickled and must be loaded().
-        :return: A generator over the index's keys.
+        :param start: First key of the range, or None to start at the smallest key.
+        :param stop: Key the range stops before, or None to go to the largest key.
+        :return: List of the (key, pickled value) pairs of the keys in the range, in key order. Cheap on SQLite
+            files, whose keys are stored sorted; Berkeley DB hash files sort all the keys first.
         '''
-        return self.index.keys()
+        with self.lock:
+            return list(self.index.range(start, stop))
 
     def merge_posting_list(self, term: str, posting_list: PostingList):
         '''
@@ -69,9 +291,86 @@ class DiskSegment:
         :param posting_list: PostingList
         :return: None
         '''
-        if self.has_key(term):
-            disk_pl = loads(self.index[dumps(term)])
-            merged_pl = PostingList.merge_lists(disk_pl, posting_list)
-            self.index[dumps(term)] = dumps(merged_pl)
-        else:
-            self.index[dumps(term)] = dumps(posting_list)
\ No newline at end of file
+        disk_pl = self._read_posting_list(term)
+        if disk_pl is not None:
+            posting_list = PostingList.merge_lists(disk_pl, posting_list)
+        value = dumps(posting_list)
+        with self.lock:
+            if disk_pl is None:
+                self._add_key(term)
+                if is_plain_term(term):
+                    self.vocabulary.add(term)
+            self.index[term] = value
+            self.term_stats.set(term, len(posting_list.postings),
+                                sum(len(posting.positions) for posting in posting_list.postings), len(value))
+            if is_plain_term(term):
+                self._suggester = None
+                self._suggester_stale = True
+            if self.tier_threshold is not None and len(posting_list.postings) >= self.tier_threshold:
+                self._write_tier(term, posting_list)
+
+    def _add_key(self, key: str):
+        '''
+        Adds a new key to the Bloom filter, rebuilding it first if it is full.
+        '''
+        if self.bloom_filter.is_full():
+            self._bloom_filter = self._build_bloom_filter()
+        self._bloom_filter.add(key)
+
+    def _write_tier(self, term: str, posting_list: PostingList):
+        '''
+        Writes the high-impact tier of a posting list: (number of postings, max impact of the postings left out,
+        list of (doc_id, impact) pairs of the tier_size postings with the highest impact, highest first).
+        '''
+        top = nlargest(self.tier_size + 1, posting_list.postings, key=lambda posting: len(posting.positions))
+        impacts = [(posting.doc_id, len(posting.positions)) for posting in top[:self.tier_size]]
+        max_tail_impact = len(top[self.tier_size].positions) if len(top) > self.tier_size else 0
+        key = tier_key(term)
+        if key not in self.bloom_filter:
+            self._add_key(key)
+        self.index[key] = dumps((len(posting_list.postings), max_tail_impact, impacts))
+
+    def adopt_sidecars(self, source):
+        '''
+        Takes over the term stats, vocabulary and suggester of a segment with the same terms, e.g. the segment this
+        one was copied from key by key, and rebuilds the Bloom filter over this segment's keys. All of them are
+        written out on the next sync.
+        :param source: DiskSegment
+        :return: None
+        '''
+        with self.lock:
+            self._term_stats = source.term_stats
+            self._vocabulary = source.vocabulary
+            with source.lock:
+                self._suggester = source._load_suggester()
+            self._suggester_stale = True
+            self._bloom_filter = self._build_bloom_filter()
+
+    def sync(self):
+        '''
+        Flushes the database, the term stats, the Bloom filter and the vocabulary to disk, and rebuilds the
+        suggester if terms were added.
+        :return: None
+        '''
+        if self.read_only:
+            return
+        with self.lock:
+            self.index.sync()
+            if self.filename is not None and self._term_stats is not None:
+                self._term_stats.save(self.filename + ".stats")
+            if self.filename is not None and self._bloom_filter is not None:
+                self._bloom_filter.save(self.filename + ".bloom")
+            if self.filename is not None and self._vocabulary is not None:
+                self._vocabulary.save(self.filename + ".vocab")
+            if self.filename is not None and self._suggester_stale:
+                self._load_suggester().save(self.filename + ".suggest")
+                self._suggester_stale = False
+
+    def close(self):
+        '''
+        Flushes and closes the underlying database file.
+        :return: None
+        '''
+        with self.lock:
+            self.sync()
+            self.index.close()
\ No newline at end of file
@@ -0,0 +1,69 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+'''
+
+import os
+from pickle import dump, load, HIGHEST_PROTOCOL
+
+
+class DocMap:
+    '''
+    Mapping between the doc ids of the documents and the internal doc ordinals (0, 1, 2, ...) that the segments and
+    the document store of a reordered index (see naive_dynamic_ix.reorder) use in their place.
+    Documents added after the reordering get the next ordinals.
+    '''
+    def __init__(self, doc_ids: list = None):
+        self.doc_ids = doc_ids if doc_ids else []  # ordinal -> doc id
+        self.ordinals = {doc_id: ordinal for ordinal, doc_id in enumerate(self.doc_ids)}
+        self.dirty = False  # whether ordinals were assigned since the map was loaded or saved
+
+    @classmethod
+    def from_file(cls, filename: str):
+        '''
+        Reads in a doc map file written by save().
+        :param filename: str
+        :return: DocMap object, or None if the file does not exist.
+        '''
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as f:
+            return cls(load(f))
+
+    def save(self, filename: str):
+        '''
+        Writes the doc map to the given file, replacing it atomically.
+        :param filename: str
+        :return: None
+        '''
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, 'wb') as f:
+            dump(self.doc_ids, f, HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+        self.dirty = False
+
+    def assign(self, doc_id) -> int:
+        '''
+        :param doc_id: Doc id of a document being added.
+        :return: Ordinal of the document, a new one if it has none yet.
+        '''
+        ordinal = self.ordinals.get(doc_id)
+        if ordinal is None:
+            ordinal = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+            self.ordinals[doc_id] = ordinal
+            self.dirty = True
+        return ordinal
+
+    def ordinal(self, doc_id) -> int:
+        '''
+        Raises a KeyError if the document is not in the map.
+        '''
+        return self.ordinals[doc_id]
+
+    def doc_id(self, ordinal: int):
+        return self.doc_ids[ordinal]
+
+    def __len__(self):
+        return len(self.doc_ids)
@@ -4,36 +4,37 @@ Contact: andrewkchan@berkeley.edu
 License: MIT License
 '''
 
-import bsddb3
 from pickle import dumps, loads
+from naive_dynamic_ix.storage import Storage, open_storage
+from naive_dynamic_ix import metrics
 
 
 class DocumentStore:
-    def __init__(self, bsddb):
-        self.repo = bsddb
+    def __init__(self, storage: Storage):
+        self.repo = storage
 
     @classmethod
-    def from_file(cls, filename: str):
+    def from_file(cls, filename: str, read_only: bool = False, expected_keys: int = None, backend: str = None):
         '''
         Reads in a repository file to create a new document store, or creates the file if it does not exist.
         :param filename: str - the filename of the index.
+        :param read_only: Open an existing file read-only, e.g. a file of a snapshot.
+        :param expected_keys: Number of documents a new file will hold, to size its hash table up front.
+        :param backend: Storage backend of a new file, see naive_dynamic_ix.storage.open_storage.
         :return: DocumentStore object.
         '''
-        bsddb = bsddb3.hashopen(filename, 'c')
-        return cls(bsddb)
+        return cls(open_storage(filename, read_only, backend, expected_keys))
 
     def has_key(self, doc_id):
         '''
         :param doc_id: The document id to search for in the repository
         :return: document is in the repository or not.
         '''
-        return self.repo.has_key(dumps(doc_id))
+        return self.repo.has_key(doc_id)
 
-    def keys(self):
+    def keys(self) -> list:
         '''
-        Supplies a generator over the keys in the document store repository.
-        Note that all keys are pickled and must be loaded().
-        :return: A generator over the repository's keys.
+        :return: List of the doc ids in the document store repository.
         '''
         return self.repo.keys()
 
@@ -45,7 +46,7 @@ class DocumentStore:
         :param doc_body: String content of the document
         :return:
         '''
-        self.repo[dumps(doc_id)] = dumps((doc_title, doc_body))
+        self.repo[doc_id] = dumps((doc_title, doc_body))
 
     def get_document(self, doc_id):
         '''
@@ -54,4 +55,78 @@ class DocumentStore:
         :param doc_id: ID of the document to retrieve.
         :return: (doc_title, doc_body)
         '''
-        return loads(self.repo[dumps(doc_id)])
+        with metrics.timer("docstore.get_document"):
+            value = self.repo[doc_id]
+        metrics.count("documents_fetched")
+        metrics.count("docstore_bytes_read", len(value))
+        return loads(value)
+
+    def iter_documents(self):
+        '''
+        :return: Iterator over the (doc_id, (doc_title, doc_body)) of every document, read one at a time.
+        '''
+        for doc_id, value in self.repo.range():
+            yield doc_id, loads(value)
+
+    def get_documents(self, doc_ids: list) -> dict:
+        '''
+        Fetches many documents in one batch read from the repository.
+        :param doc_ids: List of document ids.
+        :return: Dict of doc id to (doc_title, doc_body) of the documents that are in the repository.
+        '''
+        with metrics.timer("docstore.get_documents"):
+            values = self.repo.get_many(doc_ids)
+        metrics.count("documents_fetched", len(values))
+        metrics.count("docstore_bytes_read", sum(len(value) for value in values.values()))
+        return {doc_id: loads(value) for doc_id, value in values.items()}
+
+    def sync(self):
+        '''
+        Flushes the database to disk.
+        :return: None
+        '''
+        self.repo.sync()
+
+    def close(self):
+        '''
+        Flushes and closes the underlying database file.
+        :return: None
+        '''
+        self.repo.close()
+
+
+class MemoryDocumentStore:
+    '''
+    Document store of a RAM-only index, with the same interface as DocumentStore, backed by a dict.
+    '''
+    def __init__(self, documents: dict = None):
+        self.documents = documents if documents is not None else {}  # doc id -> (doc_title, doc_body)
+
+    def has_key(self, doc_id):
+        return doc_id in self.documents
+
+    def keys(self) -> list:
+        return list(self.documents)
+
+    def add_document(self, doc_id, doc_title, doc_body):
+        self.documents[doc_id] = (doc_title, doc_body)
+
+    def get_document(self, doc_id):
+        '''
+        Returns a tuple (doc_title, doc_str) of the document given by doc_id,
+        or raises a KeyError if the document is not in the store.
+        '''
+        doc = self.documents[doc_id]
+        metrics.count("documents_fetched")
+        return doc
+
+    def get_documents(self, doc_ids: list) -> dict:
+        documents = {doc_id: self.documents[doc_id] for doc_id in doc_ids if doc_id in self.documents}
+        metrics.count("documents_fetched", len(documents))
+        return documents
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
@@ -4,101 +4,972 @@ Contact: andrewkchan@berkeley.edu
 License: MIT License
 '''
 
-from naive_dynamic_ix.memory_segment import MemorySegment
-from naive_dynamic_ix.disk_segment import DiskSegment
-from naive_dynamic_ix.docstore import DocumentStore
+from naive_dynamic_ix.memory_segment import MemorySegment, PostingList
+from naive_dynamic_ix.disk_segment import DiskSegment, TIER_THRESHOLD
+from naive_dynamic_ix.docstore import DocumentStore, MemoryDocumentStore
 from naive_dynamic_ix.results import Results
+from naive_dynamic_ix.query import QueryPlanner
+from naive_dynamic_ix.manifest import Manifest, ANALYZER
+from naive_dynamic_ix.doc_map import DocMap
+from naive_dynamic_ix.terms import TEXT, TITLE, field_key, bigram_key
+from naive_dynamic_ix.dedup import Deduplicator, SKIP
+from naive_dynamic_ix.wal import WriteAheadLog
+from naive_dynamic_ix.suggest import CACHE_K
+from naive_dynamic_ix.batch import CachedSegment, FREE_TEXT, QUERY_TYPES
+from naive_dynamic_ix import ram_file
+from naive_dynamic_ix import metrics
 from porter_stemmer import PorterStemmer
+from collections import Counter
+from itertools import chain
+import math
+import os
 import re
+import threading
+
+STOPWORDS_FILENAME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "stopwords.dat")
+
+
+def load_stopwords(filename: str = STOPWORDS_FILENAME) -> set:
+    '''
+    :param filename: File with one stopword per line. Defaults to the stopwords.dat shipped with the repository.
+    :return: Set of stopwords.
+    '''
+    with open(filename, 'r') as f:
+        return set(line.rstrip() for line in f)
+
 
 class Index:
     '''
     Global index with underlying main inverted index on disk and auxiliary inverted index in memory.
+    The disk segment, document store and stemmer are only opened on first use, so opening an index is cheap.
+    When the memory segment is full it is frozen and merged into the disk segment on a background thread, while a
+    fresh memory segment takes new documents; queries search the frozen segment until the merge is durable.
+    Documents in the memory segments are recorded in a write-ahead log, which is replayed when the index is opened
+    after a crash.
+    A read-only index serves an immutable snapshot (see naive_dynamic_ix.snapshot): its files are opened read-only,
+    and the delta segments shipped by incremental snapshots are searched along with the main disk segment.
+    A RAM-only index (see Index.in_memory) keeps everything in the memory segment and a dict of documents, and does
+    not need Berkeley DB. Neither do indexes whose files use the SQLite storage backend, see naive_dynamic_ix.storage.
+    The segments and document store of an index reordered by naive_dynamic_ix.reorder hold internal doc ordinals
+    instead of doc ids; they are translated back with its DocMap when results are returned.
     '''
-    def __init__(self, ix_filename, repo_filename):
+    def __init__(self, ix_filename, repo_filename, stopwords=None, wal: bool = True, read_only: bool = False,
+                 doc_map: DocMap = None):
         '''
         Creates an index and document store with the given filenames.
         :param ix_filename: Filename to store the disk part of the index.
         :param repo_filename: Filename to store the on-disk document store.
+        :param stopwords: Iterable of stopwords. Defaults to the words in stopwords.dat.
+        :param wal: Whether to log added documents to "<ix_filename>.wal.<generation>" until they are saved.
+        :param read_only: Open existing files read-only and refuse new documents. Implies no write-ahead log.
+        :param doc_map: DocMap of a reordered index, or None if the documents are stored under their doc ids.
         '''
-        self.docstore = DocumentStore.from_file(repo_filename)
-        self.disk_segment = DiskSegment.from_file(ix_filename)
+        self.ix_filename = ix_filename
+        self.repo_filename = repo_filename
         self.memory_segment = MemorySegment()
-        self.porter = PorterStemmer()
+        self.frozen_segment = None # full memory segment being merged into the disk segment
         self.memory_limit = 512000000 # arbitrary memory limit in bytes before writing index to disk
+        self.background_flush = True # merge full memory segments on a background thread instead of in add_document
+        self.tier_threshold = TIER_THRESHOLD # min postings of a disk posting list with a high-impact tier, or None
+        self.doc_count = 0 # number of documents added, including the ones recorded in the manifest
+        self.directory = None # index directory, for indexes opened with Index.open
+        self.manifest = None
+        self.deduplicator = None # near-duplicate detection at ingest, see enable_dedup
+        self.read_only = read_only
+        self.delta_filenames = [] # (segment filename, docstore filename) of the delta segments, oldest first
+        self.ram_only = False # no disk segment, see Index.in_memory
+        self.ram_filename = None # file a RAM-only index is saved to, or None
+        self.doc_map = doc_map
+        self.storage = None # storage backend of new segment and document store files, or None for the default
+        self._docstore = None
+        self._disk_segment = None
+        self._delta_segments = None
+        self._porter = None
+        self._stopwords = set(stopwords) if stopwords is not None else None
+        self._flush_thread = None
+        self._flush_error = None # exception of a failed background flush, raised by the next commit or save
+        self.wal = None
+        if wal and not read_only:
+            self._start_wal()
 
-        with open("stopwords.dat", 'r') as f:
-            stopwords = [line.rstrip() for line in f]
-            self.stopwords = set(stopwords)
+    @classmethod
+    def open(cls, directory: str, read_only: bool = False, storage: str = None):
+        '''
+        Opens the index in the given directory, creating it if needed. Only the manifest is read here;
+        the segment and document store files are opened when first used.
+        :param directory: str
+        :param read_only: Open an existing index, e.g. a snapshot, read-only.
+        :param storage: Storage backend of a new index (naive_dynamic_ix.storage.BSDDB or SQLITE), or None for the
+            default one. An existing index keeps its backend; naive_dynamic_ix.optimize converts it.
+        :return: Index object.
+        '''
+        manifest = Manifest.load(directory)
+        if manifest is None:
+            if read_only:
+                raise ValueError("No index in " + directory)
+            os.makedirs(directory, exist_ok=True)
+            manifest = Manifest.create(load_stopwords(), storage)
+            manifest.save(directory)
+        elif storage is not None and storage != manifest.storage:
+            raise ValueError("Index in " + directory + " uses the " + manifest.storage + " storage backend, not " +
+                             storage)
+        doc_map = None
+        if manifest.doc_map is not None:
+            doc_map = DocMap.from_file(os.path.join(directory, manifest.doc_map))
+            if doc_map is None:
+                raise ValueError("Missing doc map file: " + os.path.join(directory, manifest.doc_map))
+        # the log is replayed once the index has the state of the manifest, which the replayed documents add to
+        ix = cls(os.path.join(directory, manifest.segments[0]["file"]), os.path.join(directory, manifest.docstore),
+                 stopwords=manifest.stopwords, wal=False, read_only=read_only, doc_map=doc_map)
+        ix.directory = directory
+        ix.manifest = manifest
+        ix.storage = manifest.storage
+        ix.doc_count = manifest.doc_count
+        ix.delta_filenames = [(os.path.join(directory, segment["file"]), os.path.join(directory, segment["docstore"]))
+                              for segment in manifest.segments[1:]]
+        if not read_only:
+            ix._start_wal()
+        if manifest.snapshot_wal_generation is not None:
+            ix.archive_wal()
+        return ix
+
+    @classmethod
+    def in_memory(cls, filename: str = None, stopwords=None):
+        '''
+        Creates a RAM-only index, with the same query API, whose postings and documents are only kept in memory.
+        save() writes the whole index to a single file in one sequential write (see naive_dynamic_ix.ram_file),
+        and it is read back in one sequential read here. Meant for small corpora and tests.
+        :param filename: File to load the index from, if it exists, and to save it to. None to never save it.
+        :param stopwords: Iterable of stopwords for a new index. Defaults to the words in stopwords.dat. An index
+            loaded from a file keeps the stopwords it was built with.
+        :return: Index object.
+        '''
+        ix = cls(None, None, stopwords, wal=False)
+        ix.ram_only = True
+        ix.ram_filename = filename
+        ix.memory_limit = math.inf
+        ix._docstore = MemoryDocumentStore()
+        if filename is not None and os.path.isfile(filename):
+            settings, ix.memory_segment, documents = ram_file.load(filename)
+            if settings["analyzer"] != ANALYZER:
+                raise ValueError("Index in " + filename + " was built with a different analyzer: " +
+                                 str(settings["analyzer"]))
+            ix._stopwords = set(settings["stopwords"])
+            ix._docstore = MemoryDocumentStore(documents)
+            ix.doc_count = len(documents)
+        return ix
+
+    @property
+    def docstore(self) -> DocumentStore:
+        if self._docstore is None:
+            self._docstore = DocumentStore.from_file(self.repo_filename, self.read_only, backend=self.storage)
+        return self._docstore
+
+    @property
+    def disk_segment(self) -> DiskSegment:
+        if self._disk_segment is None:
+            self._disk_segment = DiskSegment.from_file(self.ix_filename, self.read_only, self.tier_threshold,
+                                                       backend=self.storage)
+        return self._disk_segment
+
+    @property
+    def delta_segments(self) -> list:
+        '''
+        :return: List of (DiskSegment, DocumentStore) of the delta segments, oldest first. They are opened read-only.
+        '''
+        if self._delta_segments is None:
+            self._delta_segments = [(DiskSegment.from_file(segment_filename, read_only=True),
+                                     DocumentStore.from_file(docstore_filename, read_only=True))
+                                    for segment_filename, docstore_filename in self.delta_filenames]
+        return self._delta_segments
+
+    @property
+    def porter(self) -> PorterStemmer:
+        if self._porter is None:
+            self._porter = PorterStemmer()
+        return self._porter
+
+    @property
+    def stopwords(self) -> set:
+        if self._stopwords is None:
+            self._stopwords = load_stopwords()
+        return self._stopwords
+
+    def segments(self) -> list:
+        '''
+        :return: The segments to search, newest first: the memory segment, the frozen segment if a flush is in
+            progress, the delta segments if any, and the disk segment. Only the memory segment for a RAM-only index.
+        '''
+        if self.ram_only:
+            return [self.memory_segment]
+        segments = [self.memory_segment]
+        frozen_segment = self.frozen_segment
+        if frozen_segment is not None:
+            segments.append(frozen_segment)
+        segments.extend(segment for segment, docstore in reversed(self.delta_segments))
+        segments.append(self.disk_segment)
+        return segments
+
+    def newer_doc_ids(self, segments: list) -> list:
+        '''
+        A document is only taken from the newest segment that has it: while a background flush is in progress, the
+        postings merged so far are in both the frozen segment and the disk segment, and only the frozen segment has
+        all of them, so scoring or negating on the disk segment's copy would be wrong.
+        :param segments: The segments to search, newest first, see segments(). Possibly CachedSegments.
+        :return: For each segment, the list of the doc id sets of the memory segments newer than it.
+        '''
+        newer = []
+        doc_id_sets = []
+        for segment in segments:
+            newer.append(list(doc_id_sets))
+            if isinstance(segment, CachedSegment):
+                segment = segment.segment
+            if isinstance(segment, MemorySegment) and segment.doc_ids:
+                doc_id_sets.append(segment.doc_ids)
+        return newer
+
+    def _timer_name(self, segment) -> str:
+        if isinstance(segment, CachedSegment):
+            segment = segment.segment
+        return "disk_segment" if isinstance(segment, DiskSegment) else "memory_segment"
+
+    def get_document(self, doc_id) -> tuple:
+        '''
+        Looks up a document in the document store, then in the document stores of the delta segments.
+        Raises a KeyError if the document is in none of them.
+        :param doc_id: ID of the document to retrieve.
+        :return: (doc_title, doc_body)
+        '''
+        if self.doc_map is not None:
+            doc_id = self.doc_map.ordinal(doc_id)
+        return self._fetch_document(doc_id)
+
+    def _fetch_document(self, doc_id) -> tuple:
+        '''
+        :param doc_id: Doc id of the document, as stored: its ordinal if the index was reordered.
+        :return: (doc_title, doc_body)
+        '''
+        try:
+            return self.docstore.get_document(doc_id)
+        except KeyError:
+            for segment, docstore in self.delta_segments:
+                if docstore.has_key(doc_id):
+                    return docstore.get_document(doc_id)
+            raise
+
+    def _fetch_documents(self, doc_ids: list) -> dict:
+        '''
+        Fetches many documents with one batch read per document store.
+        Raises a KeyError if a document is in none of them.
+        :param doc_ids: Doc ids of the documents, as stored.
+        :return: Dict of doc id to (doc_title, doc_body).
+        '''
+        documents = self.docstore.get_documents(doc_ids)
+        for segment, docstore in self.delta_segments:
+            if len(documents) == len(doc_ids):
+                break
+            documents.update(docstore.get_documents([doc_id for doc_id in doc_ids if doc_id not in documents]))
+        for doc_id in doc_ids:
+            if doc_id not in documents:
+                raise KeyError(doc_id)
+        return documents
 
     def preprocess_term(self, term):
         term = term.lower()
         term = re.sub(r'[^a-z0-9 ]', '', term) # strip non-alphanumeric characters
         return self.porter.stem(term, 0, len(term) - 1)
 
-    def extract_terms(self, doc_str) -> list:
+    def tokenize(self, doc_str) -> list:
         doc_str = doc_str.lower()
         doc_str = re.sub(r'[^a-z0-9 ]', ' ', doc_str) # replace non-alphanumeric characters with whitespace
-        terms = doc_str.split()
+        return doc_str.split()
+
+    def normalize_tokens(self, tokens: list) -> list:
+        '''
+        :param tokens: List of tokens from tokenize().
+        :return: List of the tokens with every word but the stopwords stemmed.
+        '''
+        stopwords = self.stopwords
+        return [t if t in stopwords else self.porter.stem(t, 0, len(t) - 1) for t in tokens]
+
+    def extract_terms(self, doc_str) -> list:
+        terms = self.tokenize(doc_str)
         terms = [t for t in terms if t not in self.stopwords]
         return [self.porter.stem(word, 0, len(word) - 1) for word in terms]  # return stemmed words
 
+    def extract_bigrams(self, tokens: list, words: list) -> list:
+        '''
+        :param tokens: List of tokens from tokenize().
+        :param words: normalize_tokens(tokens)
+        :return: List of (bigram key, position) for the adjacent pairs of tokens that contain a stopword.
+            Positions count stopwords too.
+        '''
+        stopwords = self.stopwords
+        return [(bigram_key(words[i], words[i + 1]), i) for i in range(len(tokens) - 1)
+                if tokens[i] in stopwords or tokens[i + 1] in stopwords]
+
+    def enable_dedup(self, threshold: float = 0.8, action: str = SKIP, num_perm: int = 64, bands: int = 16):
+        '''
+        Turns on near-duplicate detection at ingest: documents whose terms are near-duplicates of an already indexed
+        document are neither stored nor indexed. The LSH table is kept in "<ix_filename>.lsh", or in
+        "<filename>.lsh" for a RAM-only index saved to a file.
+        :param threshold: Min estimated Jaccard similarity of the word 3-grams of near-duplicates.
+        :param action: naive_dynamic_ix.dedup.SKIP to drop near-duplicates, or LINK to also remember them as
+            duplicates of the original (see duplicates_of).
+        :param num_perm: Length of the MinHash signatures. Fixed once the LSH table is created.
+        :param bands: Number of LSH bands. Fixed once the LSH table is created.
+        :return: None
+        '''
+        lsh_filename = self._lsh_filename()
+        if lsh_filename is None:
+            self.deduplicator = Deduplicator(threshold, num_perm, bands, action)
+        else:
+            self.deduplicator = Deduplicator.from_file(lsh_filename, threshold, num_perm, bands, action)
+
+    def _lsh_filename(self) -> str:
+        if self.ram_only:
+            return self.ram_filename + ".lsh" if self.ram_filename is not None else None
+        return self.ix_filename + ".lsh"
+
+    def duplicates_of(self, doc_id) -> list:
+        '''
+        :param doc_id: Doc id of an indexed document.
+        :return: Doc ids of the near-duplicates linked to the document at ingest.
+        '''
+        return self.deduplicator.duplicates_of(doc_id) if self.deduplicator is not None else []
+
+    def archive_wal(self):
+        '''
+        Keeps the write-ahead log generations whose documents are saved in "<ix_filename>.wal-archive.<generation>"
+        instead of deleting them, until they are shipped by an incremental snapshot.
+        :return: None
+        '''
+        if self.wal is not None:
+            self.wal.archive_prefix = self.ix_filename + ".wal-archive"
+            # number new generations after the archived ones and the last snapshotted one, whose files may be gone
+            self.wal.generation = max(self.wal.generation, WriteAheadLog(self.wal.archive_prefix).generation)
+            if self.manifest is not None and self.manifest.snapshot_wal_generation is not None:
+                self.wal.generation = max(self.wal.generation, self.manifest.snapshot_wal_generation + 1)
+
+    def logged_documents(self, after: int) -> tuple:
+        '''
+        Closes the current write-ahead log generation and reads back the documents logged in the later generations,
+        from the archive (see archive_wal) and then from the live log. Waits for a background flush in progress.
+        :param after: Generation to start after.
+        :return: (last generation read, generator of (doc_id, doc_title, doc_body))
+        '''
+        if self.wal is None or self.wal.archive_prefix is None:
+            raise ValueError("The index does not archive its write-ahead log")
+        self._wait_for_flush()
+        generation = self._seal_wal()
+        archive = WriteAheadLog(self.wal.archive_prefix)
+        return generation, chain(archive.replay(after), self.wal.replay(after))
+
+    def _start_wal(self):
+        '''
+        Opens the write-ahead log in "<ix_filename>.wal.<generation>" and replays it.
+        :return: None
+        '''
+        self.wal = WriteAheadLog(self.ix_filename + ".wal")
+        self._replay_wal()
+
+    def _replay_wal(self):
+        '''
+        Adds the documents of the write-ahead log that were not saved before the index was last closed.
+        :return: None
+        '''
+        for doc_id, doc_title, doc_body in self.wal.replay():
+            self._index_document(doc_id, doc_title, doc_body, log=False)
+
     def add_document(self, doc_id, doc_title, doc_body):
+        '''
+        Stores and indexes a document.
+        :return: Doc id of the document it is a near-duplicate of, if dedup is enabled and it was not indexed,
+            or None.
+        '''
+        if self.read_only:
+            raise ValueError("Cannot add documents to a read-only index")
+        original = self._index_document(doc_id, doc_title, doc_body)
+        if not self.ram_only and self.memory_segment.get_size() >= self.memory_limit:
+            if self.background_flush:
+                self._flush_in_background()
+            else:
+                self.save()
+        return original
+
+    def _index_document(self, doc_id, doc_title, doc_body, log: bool = True):
+        '''
+        Stores a document and adds it to the memory segment, logging it first if log is True.
+        :return: Doc id of the document it is a near-duplicate of, or None.
+        '''
+        title_tokens = self.tokenize(doc_title)
+        tokens = title_tokens + self.tokenize(doc_body)
+        words = self.normalize_tokens(tokens)
+        stopwords = self.stopwords
+        terms = [w for t, w in zip(tokens, words) if t not in stopwords]
+        title_terms = [w for t, w in zip(title_tokens, words) if t not in stopwords]
+        if self.deduplicator is not None:
+            original = self.deduplicator.check(doc_id, terms)
+            if original is not None:
+                return original
+        if log and self.wal is not None:
+            self.wal.append(doc_id, doc_title, doc_body)
+        if self.doc_map is not None:
+            doc_id = self.doc_map.assign(doc_id)
         self.docstore.add_document(doc_id, doc_title, doc_body)
-        terms = self.extract_terms(doc_title + " " + doc_body)
         for pos, term in enumerate(terms):
             self.memory_segment.add_token(term, doc_id, pos)
-        if self.memory_segment.get_size() >= self.memory_limit:
-            self.save()
+        for pos, term in enumerate(title_terms):
+            self.memory_segment.add_token(field_key(TITLE, term), doc_id, pos)
+        for key, pos in self.extract_bigrams(tokens, words):
+            self.memory_segment.add_token(key, doc_id, pos)
+        self.doc_count += 1
+        return None
+
+    def commit(self):
+        '''
+        Makes the documents added so far durable in the write-ahead log, without waiting for the next group commit.
+        Raises the exception of a background flush that failed since the last commit or save, if any.
+        :return: None
+        '''
+        if self.wal is not None:
+            self.wal.commit()
+        self._raise_flush_error()
+
+    def _seal_wal(self):
+        '''
+        Closes the current generation of the write-ahead log and syncs the document store, so the generation can be
+        deleted as soon as the postings of its documents are on disk.
+        :return: The closed generation, or None if there is no log.
+        '''
+        if self.wal is None:
+            return None
+        generation = self.wal.rotate()
+        if self._docstore is not None:
+            self._docstore.sync()
+        return generation
+
+    def _flush_in_background(self):
+        '''
+        Freezes the memory segment and starts merging it into the disk segment on a background thread.
+        If the previous flush is still running, waits for it first (backpressure).
+        :return: None
+        '''
+        self._wait_for_flush()
+        self._save_doc_map()
+        disk_segment = self.disk_segment
+        self.frozen_segment = self.memory_segment
+        self.memory_segment = MemorySegment()
+        generation = self._seal_wal()
+        self._flush_thread = threading.Thread(target=self._flush_frozen_segment, args=(disk_segment, generation),
+                                              daemon=True)
+        self._flush_thread.start()
+
+    def _flush_frozen_segment(self, disk_segment: DiskSegment, generation):
+        try:
+            self.frozen_segment.merge_into_disk(disk_segment)
+        except Exception as e:
+            # the frozen segment stays searchable and its log generation is kept; the error is raised by the next
+            # commit or save, and the merge is retried by the next _wait_for_flush
+            self._flush_error = e
+            return
+        self.frozen_segment = None
+        if generation is not None:
+            self.wal.truncate(generation)
 
-    def do_free_text_query(self, terms: list) -> Results:
+    def _raise_flush_error(self):
+        '''
+        Raises the exception of a failed background flush once, if there is one.
+        :return: None
+        '''
+        error, self._flush_error = self._flush_error, None
+        if error is not None:
+            raise error
+
+    def _wait_for_flush(self):
+        '''
+        Waits for a background flush to finish, and raises its exception if it failed. Once it has been raised,
+        the next call merges the frozen segment again on this thread.
+        :return: None
+        '''
+        if self._flush_thread is not None:
+            self._flush_thread.join()
+            self._flush_thread = None
+        self._raise_flush_error()
+        if self.frozen_segment is not None:
+            self.frozen_segment.merge_into_disk(self.disk_segment)
+            self.frozen_segment = None
+
+    def preprocess_query_terms(self, terms: list) -> list:
+        with metrics.timer("preprocess_term"):
+            return [self.preprocess_term(term) for term in terms if term not in self.stopwords]
+
+    def expand_term(self, term: str, max_edits: int = 1, max_expansions: int = 10) -> list:
+        '''
+        Finds the indexed terms within max_edits edits of a (preprocessed) query term, using the segments' vocabularies.
+        :param term: str
+        :param max_edits: Max Levenshtein distance.
+        :param max_expansions: Max number of terms to return.
+        :return: List of terms, closest first, then most frequent first.
+        '''
+        with metrics.timer("expand_term"):
+            distances = {}
+            segments = self.segments()
+            for segment in segments:
+                for distance, match in segment.search_vocabulary(term, max_edits):
+                    distances[match] = min(distance, distances.get(match, distance))
+            def rank(t):
+                df = sum(segment.doc_frequency(t) for segment in segments)
+                return distances[t], -df, t
+            return sorted(distances, key=rank)[:max_expansions]
+
+    def suggest(self, prefix: str, k: int = 10) -> list:
+        '''
+        Type-ahead suggestions: the indexed terms starting with the prefix that occur in the most documents.
+        Terms are suggested as indexed, i.e. stemmed.
+        Each segment gives its own top k terms, and the candidates are ranked by their document frequency over all
+        the segments, threshold-style: a term missing from every segment's top n has a frequency of at most the sum
+        of the n-th frequencies of the segments whose top is full, which is the bound the k-th candidate must reach.
+        Otherwise only those segments are asked for more terms, first up to the CACHE_K terms a disk segment has
+        precomputed for short prefixes, then twice as many per round, each such round scanning the prefix's range
+        of terms in the segment.
+        :param prefix: str
+        :param k: Max number of suggestions.
+        :return: List of terms, most frequent first.
+        '''
+        prefix = re.sub(r'[^a-z0-9]', '', prefix.lower())
+        segments = self.segments()
+        with metrics.timer("suggest"):
+            n = k
+            tops = [segment.suggest(prefix, n) for segment in segments]
+            if len(tops) == 1:
+                return [term for term, frequency in tops[0]]
+            while True:
+                candidates = set(term for top in tops for term, frequency in top)
+                ranked = sorted((-sum(segment.doc_frequency(term) for segment in segments), term)
+                                for term in candidates)[:k]
+                full = [len(top) == n for top in tops]  # the segment may have more terms with the prefix
+                bound = sum(top[-1][1] for top, is_full in zip(tops, full) if is_full)
+                if bound == 0 or (len(ranked) == k and -ranked[-1][0] >= bound):
+                    return [term for frequency, term in ranked]
+                n = CACHE_K if n < CACHE_K else n * 2
+                tops = [segment.suggest(prefix, n) if is_full else top
+                        for segment, top, is_full in zip(segments, tops, full)]
+
+    def do_free_text_query(self, terms: list, trace: bool = False, fuzzy: bool = False, max_edits: int = 1,
+                           max_expansions: int = 10, fields: list = None, boosts: dict = None) -> Results:
         '''
         Executes a free text query (searches for documents containing ANY of the terms)
         :param terms: List of the terms to search for.
+        :param trace: Attach a metrics.Trace of the query's execution to the Results.
+        :param fuzzy: Also match indexed terms within max_edits edits of each term, e.g. misspellings.
+        :param max_edits: Max Levenshtein distance of fuzzy matches.
+        :param max_expansions: Max number of indexed terms each query term is expanded into when fuzzy.
+        :param fields: Fields to search, from naive_dynamic_ix.terms.FIELDS. Defaults to the full text;
+            ["title"] only reads the title posting lists.
+        :param boosts: Dict of field to weight. If given, results are ranked by the sum over fields of the field's
+            weight times the number of terms found in it, and the scores are returned in Results.scores.
         :return: Results object.
         '''
-        terms = [self.preprocess_term(term) for term in terms if term not in self.stopwords]
-        doc_ids = set()
-        for term in terms:
-            mem_results = self.memory_segment.do_one_word_query(term)
-            disk_results = self.disk_segment.do_one_word_query(term)
-            doc_ids |= set(mem_results)
-            doc_ids |= set(disk_results)
-        doc_ids = list(doc_ids)
-        doc_titles = []
-        snippets = []
-        termset = set(terms)
-        for doc_id in doc_ids:
-            doc = self.docstore.get_document(doc_id)
-            doc_titles.append(doc[0])
-            snippets.append(self.get_result_snippet(termset, doc[1]))
-        return Results(doc_ids, doc_titles, snippets)
+        with metrics.query("free_text", trace) as q:
+            terms = self.preprocess_query_terms(terms)
+            if fuzzy:
+                terms = [t for term in terms for t in self.expand_term(term, max_edits, max_expansions)]
+            matches = self._free_text_matches(self.segments(), terms, fields)
+            return q.attach(self._get_field_results(matches, terms, boosts))
+
+    def _free_text_matches(self, segments: list, terms: list, fields: list = None) -> dict:
+        '''
+        :param segments: The segments to search.
+        :param terms: List of preprocessed query terms.
+        :param fields: Fields to search, defaults to the full text.
+        :return: Dict of field to Counter of doc id to number of the terms found in the field.
+        '''
+        matches = {}
+        for field in fields or [TEXT]:
+            matches[field] = Counter()
+            for term in terms:
+                key = field_key(field, term)
+                doc_ids = set()
+                for segment in segments:
+                    with metrics.timer(self._timer_name(segment)):
+                        doc_ids.update(segment.do_one_word_query(key))
+                matches[field].update(doc_ids)
+        return matches
 
-    def do_phrase_query(self, terms: list) -> Results:
+    def do_phrase_query(self, terms: list, trace: bool = False, fields: list = None, boosts: dict = None) -> Results:
         '''
         Executes a phrase query (searches for documents containing the EXACT phrase)
+        In the full text, phrases with stopwords such as "to be or not to be" are matched exactly, stopwords
+        included, using the posting lists of the word pairs that contain a stopword.
         :param terms: List of terms comprising the phrase to search for.
+        :param trace: Attach a metrics.Trace of the query's execution to the Results.
+        :param fields: Fields to search, see do_free_text_query.
+        :param boosts: Dict of field to weight, see do_free_text_query.
+        :return: Results object
+        '''
+        with metrics.query("phrase", trace) as q:
+            matches = self._phrase_matches(self.segments(), terms, fields)
+            return q.attach(self._get_field_results(matches, self.preprocess_query_terms(terms), boosts))
+
+    def _phrase_matches(self, segments: list, words: list, fields: list = None) -> dict:
+        '''
+        :param segments: The segments to search.
+        :param words: The words of the phrase, as given in the query.
+        :param fields: Fields to search, defaults to the full text.
+        :return: Dict of field to Counter of doc id to 1 for the documents with the phrase in the field.
+        '''
+        tokens = self.tokenize(" ".join(words))
+        terms = self.preprocess_query_terms(words)
+        use_bigrams = len(tokens) > 1 and any(t in self.stopwords for t in tokens)
+        matches = {}
+        for field in fields or [TEXT]:
+            keys = [field_key(field, term) for term in terms]
+            doc_ids = set()
+            for segment in segments:
+                with metrics.timer(self._timer_name(segment)):
+                    if field == TEXT and use_bigrams:
+                        doc_ids.update(self._do_bigram_phrase_query(segment, tokens, keys))
+                    elif keys:  # a phrase of a single stopword, or of no word at all, matches nothing
+                        doc_ids.update(segment.do_phrase_query(keys))
+            matches[field] = Counter(doc_ids)
+        return matches
+
+    def _do_bigram_phrase_query(self, segment, tokens: list, terms: list) -> set:
+        '''
+        Executes a phrase query with stopwords on a segment. The pairs of adjacent words that contain a stopword
+        are matched as runs of bigrams at consecutive positions, and the runs are joined on the start position of
+        the phrase they imply, both counted with stopwords. If some adjacent words are both content words, which
+        have no bigram and whose positions are counted without stopwords, the documents that also have the phrase
+        of the content words are checked against their text.
+        :param segment: MemorySegment or DiskSegment.
+        :param tokens: The phrase, tokenized with stopwords.
+        :param terms: The preprocessed content words of the phrase.
+        :return: Set of matching doc ids.
+        '''
+        words = self.normalize_tokens(tokens)
+        bigrams = self.extract_bigrams(tokens, words)
+        runs = []  # (position of the first word in the phrase, bigram keys at consecutive positions)
+        for key, pos in bigrams:
+            if runs and pos == runs[-1][0] + len(runs[-1][1]):
+                runs[-1][1].append(key)
+            else:
+                runs.append((pos, [key]))
+        starts = None  # doc id -> start positions of the phrase that every run so far agrees on
+        for offset, run in runs:
+            postings = PostingList.find_phrases([segment.get_posting_list(key) for key in run]).postings
+            run_starts = {posting.doc_id: {pos - offset for pos in posting.positions} for posting in postings}
+            if starts is not None:
+                run_starts = {doc_id: doc_starts & starts[doc_id] for doc_id, doc_starts in run_starts.items()
+                              if doc_id in starts}
+            starts = {doc_id: doc_starts for doc_id, doc_starts in run_starts.items() if doc_starts}
+            if not starts:
+                return set()
+        doc_ids = set(starts)
+        if len(bigrams) < len(tokens) - 1 and terms:
+            doc_ids &= set(segment.do_phrase_query(terms))
+            doc_ids = {doc_id for doc_id in doc_ids if self._has_phrase(doc_id, words)}
+        return doc_ids
+
+    def _has_phrase(self, doc_id, words: list) -> bool:
+        '''
+        :param doc_id: Doc id of a document, as stored.
+        :param words: The phrase, as normalize_tokens() words.
+        :return: Whether the text of the document contains the phrase, stopwords included.
+        '''
+        doc_title, doc_body = self._fetch_document(doc_id)
+        doc_words = self.normalize_tokens(self.tokenize(doc_title) + self.tokenize(doc_body))
+        n = len(words)
+        return any(doc_words[i:i + n] == words for i in range(len(doc_words) - n + 1))
+
+    def do_proximity_query(self, terms: list, max_distance: int, ordered: bool = False,
+                           trace: bool = False) -> Results:
+        '''
+        Executes a proximity (NEAR) query: searches for documents where all the terms occur within a window of
+        max_distance words, e.g. do_proximity_query(["einstein", "bomb"], 5) finds "einstein" within 5 words of "bomb".
+        With ordered=True the terms must also occur in the given order, which makes this a "sloppy" phrase query.
+        Stopwords are not counted as words.
+        :param terms: List of the terms to search for.
+        :param max_distance: Max distance in words between the first and last of the terms.
+        :param ordered: Whether the terms must occur in the given order.
+        :param trace: Attach a metrics.Trace of the query's execution to the Results.
+        :return: Results object
+        '''
+        with metrics.query("proximity", trace) as q:
+            terms = self.preprocess_query_terms(terms)
+            if not terms:
+                return q.attach(Results([], [], []))
+            doc_ids = set()
+            for segment in self.segments():
+                with metrics.timer(self._timer_name(segment)):
+                    doc_ids.update(segment.do_proximity_query(terms, max_distance, ordered))
+            return q.attach(self.get_results(list(doc_ids), terms))
+
+    def do_top_k_query(self, terms: list, k: int = 10, trace: bool = False, tiered: bool = True) -> Results:
+        '''
+        Finds the k documents with the highest score for the terms, the score of a document being the sum over the
+        terms of their frequency in the document times their idf, log(1 + N / df).
+        Only the high-impact tiers of long posting lists on disk are read at first (see DiskSegment.get_impacts).
+        If the tiers can't prove which documents are the top k, the rest of the posting lists is read; otherwise
+        the rest of a posting list is only read to complete the score of a top document.
+        :param terms: List of the terms to search for.
+        :param k: Number of documents to return.
+        :param trace: Attach a metrics.Trace of the query's execution to the Results.
+        :param tiered: Read the high-impact tiers first. With tiered=False every posting list is read in full, which
+            gives the same results.
+        :return: Results object with the top k documents, best first, and their scores in Results.scores.
+        '''
+        with metrics.query("top_k", trace) as q:
+            terms = self.preprocess_query_terms(terms)
+            doc_ids, scores = self._top_k(self.segments(), terms, k, tiered)
+            results = self.get_results(doc_ids, terms)
+            results.scores = scores
+            return q.attach(results)
+
+    def _top_k(self, segments: list, terms: list, k: int, tiered: bool) -> tuple:
+        '''
+        :param segments: The segments to search.
+        :param terms: List of preprocessed query terms.
+        :param k: Number of documents to return.
+        :param tiered: Read the high-impact tiers first.
+        :return: (list of the top k doc ids, best first, ties by doc id, list of their scores)
+        '''
+        if k <= 0:
+            return [], []
+        doc_frequencies = {term: sum(segment.doc_frequency(term) for segment in segments) for term in set(terms)}
+        num_docs = max([self.doc_count] + list(doc_frequencies.values()))
+        weights = {term: math.log(1 + num_docs / df) for term, df in doc_frequencies.items() if df}
+        newer_doc_ids = self.newer_doc_ids(segments)
+        # (segment number, term) -> (dict of doc id to impact, max impact of the postings not read yet)
+        impacts = {}
+        with metrics.timer("read_impacts"):
+            for term in weights:
+                for i, segment in enumerate(segments):
+                    pairs, max_tail_impact = segment.get_impacts(term, tiered)
+                    impacts[i, term] = (dict(pairs), max_tail_impact)
+        while True:
+            scores = Counter() # lower bounds of the scores, exact for documents with nothing missing
+            segment_of = {}
+            for (i, term), (doc_impacts, max_tail_impact) in impacts.items():
+                for doc_id, impact in doc_impacts.items():
+                    if any(doc_id in doc_ids for doc_ids in newer_doc_ids[i]):
+                        continue  # also in a newer segment, e.g. the frozen segment of a flush in progress
+                    scores[doc_id] += weights[term] * impact
+                    segment_of[doc_id] = i
+
+            def missing(doc_id):
+                # the terms that may be in the document, in the parts of their posting lists not read yet
+                i = segment_of[doc_id]
+                return [term for term in weights if impacts[i, term][1] and doc_id not in impacts[i, term][0]]
+
+            def upper_bound(doc_id):
+                return scores[doc_id] + sum(weights[term] * impacts[segment_of[doc_id], term][1]
+                                            for term in missing(doc_id))
+
+            ranked = sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+            top = ranked[:k]
+            unseen_bound = sum(weights[term] * max(impacts[i, term][1] for i in range(len(segments)))
+                               for term in weights)
+            if not unseen_bound:
+                to_read = set()
+            elif len(top) == k and unseen_bound < scores[top[-1]] and \
+                    all((-upper_bound(doc_id), doc_id) > (-scores[top[-1]], top[-1]) for doc_id in ranked[k:]):
+                # no other document can make it into the top k: complete the scores of the top documents
+                to_read = set((segment_of[doc_id], term) for doc_id in top for term in missing(doc_id))
+            else:
+                to_read = set(key for key, (doc_impacts, max_tail_impact) in impacts.items() if max_tail_impact)
+            if not to_read:
+                return top, [scores[doc_id] for doc_id in top]
+            metrics.count("tail_posting_lists_read", len(to_read))
+            with metrics.timer("read_impacts"):
+                for i, term in to_read:
+                    pairs, max_tail_impact = segments[i].get_impacts(term, tiered=False)
+                    impacts[i, term] = (dict(pairs), 0)
+
+    def plan_query(self, query: str):
+        '''
+        Parses a boolean query and plans its execution over the memory and disk segments.
+        See naive_dynamic_ix.query for the query syntax.
+        :param query: Query string, e.g. '"albert einstein" AND (bomb OR atomic) -movie'
+        :return: QueryPlan object.
+        '''
+        return QueryPlanner(self).plan(query)
+
+    def do_boolean_query(self, query: str, trace: bool = False) -> Results:
+        '''
+        Executes a boolean query, e.g. '"albert einstein" AND (bomb OR atomic) -movie'.
+        Adjacent clauses are ANDed; phrases are in double quotes; "-" or NOT negates a clause.
+        :param query: Query string.
+        :param trace: Attach a metrics.Trace of the query's execution to the Results.
         :return: Results object
         '''
-        terms = [self.preprocess_term(term) for term in terms if term not in self.stopwords]
-        doc_ids = set(self.memory_segment.do_phrase_query(terms)) | set(self.disk_segment.do_phrase_query(terms))
-        doc_ids = list(doc_ids)
+        with metrics.query("boolean", trace) as q:
+            with metrics.timer("plan"):
+                plan = self.plan_query(query)
+            with metrics.timer("execute"):
+                doc_ids = plan.execute()
+            return q.attach(self.get_results(doc_ids, plan.terms))
+
+    def explain(self, query: str) -> str:
+        '''
+        Executes a boolean query and describes how it was executed.
+        :param query: Query string.
+        :return: The chosen plan, with the estimated documents and the postings touched by each step.
+        '''
+        plan = self.plan_query(query)
+        plan.execute()
+        return plan.explain()
+
+    @staticmethod
+    def _rank_field_matches(matches: dict, boosts: dict = None) -> tuple:
+        '''
+        :param matches: Dict of field to Counter of doc id to number of query terms matched in the field.
+        :param boosts: Dict of field to weight, or None to return the matches unranked.
+        :return: (list of the doc ids matching in any field, list of their scores or None if unranked)
+        '''
+        if boosts is None:
+            doc_ids = set()
+            for counts in matches.values():
+                doc_ids.update(counts)
+            return list(doc_ids), None
+        scores = {}
+        for field, counts in matches.items():
+            boost = boosts.get(field, 1.0)
+            for doc_id, count in counts.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + boost * count
+        doc_ids = sorted(scores, key=lambda doc_id: -scores[doc_id])
+        return doc_ids, [scores[doc_id] for doc_id in doc_ids]
+
+    def _get_field_results(self, matches: dict, terms: list, boosts: dict = None) -> Results:
+        '''
+        :param matches: Dict of field to Counter of doc id to number of query terms matched in the field.
+        :param terms: List of the (preprocessed) query terms.
+        :param boosts: Dict of field to weight, or None to return the matches unranked.
+        :return: Results object for the documents matching in any field.
+        '''
+        doc_ids, scores = self._rank_field_matches(matches, boosts)
+        results = self.get_results(doc_ids, terms)
+        results.scores = scores
+        return results
+
+    def run_queries(self, batch: list) -> list:
+        '''
+        Executes a batch of free text and phrase queries, sharing the work between them: each posting list is
+        fetched and decoded at most once per segment, and the matching documents of the whole batch are fetched once
+        each, in one bulk read of the document store.
+        The queries are evaluated one after the other: their evaluation is pure Python, which threads would not run
+        in parallel. ShardedIndex.run_queries evaluates a batch on all the shards in parallel worker processes.
+        :param batch: List of (query type, terms) or (query type, terms, options), where the query type is "free_text"
+            or "phrase" and options is a dict of keyword arguments of do_free_text_query or do_phrase_query
+            ("fields" and "boosts").
+        :return: List of Results, one per query.
+        '''
+        with metrics.query("batch"):
+            segments = [CachedSegment(segment) for segment in self.segments()]
+            ranked = []
+            for query in batch:
+                query_type, words = query[0], query[1]
+                options = query[2] if len(query) > 2 else {}
+                if query_type not in QUERY_TYPES:
+                    raise ValueError("Unknown query type: " + repr(query_type))
+                terms = self.preprocess_query_terms(words)
+                if query_type == FREE_TEXT:
+                    matches = self._free_text_matches(segments, terms, options.get("fields"))
+                else:
+                    matches = self._phrase_matches(segments, words, options.get("fields"))
+                doc_ids, scores = self._rank_field_matches(matches, options.get("boosts"))
+                ranked.append((doc_ids, scores, terms))
+
+            with metrics.timer("get_results"):
+                matched = list(dict.fromkeys(chain.from_iterable(doc_ids for doc_ids, scores, terms in ranked)))
+                documents = self._fetch_documents(matched)
+            results_list = []
+            for doc_ids, scores, terms in ranked:
+                results = self.get_results(doc_ids, terms, documents)
+                results.scores = scores
+                results_list.append(results)
+            return results_list
+
+    def get_results(self, doc_ids: list, terms: list, documents: dict = None) -> Results:
+        '''
+        Looks up the titles and snippets of the given documents in the document store.
+        :param doc_ids: List of matching doc ids, as stored in the segments: ordinals if the index was reordered.
+        :param terms: List of the (preprocessed) query terms.
+        :param documents: Dict of doc id to (doc_title, doc_body) of documents that were already fetched.
+        :return: Results object, with the doc ids of the documents.
+        '''
         doc_titles = []
         snippets = []
         termset = set(terms)
-        for doc_id in doc_ids:
-            doc = self.docstore.get_document(doc_id)
-            doc_titles.append(doc[0])
-            snippets.append(self.get_result_snippet(termset, doc[1]))
+        with metrics.timer("get_results"):
+            for doc_id in doc_ids:
+                if documents is not None and doc_id in documents:
+                    doc = documents[doc_id]
+                else:
+                    doc = self._fetch_document(doc_id)
+                doc_titles.append(doc[0])
+                snippets.append(self.get_result_snippet(termset, doc[1]))
+        if self.doc_map is not None:
+            doc_ids = [self.doc_map.doc_id(ordinal) for ordinal in doc_ids]
         return Results(doc_ids, doc_titles, snippets)
 
     def save(self):
         '''
         Saves any pending changes to disk and clears the memory portion of the index.
+        Waits for a background flush in progress. Does nothing for a read-only index.
+        A RAM-only index is written to its file, if it has one, and stays in memory.
+        :return: None
+        '''
+        if self.read_only:
+            return
+        if self.ram_only:
+            if self.ram_filename is not None:
+                settings = {"analyzer": ANALYZER, "stopwords": sorted(self.stopwords)}
+                ram_file.save(self.ram_filename, settings, self.memory_segment, self.docstore.documents)
+                if self.deduplicator is not None:
+                    self.deduplicator.save(self._lsh_filename())
+            return
+        self._wait_for_flush()
+        self._save_doc_map()
+        if self.memory_segment.index or self._disk_segment is not None:
+            self.memory_segment.merge_into_disk(self.disk_segment)
+            self.memory_segment.clear()
+        generation = self._seal_wal()
+        if generation is not None:
+            self.wal.truncate(generation)
+        if self.deduplicator is not None:
+            self.deduplicator.save(self._lsh_filename())
+        if self.manifest is not None and self.manifest.doc_count != self.doc_count:
+            self.manifest.doc_count = self.doc_count
+            self.manifest.save(self.directory)
+
+    def _save_doc_map(self):
+        '''
+        Saves the ordinals assigned to new documents, before their postings are merged into the disk segment.
+        :return: None
+        '''
+        if self.doc_map is not None and self.doc_map.dirty:
+            self.doc_map.save(os.path.join(self.directory, self.manifest.doc_map))
+
+    def close(self):
+        '''
+        Saves any pending changes and closes the underlying database files that were opened.
         :return: None
         '''
-        self.memory_segment.merge_into_disk(self.disk_segment)
-        self.memory_segment.clear()
+        self.save()
+        if self.wal is not None:
+            self.wal.close()
+        if self._disk_segment is not None:
+            self._disk_segment.close()
+            self._disk_segment = None
+        if self._docstore is not None:
+            self._docstore.close()
+            self._docstore = None
+        if self._delta_segments is not None:
+            for segment, docstore in self._delta_segments:
+                segment.close()
+                docstore.close()
+            self._delta_segments = None
 
     def get_result_snippet(self, termset: set, doc_body: str):
         '''
@@ -0,0 +1,94 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+'''
+
+import json
+import os
+from naive_dynamic_ix.storage import BSDDB, DEFAULT_BACKEND
+
+FORMAT_VERSION = 1
+MANIFEST_FILENAME = "MANIFEST.json"
+
+# settings of the analyzer in Index.extract_terms / Index.preprocess_term.
+ANALYZER = {"lowercase": True, "token_pattern": "[a-z0-9]+", "stemmer": "porter"}
+
+
+class Manifest:
+    '''
+    Description of an index directory: the format version, analyzer settings and stopword list the index was built
+    with, the number of documents, the files of its segments and document store and their storage backend.
+    Stored as JSON in <directory>/MANIFEST.json, so an index can be opened without touching any other file.
+    '''
+    def __init__(self, format_version: int, analyzer: dict, stopwords: list, doc_count: int,
+                 segments: list, docstore: str, snapshot_wal_generation: int = None, doc_map: str = None,
+                 storage: str = BSDDB):
+        self.format_version = format_version
+        self.analyzer = analyzer
+        self.stopwords = stopwords
+        self.doc_count = doc_count
+        # list of dicts with keys "name" and "file", the file being relative to the index directory. The first one
+        # is the main segment; the others are delta segments shipped by incremental snapshots, which also have a
+        # "docstore" key with the file of their documents.
+        self.segments = segments
+        self.docstore = docstore
+        # last write-ahead log generation included in a snapshot of the index, or None if it was never snapshotted
+        self.snapshot_wal_generation = snapshot_wal_generation
+        # file of the DocMap of an index whose documents were reordered, see naive_dynamic_ix.reorder, or None
+        self.doc_map = doc_map
+        # storage backend of the segment and document store files, see naive_dynamic_ix.storage
+        self.storage = storage
+
+    @classmethod
+    def create(cls, stopwords, storage: str = None):
+        '''
+        :param stopwords: Iterable of stopwords.
+        :param storage: Storage backend of the index files, or None for the default one.
+        :return: Manifest for a new, empty index.
+        '''
+        return cls(FORMAT_VERSION, dict(ANALYZER), sorted(stopwords), 0,
+                   [{"name": "main", "file": "segment.db"}], "docs.db", storage=storage or DEFAULT_BACKEND)
+
+    @classmethod
+    def load(cls, directory: str):
+        '''
+        Reads the manifest of an index directory.
+        :param directory: str
+        :return: Manifest object, or None if the directory has no manifest.
+        '''
+        filename = os.path.join(directory, MANIFEST_FILENAME)
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        if data["format_version"] > FORMAT_VERSION:
+            raise ValueError("Index format version " + str(data["format_version"]) +
+                             " is newer than the supported version " + str(FORMAT_VERSION))
+        if data["analyzer"] != ANALYZER:
+            raise ValueError("Index was built with a different analyzer: " + repr(data["analyzer"]))
+        return cls(data["format_version"], data["analyzer"], data["stopwords"], data["doc_count"],
+                   data["segments"], data["docstore"], data.get("snapshot_wal_generation"), data.get("doc_map"),
+                   data.get("storage", BSDDB))
+
+    def save(self, directory: str):
+        '''
+        Writes the manifest into the index directory, replacing the old one atomically.
+        :param directory: str
+        :return: None
+        '''
+        filename = os.path.join(directory, MANIFEST_FILENAME)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, 'w') as f:
+            json.dump({
+                "format_version": self.format_version,
+                "analyzer": self.analyzer,
+                "stopwords": self.stopwords,
+                "doc_count": self.doc_count,
+                "segments": self.segments,
+                "docstore": self.docstore,
+                "snapshot_wal_generation": self.snapshot_wal_generation,
+                "doc_map": self.doc_map,
+                "storage": self.storage,
+            }, f, indent=2)
+        os.replace(tmp_filename, filename)
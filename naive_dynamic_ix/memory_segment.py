@@ -4,8 +4,15 @@ Contact: andrewkchan@berkeley.edu
 License: MIT License
 '''
 
-from collections import defaultdict
-from bisect import bisect_left
+from collections import defaultdict, deque
+from bisect import bisect_left, bisect_right, insort
+from heapq import merge, nlargest
+from naive_dynamic_ix import posting_arrays
+from naive_dynamic_ix.term_stats import TermStats
+from naive_dynamic_ix.vocabulary import Vocabulary
+from naive_dynamic_ix.suggest import prefix_range
+from naive_dynamic_ix.terms import is_plain_term
+from naive_dynamic_ix import metrics
 import gc
 
 
@@ -32,6 +39,9 @@ class Posting:
         '''
         if p1.doc_id != p2.doc_id:
             raise ValueError("Postings to merge do not have same doc id")
+        if posting_arrays.np is not None and \
+                len(p1.positions) + len(p2.positions) >= posting_arrays.MIN_VECTORIZE_POSITIONS:
+            return Posting(p1.doc_id, posting_arrays.merge_positions(p1.positions, p2.positions))
         i, j = 0, 0
         merged = []
         while i < len(p1.positions) or j < len(p2.positions):
@@ -75,24 +85,54 @@ class PostingList:
         # keep a separate list of doc ids mostly for convenience to use with bisect_left.
         self._doc_ids = [posting.doc_id for posting in self.postings]
 
+        # numpy arrays packed from the postings by posting_arrays, dropped whenever the postings change.
+        self._packed = None
+
+    @classmethod
+    def _from_pairs(cls, pairs):
+        '''
+        Builds a posting list from (doc_id, positions) pairs sorted by doc id.
+        '''
+        return cls([Posting(doc_id, positions) for doc_id, positions in pairs])
+
+    def __getstate__(self):
+        # never pickle the packed arrays into the disk segment.
+        state = self.__dict__.copy()
+        state.pop('_packed', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._packed = None
+
     def add_posting(self, posting: Posting):
         '''
         Adds a posting to the posting list, maintaining sorted order by doc id.
         :param posting: Posting object
-        :return: None
+        :return: True if the posting's document was not in the list before.
         '''
         posting_i = bisect_left(self._doc_ids, posting.doc_id)
         if posting_i == len(self._doc_ids) or self._doc_ids[posting_i] != posting.doc_id:
             # if we don't already have this doc in our postings list, insert it
             self.postings.insert(posting_i, posting)
             self._doc_ids.insert(posting_i, posting.doc_id)
-        else:
-            # if already have this doc, merge the positions lists of the postings
-            self.postings[posting_i] = Posting.merge_postings(self.postings[posting_i], posting)
+            self._packed = None
+            return True
+        # if already have this doc, merge the positions lists of the postings
+        self.postings[posting_i] = Posting.merge_postings(self.postings[posting_i], posting)
+        self._packed = None
+        return False
 
     def __repr__(self):
         return "< PostingList::" + repr(self.postings) + ";" + repr(self._doc_ids) + ">"
 
+    def impacts(self) -> list:
+        '''
+        :return: List of (doc_id, impact) pairs sorted by doc id, the impact of a posting being its number of
+            positions, i.e. the term frequency in the document.
+        '''
+        return [(posting.doc_id, len(posting.positions)) for posting in self.postings]
+
     @staticmethod
     def merge_lists(pl_1, pl_2):
         '''
@@ -102,6 +142,10 @@ class PostingList:
         :param pl_2: PostingList
         :return: Merged PostingList.
         '''
+        if posting_arrays.should_vectorize([pl_1, pl_2]):
+            merged = posting_arrays.merge_lists(pl_1, pl_2)
+            if merged is not None:
+                return PostingList([p if isinstance(p, Posting) else Posting(*p) for p in merged])
         i, j = 0, 0
         merged = []
         while i < len(pl_1.postings) or j < len(pl_2.postings):
@@ -141,6 +185,10 @@ class PostingList:
         :param posting_lists: Iterator where each element is a PostingList.
         :return: PostingList. The Postings contain start positions of found phrases.
         '''
+        if posting_arrays.should_vectorize(posting_lists):
+            pairs = posting_arrays.find_phrases(posting_lists)
+            if pairs is not None:
+                return PostingList._from_pairs(pairs)
         first_posting_list = posting_lists[0]
         # create forward index with doc_id as key and possible start positions of the phrase as values.
         fw_index = {posting.doc_id: set(posting.positions) for posting in first_posting_list.postings}
@@ -168,9 +216,135 @@ class PostingList:
         result_postings = [Posting(item[0], sorted(item[1])) for item in fw_index.items()]
         return PostingList(result_postings)
 
+    @staticmethod
+    def find_near(posting_lists, max_distance: int, ordered: bool = False):
+        '''
+        Finds windows of at most max_distance positions (last position - first position) that contain an occurrence
+        of every posting list's term. If ordered, the occurrences must also be in the same order as the posting lists.
+        Example, for max_distance = 2:
+        >>> x = PostingList([Posting(1, [2, 9]), Posting(2, [2])])
+        >>> y = PostingList([Posting(1, [7]), Posting(2, [8])])
+        >>> PostingList.find_near([x, y], 2)
+        >>>   PostingList([Posting(1, [7])])
+        An ordered query with max_distance = len(posting_lists) - 1 is an exact phrase query; raising max_distance
+        by k allows k extra words in between ("sloppy" phrases).
+        Documents missing any of the terms are dropped up front, and each remaining document takes one linear pass
+        over its position lists.
+        :param posting_lists: List where each element is a PostingList.
+        :param max_distance: int
+        :param ordered: Whether the terms must occur in order.
+        :return: PostingList. The Postings contain start positions of the matching windows.
+        '''
+        candidates = PostingList.intersect_doc_ids(posting_lists)
+        if not candidates:
+            return PostingList()
+        candidate_set = set(candidates)
+        positions_by_doc = [{p.doc_id: p.positions for p in posting_list.postings if p.doc_id in candidate_set}
+                            for posting_list in posting_lists]
+        result_postings = []
+        for doc_id in candidates:
+            positions = [doc_positions[doc_id] for doc_positions in positions_by_doc]
+            if ordered:
+                starts = PostingList._ordered_window_starts(positions, max_distance)
+            else:
+                starts = PostingList._window_starts(positions, max_distance)
+            if starts:
+                result_postings.append(Posting(doc_id, starts))
+        return PostingList(result_postings)
+
+    @staticmethod
+    def _window_starts(positions: list, max_distance: int) -> list:
+        '''
+        Merges the sorted position lists in one pass, tracking the latest occurrences of each list.
+        Whenever every list has occurred, the tightest window ending at the current position starts at the
+        earliest of those latest occurrences.
+        Each position holds one term, so equal lists are the same term repeated in the query: they are merged into
+        one list that must occur as many times in the window, each occurrence at its own position.
+        :return: Sorted start positions of matching windows.
+        '''
+        repeats = defaultdict(int)
+        for poses in positions:
+            repeats[tuple(poses)] += 1
+        needed = list(repeats.values())
+        latest = [deque(maxlen=n) for n in needed]  # latest occurrences of each distinct list, oldest first
+        seen = 0
+        starts = []
+        events = merge(*[[(pos, i) for pos in poses] for i, poses in enumerate(repeats)])
+        for pos, i in events:
+            if len(latest[i]) == needed[i] - 1:
+                seen += 1
+            latest[i].append(pos)
+            if seen == len(needed):
+                start = min(occurrences[0] for occurrences in latest)
+                if pos - start <= max_distance and (not starts or starts[-1] != start):
+                    starts.append(start)
+        return starts
+
+    @staticmethod
+    def _ordered_window_starts(positions: list, max_distance: int) -> list:
+        '''
+        For each occurrence of the first list, greedily takes the next occurrence of each following list.
+        The greedy choices only move forward as the first occurrence does, so every list is scanned once.
+        :return: Sorted start positions of matching windows.
+        '''
+        cursors = [0] * len(positions)
+        starts = []
+        for start in positions[0]:
+            prev = start
+            for i in range(1, len(positions)):
+                cursors[i] = bisect_right(positions[i], prev, cursors[i])
+                if cursors[i] == len(positions[i]):
+                    return starts
+                prev = positions[i][cursors[i]]
+                if prev - start > max_distance:
+                    break
+            else:
+                starts.append(start)
+        return starts
+
+    @staticmethod
+    def intersect_doc_ids(posting_lists) -> list:
+        '''
+        Finds the documents that occur in every one of the posting lists.
+        :param posting_lists: List of PostingList objects.
+        :return: Sorted list of doc ids.
+        '''
+        if not posting_lists:
+            return []
+        if posting_arrays.should_vectorize(posting_lists):
+            doc_ids = posting_arrays.intersect_doc_ids(posting_lists)
+            if doc_ids is not None:
+                return doc_ids
+        # intersect starting from the shortest list so the working set only ever shrinks.
+        posting_lists = sorted(posting_lists, key=lambda pl: len(pl.postings))
+        doc_ids = set(posting_lists[0]._doc_ids)
+        for posting_list in posting_lists[1:]:
+            doc_ids.intersection_update(posting_list._doc_ids)
+        return sorted(doc_ids)
+
+    @staticmethod
+    def union_doc_ids(posting_lists) -> list:
+        '''
+        Finds the documents that occur in any of the posting lists.
+        :param posting_lists: List of PostingList objects.
+        :return: Sorted list of doc ids.
+        '''
+        if posting_arrays.should_vectorize(posting_lists):
+            doc_ids = posting_arrays.union_doc_ids(posting_lists)
+            if doc_ids is not None:
+                return doc_ids
+        doc_ids = set()
+        for posting_list in posting_lists:
+            doc_ids.update(posting_list._doc_ids)
+        return sorted(doc_ids)
+
 class MemorySegment:
     def __init__(self):
         self.index = defaultdict(PostingList)
+        self.term_stats = TermStats()
+        self.vocabulary = Vocabulary()
+        self._terms = [] # sorted plain terms, for suggest
+        self.doc_ids = set() # ids of the documents with postings in the segment
         self._size_postings = 0 # number of bytes the postings in the index will occupy if packed. not incl. terms
 
     def get_size(self):
@@ -179,13 +353,54 @@ class MemorySegment:
         '''
         return self._size_postings
 
+    def get_posting_list(self, term: str) -> PostingList:
+        '''
+        :param term: str
+        :return: The PostingList of the term, or an empty PostingList if the term is not in the index.
+        '''
+        return self.index[term] if term in self.index else PostingList()
+
+    def doc_frequency(self, term: str) -> int:
+        '''
+        :param term: str
+        :return: Number of documents containing the term.
+        '''
+        return self.term_stats.doc_frequency(term)
+
+    def search_vocabulary(self, term: str, max_edits: int) -> list:
+        '''
+        :return: List of (distance, term) pairs for the terms within max_edits edits of the given term, see
+            Vocabulary.search.
+        '''
+        return self.vocabulary.search(term, max_edits)
+
+    def suggest(self, prefix: str, k: int = 10) -> list:
+        '''
+        Scans the terms starting with the prefix, which are kept sorted as they are added; unlike a Suggester, no
+        top terms are precomputed, since the document frequencies change with every added document.
+        :return: List of (term, document frequency) pairs of the k most frequent terms starting with the prefix,
+            ties going to the alphabetically first term, see Suggester.suggest.
+        '''
+        terms, doc_frequency = self._terms, self.term_stats.doc_frequency
+        lo, hi = prefix_range(terms, prefix)
+        indexes = nlargest(k, range(lo, hi), key=lambda i: (doc_frequency(terms[i]), -i))
+        return [(terms[i], doc_frequency(terms[i])) for i in indexes]
+
+    def get_impacts(self, term: str, tiered: bool = True) -> tuple:
+        '''
+        :param term: str
+        :param tiered: Unused, a memory segment has no tiers. See DiskSegment.get_impacts.
+        :return: (list of (doc_id, impact) pairs of every posting of the term, 0)
+        '''
+        return self.get_posting_list(term).impacts(), 0
+
     def do_one_word_query(self, term: str) -> list:
         '''
         Executes a one word query on the index with the given term.
         :param term: str
         :return: List of matching doc ids.
         '''
-        posting_list = self.index[term]
+        posting_list = self.get_posting_list(term)
         doc_ids = [posting.doc_id for posting in posting_list.postings]
         return doc_ids
 
@@ -195,18 +410,39 @@ class MemorySegment:
         :param terms: List of strings representing the exact phrase in order.
         :return: List of matching doc ids.
         '''
-        term_postlists = [self.index[term] for term in terms]
-        phrase_postings = PostingList.find_phrases(term_postlists).postings
+        term_postlists = [self.get_posting_list(term) for term in terms]
+        with metrics.timer("find_phrases"):
+            phrase_postings = PostingList.find_phrases(term_postlists).postings
         doc_ids = [posting.doc_id for posting in phrase_postings]
         return doc_ids
 
+    def do_proximity_query(self, terms: list, max_distance: int, ordered: bool = False) -> list:
+        '''
+        Executes a proximity query on the index: finds documents where all the terms occur within max_distance
+        positions of each other (in order, if ordered).
+        :param terms: List of strings.
+        :param max_distance: int
+        :param ordered: Whether the terms must occur in the given order.
+        :return: List of matching doc ids.
+        '''
+        if any(term not in self.index for term in terms):
+            return []
+        term_postlists = [self.index[term] for term in terms]
+        with metrics.timer("find_near"):
+            near_postings = PostingList.find_near(term_postlists, max_distance, ordered).postings
+        return [posting.doc_id for posting in near_postings]
+
     def add_token(self, term: str, doc_id, position: int):
         '''
         Adds a token to the index.
         A Token is a (term, doc_id, position) triplet, indicating that the term occurred in
         the document corresponding to doc_id at the given position.
         '''
-        self.index[term].add_posting(Posting(doc_id, [position]))
+        if term not in self.index and is_plain_term(term):
+            self._add_plain_term(term)
+        new_doc = self.index[term].add_posting(Posting(doc_id, [position]))
+        self.term_stats.add_occurrences(term, 1 if new_doc else 0, 1)
+        self.doc_ids.add(doc_id)
         self._size_postings += 4 + 4
 
     def add_posting(self, term: str, posting: Posting):
@@ -216,11 +452,37 @@ class MemorySegment:
         :param posting: Posting
         :return: None
         '''
-        self.index[term].add_posting(posting)
+        if term not in self.index and is_plain_term(term):
+            self._add_plain_term(term)
+        new_doc = self.index[term].add_posting(posting)
+        self.term_stats.add_occurrences(term, 1 if new_doc else 0, len(posting.positions))
+        self.doc_ids.add(posting.doc_id)
 
         # not totally accurate size, but ok approximation
         self._size_postings += len(posting.positions)*4 + 4
 
+    def set_posting_list(self, term: str, posting_list: PostingList):
+        '''
+        Sets the posting list of a term that is not in the segment yet, e.g. when loading a saved index.
+        :param term: str
+        :param posting_list: PostingList
+        :return: None
+        '''
+        if is_plain_term(term):
+            self._add_plain_term(term)
+        self.index[term] = posting_list
+        num_positions = sum(len(posting.positions) for posting in posting_list.postings)
+        self.term_stats.set(term, len(posting_list.postings), num_positions, 0)
+        self.doc_ids.update(posting_list._doc_ids)
+        self._size_postings += num_positions * 4 + len(posting_list.postings) * 4
+
+    def _add_plain_term(self, term: str):
+        '''
+        Adds a term that is new to the segment to the vocabulary and to the sorted terms.
+        '''
+        self.vocabulary.add(term)
+        insort(self._terms, term)
+
     def merge_into_disk(self, disk_segment):
         '''
         Merges this memory segment into the given disk segment.
@@ -229,6 +491,7 @@ class MemorySegment:
         '''
         for term in self.index.keys():
             disk_segment.merge_posting_list(term, self.index[term])
+        disk_segment.sync()
 
     def clear(self):
         '''
@@ -237,4 +500,8 @@ class MemorySegment:
         '''
         # don't use dict.clear because the underlying hash table stays the same size
         self.index = defaultdict(PostingList)
+        self.term_stats = TermStats()
+        self.vocabulary = Vocabulary()
+        self._terms = []
+        self.doc_ids = set()
         gc.collect()
@@ -0,0 +1,257 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Lightweight instrumentation of the query path.
+Process-wide counters and histograms are kept in REGISTRY while metrics are enabled (see enable()), and can be
+dumped as JSON or in the Prometheus text format. Independently, a single query can be traced by passing
+trace=True to an Index query method, which attaches a Trace with per-stage timings to the Results.
+When metrics are disabled and no query is being traced, timer() and count() return right away.
+'''
+
+import json
+import threading
+import time
+
+# buckets for latency histograms, in seconds.
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+_enabled = False
+_active_traces = 0  # number of traces in progress, over all threads
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def enable(on: bool = True):
+    '''
+    Turns process-wide collection of counters and histograms on or off.
+    '''
+    global _enabled
+    _enabled = on
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "sum": self.sum,
+                "buckets": [[str(bound), count] for bound, count in zip(BUCKETS, self.counts)]}
+
+
+class Registry:
+    '''
+    Counters and histograms keyed by (name, labels), where labels is a sorted tuple of (label, value) pairs.
+    '''
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name: str, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with _lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with _lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def reset(self):
+        with _lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def to_json(self) -> str:
+        def entry(key, value):
+            return {"name": key[0], "labels": dict(key[1]), "value": value}
+        with _lock:
+            return json.dumps({
+                "counters": [entry(key, value) for key, value in sorted(self.counters.items())],
+                "histograms": [entry(key, hist.to_dict()) for key, hist in sorted(self.histograms.items())],
+            }, indent=2)
+
+    def to_prometheus(self, prefix: str = "naive_ix_") -> str:
+        def labels_str(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(k + '="' + str(v) + '"' for k, v in pairs) + "}"
+        lines = []
+        with _lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append("# TYPE " + prefix + name + " counter")
+                    typed.add(name)
+                lines.append(prefix + name + labels_str(labels) + " " + repr(value))
+            for (name, labels), hist in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append("# TYPE " + prefix + name + " histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, hist.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(prefix + name + "_bucket" + labels_str(labels, [("le", le)]) + " " + str(cumulative))
+                lines.append(prefix + name + "_sum" + labels_str(labels) + " " + repr(hist.sum))
+                lines.append(prefix + name + "_count" + labels_str(labels) + " " + str(hist.count))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Trace:
+    '''
+    Per-query record of the time spent in each stage and of the work done:
+    stages maps stage name to [total seconds, number of calls], counters maps e.g. "postings_decoded" to a count.
+    '''
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.total_seconds = 0.0
+
+    def add_time(self, stage: str, seconds: float):
+        entry = self.stages.setdefault(stage, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def add_count(self, name: str, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        return {
+            "total_ms": self.total_seconds * 1000,
+            "stages": {stage: {"ms": secs * 1000, "calls": calls} for stage, (secs, calls) in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+    def __str__(self):
+        lines = ["total: %.3f ms" % (self.total_seconds * 1000)]
+        for stage, (secs, calls) in sorted(self.stages.items(), key=lambda item: -item[1][0]):
+            lines.append("  %-28s %9.3f ms  (%d calls)" % (stage, secs * 1000, calls))
+        for name, value in sorted(self.counters.items()):
+            lines.append("  %-28s %9d" % (name, value))
+        return "\n".join(lines)
+
+
+def current_trace():
+    '''
+    :return: The Trace of the query in progress on this thread, or None.
+    '''
+    return getattr(_local, "trace", None)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        trace = current_trace()
+        if trace is not None:
+            trace.add_time(self.stage, seconds)
+        if _enabled:
+            REGISTRY.observe("stage_seconds", seconds, stage=self.stage)
+        return False
+
+
+def timer(stage: str):
+    '''
+    Context manager timing a stage of the current query.
+    :param stage: Stage name, e.g. "disk_segment.lookup".
+    '''
+    if not (_enabled or _active_traces):
+        return _NULL_TIMER
+    return _Timer(stage)
+
+
+def count(name: str, value=1):
+    '''
+    Adds to a counter of the current query's trace and to the process-wide counter "<name>_total".
+    :param name: Counter name, e.g. "bytes_read".
+    :param value: Amount to add.
+    '''
+    if not (_enabled or _active_traces):
+        return
+    trace = current_trace()
+    if trace is not None:
+        trace.add_count(name, value)
+    if _enabled:
+        REGISTRY.inc(name + "_total", value)
+
+
+class query:
+    '''
+    Context manager wrapped around the execution of a query of the given type. Counts the query and records its
+    latency when metrics are enabled, and traces it if trace is True:
+        with metrics.query("free_text", trace) as q:
+            ...
+            return q.attach(results)
+    '''
+    def __init__(self, query_type: str, trace: bool = False):
+        self.query_type = query_type
+        self.trace = Trace() if trace else None
+
+    def __enter__(self):
+        global _active_traces
+        if self.trace is not None:
+            _local.trace = self.trace
+            with _lock:
+                _active_traces += 1
+        self.start = time.perf_counter()
+        return self
+
+    def attach(self, results):
+        '''
+        Attaches the trace (if any) to the query's Results.
+        :return: results
+        '''
+        results.trace = self.trace
+        return results
+
+    def __exit__(self, *exc):
+        global _active_traces
+        seconds = time.perf_counter() - self.start
+        if self.trace is not None:
+            self.trace.total_seconds = seconds
+            _local.trace = None
+            with _lock:
+                _active_traces -= 1
+        if _enabled:
+            REGISTRY.inc("queries_total", type=self.query_type)
+            REGISTRY.observe("query_seconds", seconds, type=self.query_type)
+        return False
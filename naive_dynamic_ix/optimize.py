@@ -0,0 +1,155 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Offline optimize (force-merge) of an index directory. Every save rewrites the posting lists of the terms it touches
+with merge_posting_list, and the hash database behind the disk segment never gives the old space back, so after many
+saves the file is fragmented and much larger than its contents. The optimize pass copies the posting lists, in term
+order, into a freshly written database (whose hash table is sized for them up front, for Berkeley DB), and the
+documents into a fresh document store, drops the high-impact tiers left stale by earlier merges and carries over the
+term stats, vocabulary and suggester. The copy is then checked against the source, key by key, before the index is
+switched to it as described in naive_dynamic_ix.rewrite. The copy can be written with another storage backend, which
+converts the index, e.g. from Berkeley DB to SQLite.
+Values are streamed as stored, one at a time, in a key range scan of the source (which Berkeley DB files answer by
+sorting their keys). What is held in memory is the term dictionary, i.e. the term stats, vocabulary, suggester and
+Bloom filter that the index keeps in memory anyway, plus the list of keys of each copy, read back once to count
+them; it does not grow with the size of the posting lists or documents. The index must not be in use by another
+process.
+'''
+
+import argparse
+import json
+import os
+from pickle import loads
+from naive_dynamic_ix.index import Index
+from naive_dynamic_ix.disk_segment import DiskSegment
+from naive_dynamic_ix.docstore import DocumentStore
+from naive_dynamic_ix.rewrite import index_size, next_filename, switch_files
+from naive_dynamic_ix.storage import BACKENDS
+from naive_dynamic_ix.terms import is_tier_key, TIER_PREFIX
+
+
+def _is_stale_tier(segment: DiskSegment, key: str, value: bytes) -> bool:
+    '''
+    :return: Whether the value of a tier key is out of date with the posting list of its term, see
+        DiskSegment.get_impacts.
+    '''
+    return loads(value)[0] != segment.doc_frequency(key[len(TIER_PREFIX):])
+
+
+def _segment_items(source: DiskSegment):
+    '''
+    :return: Iterator over the (key, value) pairs of the posting lists and tiers of a segment in term order, leaving
+        out the stale tiers, i.e. what _copy_segment copies.
+    '''
+    for key, value in source.index.range():
+        if not (is_tier_key(key) and _is_stale_tier(source, key, value)):
+            yield key, value
+
+
+def _copy_segment(source: DiskSegment, filename: str, backend: str) -> tuple:
+    '''
+    Copies the posting lists and tiers of a segment, in term order, into a new segment file.
+    :return: (number of copied keys, number of stale tiers dropped)
+    '''
+    # the tier keys are few next to the terms, the hash table is sized for the terms
+    target = DiskSegment.from_file(filename, tier_threshold=source.tier_threshold,
+                                   expected_keys=len(source.term_stats), backend=backend)
+    copied = 0
+    dropped = 0
+    for key, value in source.index.range():
+        if is_tier_key(key) and _is_stale_tier(source, key, value):
+            dropped += 1
+        else:
+            target.index[key] = value
+            copied += 1
+    target.adopt_sidecars(source)
+    target.sync()
+    target.close()
+    return copied, dropped
+
+
+def _copy_docstore(source: DocumentStore, filename: str, backend: str, expected_keys: int) -> int:
+    '''
+    Copies the documents into a new document store file.
+    :param expected_keys: Number of documents, to size a new Berkeley DB file.
+    :return: Number of copied keys.
+    '''
+    target = DocumentStore.from_file(filename, expected_keys=expected_keys, backend=backend)
+    copied = 0
+    for key, value in source.repo.range():
+        target.repo[key] = value
+        copied += 1
+    target.sync()
+    target.close()
+    return copied
+
+
+def _verify_copy(items, target, num_keys: int, what: str):
+    '''
+    Checks that the target storage holds exactly the given items. Raises a ValueError otherwise.
+    :param items: Iterable of the (key, value) pairs that were copied.
+    :param target: Storage of the copy.
+    :param num_keys: Number of copied keys.
+    '''
+    if len(target.keys()) != num_keys:
+        raise ValueError("The optimized " + what + " has " + str(len(target.keys())) + " keys instead of " +
+                         str(num_keys))
+    for key, value in items:
+        if target[key] != value:
+            raise ValueError("The optimized " + what + " differs from the source at key " + repr(key))
+
+
+def optimize(directory: str, verify: bool = True, backend: str = None) -> dict:
+    '''
+    Rewrites the segment and document store of an index directory into compact new files and switches to them.
+    Incremental snapshots can still be taken afterwards.
+    :param directory: Index directory, see Index.open. It must not have delta segments.
+    :param verify: Check the new files against the old ones before switching.
+    :param backend: Storage backend of the new files, see naive_dynamic_ix.storage, or None to keep the backend of
+        the index.
+    :return: Report dict with the number of terms, documents and dropped stale tiers and the index size in bytes
+        before and after.
+    '''
+    ix = Index.open(directory)
+    try:
+        if ix.delta_filenames:
+            raise ValueError("Cannot optimize an index with delta segments")
+        ix.save()
+        report = {"bytes_before": index_size(directory)}
+        source = ix.disk_segment
+        segment_name = next_filename(directory, ix.manifest.segments[0]["file"], "segment.db")
+        docstore_name = next_filename(directory, ix.manifest.docstore, "docs.db")
+        backend = backend or ix.storage
+        num_keys, report["dropped_tiers"] = _copy_segment(source, os.path.join(directory, segment_name), backend)
+        num_documents = _copy_docstore(ix.docstore, os.path.join(directory, docstore_name), backend, ix.doc_count)
+        if verify:
+            target = DiskSegment.from_file(os.path.join(directory, segment_name), read_only=True)
+            try:
+                _verify_copy(_segment_items(source), target.index, num_keys, "segment")
+                if target.term_stats.stats != source.term_stats.stats:
+                    raise ValueError("The term stats of the optimized segment differ from the source")
+            finally:
+                target.close()
+            target = DocumentStore.from_file(os.path.join(directory, docstore_name), read_only=True)
+            try:
+                _verify_copy(ix.docstore.repo.range(), target.repo, num_documents, "document store")
+            finally:
+                target.close()
+        report["terms"] = len(source.term_stats)
+        report["documents"] = num_documents
+    finally:
+        ix.close()
+    switch_files(ix, segment_name, docstore_name, keep_wal_archive=True, storage=backend)
+    report["bytes_after"] = index_size(directory)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Optimize an index directory that is not in use.")
+    parser.add_argument("index_dir")
+    parser.add_argument("--no-verify", action="store_true", help="don't check the new files before switching")
+    parser.add_argument("--storage", choices=BACKENDS, help="storage backend of the new files")
+    args = parser.parse_args()
+    print(json.dumps(optimize(args.index_dir, not args.no_verify, args.storage), indent=2))
@@ -0,0 +1,230 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Optional NumPy-backed implementations of the posting list operations in memory_segment.
+PostingList and Posting call into this module for long inputs and fall back to their pure Python loops
+when NumPy is not installed.
+'''
+
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# below this many postings (summed over all inputs) the Python loops beat the cost of packing into arrays.
+MIN_VECTORIZE_POSTINGS = 256
+# same, for the number of positions in Posting.merge_postings.
+MIN_VECTORIZE_POSITIONS = 1024
+
+
+def should_vectorize(posting_lists) -> bool:
+    '''
+    :param posting_lists: List of PostingList objects.
+    :return: Whether an operation over the posting lists should take the vectorized path.
+    '''
+    return np is not None and sum(len(pl.postings) for pl in posting_lists) >= MIN_VECTORIZE_POSTINGS
+
+
+class PostingArrays:
+    '''
+    A PostingList packed into parallel int32 arrays. The ith posting belongs to the document with
+    ordinal doc_ords[i] and has positions positions[offsets[i]:offsets[i+1]].
+    Doc ordinals index into the sorted array of doc ids shared by all the PostingArrays taking part
+    in one operation (see pack()), so comparing ordinals is the same as comparing doc ids.
+    '''
+    def __init__(self, doc_ords, offsets, positions):
+        self.doc_ords = doc_ords
+        self.offsets = offsets
+        self.positions = positions
+
+    def keys(self, shift: int = 0):
+        '''
+        Returns one int64 key (doc_ord << 32 | position - shift) per position, in ascending order.
+        Positions smaller than shift are dropped.
+        :param shift: int to subtract from every position.
+        :return: numpy int64 array.
+        '''
+        ords = np.repeat(self.doc_ords.astype(np.int64), np.diff(self.offsets))
+        positions = self.positions.astype(np.int64) - shift
+        keep = positions >= 0
+        return (ords[keep] << 32) | positions[keep]
+
+
+def _first_of_runs(sorted_arr):
+    '''
+    :return: Boolean mask that is True at the first element of every run of equal values in a sorted array.
+    '''
+    mask = np.empty(len(sorted_arr), dtype=bool)
+    mask[:1] = True
+    np.not_equal(sorted_arr[1:], sorted_arr[:-1], out=mask[1:])
+    return mask
+
+
+def _sorted_union(arr_1, arr_2):
+    '''
+    Sorted union of two arrays. Cheaper than np.union1d, which may hash rather than sort.
+    '''
+    merged = np.concatenate((arr_1, arr_2))
+    merged.sort(kind='mergesort')
+    return merged[_first_of_runs(merged)]
+
+
+def _doc_id_array(doc_ids: list):
+    '''
+    Converts a list of doc ids to a numpy array that sorts the same way as the Python objects do,
+    or returns None if there is no such array (e.g. mixed types), in which case callers fall back to Python.
+    '''
+    if not doc_ids:
+        return np.array([], dtype=np.int64)
+    arr = np.array(doc_ids)
+    if arr.dtype.kind in 'iu':
+        return arr
+    if arr.dtype.kind == 'U' and set(map(type, doc_ids)) == {str}:
+        return arr
+    return None
+
+
+def _packed(posting_list):
+    '''
+    Returns (doc ids array, offsets, positions) for the posting list, cached on the posting list until
+    it is next modified. These do not depend on the doc ordinal space so can be reused across operations.
+    '''
+    if getattr(posting_list, '_packed', None) is None:
+        postings = posting_list.postings
+        lengths = np.fromiter((len(p.positions) for p in postings), dtype=np.int64, count=len(postings))
+        offsets = np.zeros(len(postings) + 1, dtype=np.int32)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.fromiter(chain.from_iterable(p.positions for p in postings), dtype=np.int32,
+                                count=int(offsets[-1]))
+        posting_list._packed = (_doc_id_array(posting_list._doc_ids), offsets, positions)
+    return posting_list._packed
+
+
+def pack(posting_lists):
+    '''
+    Packs the given posting lists into PostingArrays over a shared doc ordinal space.
+    :param posting_lists: List of PostingList objects.
+    :return: (doc_ids, list of PostingArrays), where doc_ids is the sorted numpy array of every doc id
+        in the inputs, or None if the doc ids can't be vectorized.
+    '''
+    packed = [_packed(pl) for pl in posting_lists]
+    id_arrays = [p[0] for p in packed]
+    if any(arr is None for arr in id_arrays):
+        return None
+    id_arrays = [arr for arr in id_arrays if len(arr)]
+    if len(set(arr.dtype.kind for arr in id_arrays)) > 1:
+        return None
+    if not id_arrays:
+        id_arrays = [np.array([], dtype=np.int64)]
+    all_ids = np.concatenate(id_arrays)
+    # sort the doc ids once, then number each distinct doc id in sorted order.
+    order = np.argsort(all_ids, kind='mergesort')
+    sorted_ids = all_ids[order]
+    first = _first_of_runs(sorted_ids)
+    doc_ids = sorted_ids[first]
+    inverse = np.empty(len(all_ids), dtype=np.int32)
+    inverse[order] = np.cumsum(first) - 1
+    arrays, start = [], 0
+    for ids, offsets, positions in packed:
+        arrays.append(PostingArrays(inverse[start:start + len(ids)], offsets, positions))
+        start += len(ids)
+    return doc_ids, arrays
+
+
+def _unpack_keys(doc_ids, keys) -> list:
+    '''
+    Splits sorted (doc_ord << 32 | position) keys back into postings.
+    :return: List of (doc_id, positions) pairs sorted by doc id.
+    '''
+    if len(keys) == 0:
+        return []
+    ords = keys >> 32
+    positions = (keys & 0xffffffff).tolist()
+    starts = np.flatnonzero(_first_of_runs(ords))
+    ids = doc_ids[ords[starts]].tolist()
+    bounds = starts.tolist() + [len(positions)]
+    return [(ids[i], positions[bounds[i]:bounds[i + 1]]) for i in range(len(ids))]
+
+
+def merge_lists(pl_1, pl_2):
+    '''
+    Vectorized PostingList.merge_lists. Only the positions of documents found in both lists are merged;
+    every other Posting is reused as is.
+    :return: List whose items are either Postings of the inputs or (doc_id, positions) pairs of merged postings,
+        sorted by doc id, or None if the inputs can't be vectorized.
+    '''
+    packed = pack([pl_1, pl_2])
+    if packed is None:
+        return None
+    doc_ids, (a, b) = packed
+    all_ords = _sorted_union(a.doc_ords, b.doc_ords)
+    common = np.intersect1d(a.doc_ords, b.doc_ords, assume_unique=True)
+
+    merged = [None] * len(all_ords)
+    for i, posting in zip(np.searchsorted(all_ords, a.doc_ords).tolist(), pl_1.postings):
+        merged[i] = posting
+    for i, posting in zip(np.searchsorted(all_ords, b.doc_ords).tolist(), pl_2.postings):
+        merged[i] = posting
+    if len(common):
+        a_keys, b_keys = a.keys(), b.keys()
+        a_keys = a_keys[np.isin(a_keys >> 32, common)]
+        b_keys = b_keys[np.isin(b_keys >> 32, common)]
+        for i, pair in zip(np.searchsorted(all_ords, common).tolist(),
+                           _unpack_keys(doc_ids, _sorted_union(a_keys, b_keys))):
+            merged[i] = pair
+    return merged
+
+
+def merge_positions(positions_1: list, positions_2: list) -> list:
+    '''
+    Vectorized merge of two sorted position lists, dropping duplicates.
+    '''
+    return _sorted_union(np.array(positions_1, dtype=np.int64), np.array(positions_2, dtype=np.int64)).tolist()
+
+
+def find_phrases(posting_lists):
+    '''
+    Vectorized PostingList.find_phrases. A phrase starting at position p of a document is found by
+    intersecting the (doc, position - i) keys of the ith posting list across all the posting lists.
+    :return: List of (doc_id, start positions) pairs sorted by doc id, or None if the inputs can't be vectorized.
+    '''
+    packed = pack(posting_lists)
+    if packed is None:
+        return None
+    doc_ids, arrays = packed
+    keys = arrays[0].keys()
+    for i, arr in enumerate(arrays[1:]):
+        if len(keys) == 0:
+            break
+        keys = np.intersect1d(keys, arr.keys(i + 1), assume_unique=True)
+    return _unpack_keys(doc_ids, keys)
+
+
+def intersect_doc_ids(posting_lists):
+    '''
+    Vectorized PostingList.intersect_doc_ids.
+    :return: Sorted list of the doc ids present in every posting list, or None if the inputs can't be vectorized.
+    '''
+    packed = pack(posting_lists)
+    if packed is None:
+        return None
+    doc_ids, arrays = packed
+    ords = arrays[0].doc_ords
+    for arr in arrays[1:]:
+        ords = np.intersect1d(ords, arr.doc_ords, assume_unique=True)
+    return doc_ids[ords].tolist()
+
+
+def union_doc_ids(posting_lists):
+    '''
+    Vectorized PostingList.union_doc_ids.
+    :return: Sorted list of the doc ids present in any of the posting lists, or None if the inputs can't be vectorized.
+    '''
+    packed = pack(posting_lists)
+    if packed is None:
+        return None
+    return packed[0].tolist()
@@ -0,0 +1,446 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Boolean query language. parse() turns a query string such as
+    "albert einstein" AND (bomb OR atomic) -movie
+into an AST, and QueryPlanner turns the AST into a QueryPlan that can be executed over the index segments.
+
+Grammar (AND binds tighter than OR, and is implied between adjacent clauses):
+    query   := and_expr ('OR' and_expr)*
+    and_expr := unary (['AND'] unary)*
+    unary   := ('-' | 'NOT') unary | primary
+    primary := '(' query ')' | '"' word* '"' | word
+A word of the form "title:word" only matches in the title field (see naive_dynamic_ix.terms).
+'''
+
+import re
+from naive_dynamic_ix.memory_segment import PostingList
+from naive_dynamic_ix.terms import FIELDS, field_key
+
+
+class QueryParseError(ValueError):
+    pass
+
+
+class Term:
+    def __init__(self, word):
+        self.word = word
+
+    def __repr__(self):
+        return "Term(" + repr(self.word) + ")"
+
+    def __eq__(self, other):
+        return isinstance(other, Term) and self.word == other.word
+
+
+class Phrase:
+    def __init__(self, words: list, tokens: list = None):
+        '''
+        :param words: The words of the phrase; once normalized, its index terms, without stopwords.
+        :param tokens: Once normalized, the phrase tokenized with its stopwords if it has any, else None.
+        '''
+        self.words = words
+        self.tokens = tokens
+
+    def __repr__(self):
+        if self.tokens is None:
+            return "Phrase(" + repr(self.words) + ")"
+        return "Phrase(" + repr(self.words) + ", " + repr(self.tokens) + ")"
+
+    def __eq__(self, other):
+        return isinstance(other, Phrase) and self.words == other.words and self.tokens == other.tokens
+
+
+class And:
+    def __init__(self, children: list):
+        self.children = children
+
+    def __repr__(self):
+        return "And(" + repr(self.children) + ")"
+
+    def __eq__(self, other):
+        return isinstance(other, And) and self.children == other.children
+
+
+class Or:
+    def __init__(self, children: list):
+        self.children = children
+
+    def __repr__(self):
+        return "Or(" + repr(self.children) + ")"
+
+    def __eq__(self, other):
+        return isinstance(other, Or) and self.children == other.children
+
+
+class Not:
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return "Not(" + repr(self.child) + ")"
+
+    def __eq__(self, other):
+        return isinstance(other, Not) and self.child == other.child
+
+
+_TOKEN_RE = re.compile(r'\s*(?:(?P<phrase>"[^"]*"?)|(?P<paren>[()])|(?P<minus>(?<![^\s(])-)|(?P<word>[^\s()"]+))')
+
+
+def tokenize(query: str) -> list:
+    '''
+    Splits a query string into (kind, value) tokens, where kind is one of "phrase", "paren", "minus", "word".
+    A minus sign is only an operator at the start of a word, so "x-ray" stays one word.
+    '''
+    tokens = []
+    pos = 0
+    query = query.rstrip()
+    while pos < len(query):
+        match = _TOKEN_RE.match(query, pos)
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "phrase":
+            if len(value) < 2 or not value.endswith('"'):
+                raise QueryParseError("Unterminated phrase in query: " + query)
+            value = value[1:-1]
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+def parse(query: str):
+    '''
+    Parses a query string into an AST of Term, Phrase, And, Or and Not nodes.
+    :param query: str
+    :return: Root node of the AST, or None for an empty query.
+    '''
+    parser = _Parser(tokenize(query))
+    if not parser.tokens:
+        return None
+    node = parser.parse_or()
+    if parser.peek() is not None:
+        raise QueryParseError("Unexpected " + repr(parser.peek()[1]) + " in query: " + query)
+    return node
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise QueryParseError("Unexpected end of query")
+        self.i += 1
+        return token
+
+    def at_keyword(self, keyword):
+        return self.peek() == ("word", keyword)
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.at_keyword("OR"):
+            self.next()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        children = [self.parse_unary()]
+        while True:
+            token = self.peek()
+            if token is None or token == ("paren", ")") or self.at_keyword("OR"):
+                break
+            if self.at_keyword("AND"):
+                self.next()
+            children.append(self.parse_unary())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_unary(self):
+        if self.peek() is not None and (self.peek()[0] == "minus" or self.at_keyword("NOT")):
+            self.next()
+            return Not(self.parse_unary())
+        return self.parse_primary()
+
+    def parse_primary(self):
+        kind, value = self.next()
+        if kind == "paren" and value == "(":
+            node = self.parse_or()
+            if self.next() != ("paren", ")"):
+                raise QueryParseError("Expected )")
+            return node
+        if kind == "phrase":
+            return Phrase(value.split())
+        if kind == "word" and value not in ("AND", "OR", "NOT"):
+            return Term(value)
+        raise QueryParseError("Unexpected " + repr(value))
+
+
+class _SegmentContext:
+    '''
+    Loads each term's posting list from one segment at most once per query, counting the postings touched.
+    '''
+    def __init__(self, segment, touched: dict):
+        self.segment = segment
+        self.posting_lists = {}
+        self.touched = touched
+
+    def posting_list(self, term) -> PostingList:
+        if term not in self.posting_lists:
+            posting_list = self.segment.get_posting_list(term)
+            self.posting_lists[term] = posting_list
+            self.touched[term] = self.touched.get(term, 0) + len(posting_list.postings)
+        return self.posting_lists[term]
+
+
+class TermScan:
+    def __init__(self, term, estimate):
+        self.term = term
+        self.estimate = estimate
+
+    def evaluate(self, ctx, candidates):
+        doc_ids = ctx.posting_list(self.term)._doc_ids
+        return set(doc_ids) if candidates is None else candidates.intersection(doc_ids)
+
+    def describe(self, touched):
+        return ["TERM " + self.term + "  est=" + str(self.estimate) + " postings=" + str(touched.get(self.term, 0))]
+
+
+class PhraseMatch:
+    '''
+    Finds the phrase by position, looking only at the candidate documents when there are any.
+    A phrase with stopwords is matched with the bigram posting lists, see Index._do_bigram_phrase_query.
+    '''
+    def __init__(self, terms, estimate, tokens: list = None, index=None):
+        self.terms = terms
+        self.estimate = estimate
+        self.tokens = tokens
+        self.index = index
+
+    def evaluate(self, ctx, candidates):
+        if self.tokens is not None:
+            if candidates is not None and not candidates:
+                return set()
+            doc_ids = self.index._do_bigram_phrase_query(ctx.segment, self.tokens, self.terms)
+            return doc_ids if candidates is None else doc_ids & candidates
+        posting_lists = [ctx.posting_list(term) for term in self.terms]
+        if candidates is None:
+            candidates = set(PostingList.intersect_doc_ids(posting_lists))
+        if not candidates:
+            return set()
+        posting_lists = [PostingList([p for p in pl.postings if p.doc_id in candidates]) for pl in posting_lists]
+        return set(p.doc_id for p in PostingList.find_phrases(posting_lists).postings)
+
+    def describe(self, touched):
+        return ["PHRASE \"" + " ".join(self.tokens or self.terms) + "\"  est=" + str(self.estimate)]
+
+
+class Union:
+    def __init__(self, children):
+        self.children = children
+        self.estimate = sum(child.estimate for child in children)
+
+    def evaluate(self, ctx, candidates):
+        doc_ids = set()
+        for child in self.children:
+            doc_ids |= child.evaluate(ctx, candidates)
+        return doc_ids
+
+    def describe(self, touched):
+        lines = ["UNION  est=" + str(self.estimate)]
+        for child in self.children:
+            lines.extend("  " + line for line in child.describe(touched))
+        return lines
+
+
+class Intersect:
+    '''
+    Intersects the positive clauses from the smallest to the largest, so each step only has to look at the survivors
+    of the previous ones. Negated clauses then remove documents from the survivors (they never have to be
+    complemented), and phrases are verified last, on whatever candidates are left.
+    '''
+    def __init__(self, positives, negatives, phrases):
+        self.positives = sorted(positives, key=lambda child: child.estimate)
+        self.negatives = sorted(negatives, key=lambda child: child.estimate)
+        self.phrases = sorted(phrases, key=lambda child: child.estimate)
+        self.estimate = self.positives[0].estimate
+
+    def evaluate(self, ctx, candidates):
+        for child in self.positives:
+            candidates = child.evaluate(ctx, candidates)
+            if not candidates:
+                return set()
+        for child in self.negatives:
+            candidates = candidates - child.evaluate(ctx, candidates)
+            if not candidates:
+                return set()
+        for child in self.phrases:
+            candidates = child.evaluate(ctx, candidates)
+            if not candidates:
+                return set()
+        return candidates
+
+    def describe(self, touched):
+        lines = ["INTERSECT  est=" + str(self.estimate)]
+        for child in self.positives:
+            lines.extend("  " + line for line in child.describe(touched))
+        for child in self.negatives:
+            lines.append("  EXCLUDE")
+            lines.extend("    " + line for line in child.describe(touched))
+        for child in self.phrases:
+            lines.append("  VERIFY")
+            lines.extend("    " + line for line in child.describe(touched))
+        return lines
+
+
+class QueryPlan:
+    def __init__(self, root, terms: list, segments: list, newer_doc_ids: list = None):
+        '''
+        :param root: Root plan node, or None if the query can't match anything.
+        :param terms: The positive query terms, for snippets.
+        :param segments: The segments to execute the plan over.
+        :param newer_doc_ids: For each segment, the doc id sets of the newer segments whose documents are not taken
+            from it, see Index.newer_doc_ids. None to take every match.
+        '''
+        self.root = root
+        self.terms = terms
+        self.segments = segments
+        self.newer_doc_ids = newer_doc_ids if newer_doc_ids is not None else [[] for segment in segments]
+        self.touched = {}
+
+    def execute(self) -> list:
+        '''
+        Executes the plan over every segment.
+        :return: Sorted list of matching doc ids.
+        '''
+        self.touched = {}
+        doc_ids = set()
+        if self.root is not None:
+            for segment, newer in zip(self.segments, self.newer_doc_ids):
+                matches = self.root.evaluate(_SegmentContext(segment, self.touched), None)
+                doc_ids.update(doc_id for doc_id in matches if not any(doc_id in ids for ids in newer))
+        return sorted(doc_ids)
+
+    def explain(self) -> str:
+        '''
+        :return: A description of the plan with the estimated document frequency of each step and the number of
+            postings each term touched in the last execution.
+        '''
+        if self.root is None:
+            return "EMPTY"
+        lines = self.root.describe(self.touched)
+        lines.append("postings touched: " + str(sum(self.touched.values())))
+        return "\n".join(lines)
+
+
+class QueryPlanner:
+    '''
+    Turns query ASTs into QueryPlans for an Index, using the document frequencies of the terms as cost estimates.
+    '''
+    def __init__(self, index):
+        self.index = index
+        self.segments = index.segments()
+        self.terms = []
+
+    def plan(self, query) -> QueryPlan:
+        '''
+        :param query: Query string or AST root.
+        :return: QueryPlan
+        '''
+        self.terms = []
+        if isinstance(query, str):
+            query = parse(query)
+        node = self._normalize(query) if query is not None else None
+        root = self._plan(node) if node is not None else None
+        return QueryPlan(root, self.terms, self.segments, self.index.newer_doc_ids(self.segments))
+
+    def _normalize(self, node):
+        '''
+        Preprocesses words into index terms, drops stopwords outside of phrases and flattens nested ANDs and ORs.
+        Phrases with stopwords keep their tokens, so that they are matched exactly, like in Index.do_phrase_query.
+        :return: Normalized node, or None if nothing is left of it.
+        '''
+        if isinstance(node, Term):
+            field, sep, word = node.word.partition(":")
+            if not (sep and field in FIELDS):
+                field, word = None, node.word
+            if word.lower() in self.index.stopwords:
+                return None
+            term = self.index.preprocess_term(word)
+            if not term:
+                return None
+            return Term(field_key(field, term) if field else term)
+        if isinstance(node, Phrase):
+            tokens = self.index.tokenize(" ".join(node.words))
+            terms = [t for t in self.index.preprocess_query_terms(tokens) if t]
+            if len(tokens) > 1 and any(t in self.index.stopwords for t in tokens):
+                return Phrase(terms, tokens)
+            if not terms:
+                return None
+            return Term(terms[0]) if len(terms) == 1 else Phrase(terms)
+        if isinstance(node, Not):
+            child = self._normalize(node.child)
+            return Not(child) if child is not None else None
+        children = []
+        for child in node.children:
+            child = self._normalize(child)
+            if child is None:
+                continue
+            children.extend(child.children if type(child) is type(node) else [child])
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else type(node)(children)
+
+    def _doc_frequency(self, term) -> int:
+        return sum(segment.doc_frequency(term) for segment in self.segments)
+
+    def _phrase_match(self, node: Phrase, estimate: int = None) -> PhraseMatch:
+        '''
+        :param estimate: Estimated matches, or None for the doc frequency of the phrase's rarest term or bigram.
+        '''
+        if estimate is None:
+            keys = node.words
+            if node.tokens is not None:
+                keys = keys + [key for key, pos in
+                               self.index.extract_bigrams(node.tokens, self.index.normalize_tokens(node.tokens))]
+            estimate = min(self._doc_frequency(key) for key in keys)
+        return PhraseMatch(node.words, estimate, node.tokens, self.index)
+
+    def _plan(self, node, negated=False):
+        if isinstance(node, Term):
+            if not negated:
+                self.terms.append(node.word)
+            return TermScan(node.word, self._doc_frequency(node.word))
+        if isinstance(node, Phrase):
+            if not negated:
+                self.terms.extend(node.words)
+            return self._phrase_match(node)
+        if isinstance(node, Or):
+            return Union([self._plan(child, negated) for child in node.children])
+        if isinstance(node, Not):
+            raise QueryParseError("A query needs at least one clause that is not negated")
+        positives, negatives, phrases = [], [], []
+        for child in node.children:
+            if isinstance(child, Not):
+                negatives.append(self._plan(child.child, not negated))
+            elif isinstance(child, Phrase) and not child.words:
+                # a phrase of stopwords only has no terms to intersect, it is matched on its own
+                positives.append(self._plan(child, negated))
+            elif isinstance(child, Phrase):
+                # intersect the phrase's terms along with the other clauses, and only look at positions
+                # in the documents that survive.
+                for term in child.words:
+                    if all(not (isinstance(p, TermScan) and p.term == term) for p in positives):
+                        positives.append(self._plan(Term(term), negated))
+                estimate = min(p.estimate for p in positives if isinstance(p, TermScan) and p.term in child.words)
+                phrases.append(self._phrase_match(child, estimate))
+            else:
+                positives.append(self._plan(child, negated))
+        if not positives:
+            raise QueryParseError("A query needs at least one clause that is not negated")
+        return Intersect(positives, negatives, phrases)
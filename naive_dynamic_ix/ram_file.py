@@ -0,0 +1,92 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Single-file format of a RAM-only index (Index.in_memory), written and read back in one sequential pass.
+The file is a magic number followed by one pickle holding the index settings, the documents and, for every term,
+three packed arrays of unsigned ints: the numbers of the documents of its postings (indexes into the document
+list), their numbers of positions, and all their positions one after the other. This is several times smaller
+and faster to load than pickling the Posting objects themselves.
+'''
+
+import os
+import sys
+from array import array
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from naive_dynamic_ix.memory_segment import MemorySegment, PostingList, Posting
+
+MAGIC = b"NDIXRAM\n"
+FORMAT_VERSION = 1
+_TYPECODE = 'I'
+
+
+def _pack(values) -> bytes:
+    packed = array(_TYPECODE, values)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(data: bytes) -> array:
+    unpacked = array(_TYPECODE)
+    unpacked.frombytes(data)
+    if sys.byteorder != "little":
+        unpacked.byteswap()
+    return unpacked
+
+
+def save(filename: str, settings: dict, memory_segment: MemorySegment, documents: dict):
+    '''
+    Writes an index to the given file, replacing it atomically.
+    :param filename: str
+    :param settings: Dict of the index settings to save, e.g. the stopwords.
+    :param memory_segment: MemorySegment with the postings.
+    :param documents: Dict of doc id to (doc_title, doc_body).
+    :return: None
+    '''
+    doc_ids = list(documents)
+    doc_numbers = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+    postings = {}
+    for term, posting_list in memory_segment.index.items():
+        postings[term] = (_pack([doc_numbers[posting.doc_id] for posting in posting_list.postings]),
+                          _pack([len(posting.positions) for posting in posting_list.postings]),
+                          _pack([pos for posting in posting_list.postings for pos in posting.positions]))
+    data = dumps({
+        "format_version": FORMAT_VERSION,
+        "settings": settings,
+        "doc_ids": doc_ids,
+        "documents": [documents[doc_id] for doc_id in doc_ids],
+        "postings": postings,
+    }, HIGHEST_PROTOCOL)
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, 'wb') as f:
+        f.write(MAGIC + data)
+    os.replace(tmp_filename, filename)
+
+
+def load(filename: str) -> tuple:
+    '''
+    Reads an index written by save().
+    :param filename: str
+    :return: (settings dict, MemorySegment, dict of doc id to (doc_title, doc_body))
+    '''
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(filename + " is not a RAM-only index file")
+    contents = loads(memoryview(data)[len(MAGIC):])
+    if contents["format_version"] > FORMAT_VERSION:
+        raise ValueError("Index format version " + str(contents["format_version"]) +
+                         " is newer than the supported version " + str(FORMAT_VERSION))
+    doc_ids = contents["doc_ids"]
+    memory_segment = MemorySegment()
+    for term, (doc_numbers, counts, positions) in contents["postings"].items():
+        positions = _unpack(positions)
+        postings = []
+        start = 0
+        for doc_number, count in zip(_unpack(doc_numbers), _unpack(counts)):
+            postings.append(Posting(doc_ids[doc_number], positions[start:start + count].tolist()))
+            start += count
+        memory_segment.set_posting_list(term, PostingList(postings))
+    return contents["settings"], memory_segment, dict(zip(doc_ids, contents["documents"]))
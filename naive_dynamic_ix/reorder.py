@@ -0,0 +1,171 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Offline reordering of the documents of an index directory. Doc ids are whatever the documents were added with
+(e.g. page titles in dump order), so the postings of a term are sorted by arbitrary keys and documents with the same
+terms are scattered. The reorder pass gives every document an internal ordinal, 0, 1, 2, ..., in an order that puts
+similar documents next to each other, and rewrites the segment and the document store with the ordinals in place of
+the doc ids:
+- "minhash" sorts the documents by the MinHash signature of their sets of terms, so documents sharing rare terms
+  get nearby ordinals.
+- "title" sorts them by title.
+Small integers pickle smaller and compare faster than the doc ids, and the posting lists of related terms cover
+runs of nearby ordinals. The mapping to the doc ids is kept in a DocMap, which translates results back.
+The new files are switched to as described in naive_dynamic_ix.rewrite. The index must not be in use by another
+process.
+Memory use is linear in the number of documents, not in their size: each document is read and unpickled once for
+its sort key, and only the (sort key, stored key) pairs are kept, which are then replaced by the stored keys in the
+new order and their ordinals. Posting lists are rewritten one term at a time, and the stored bytes of each document
+are then fetched by key and copied under its ordinal, without being unpickled again.
+'''
+
+import argparse
+import json
+import os
+import random
+import time
+from naive_dynamic_ix.index import Index
+from naive_dynamic_ix.disk_segment import DiskSegment
+from naive_dynamic_ix.docstore import DocumentStore
+from naive_dynamic_ix.doc_map import DocMap
+from naive_dynamic_ix.dedup import MinHasher
+from naive_dynamic_ix.memory_segment import PostingList
+from naive_dynamic_ix.rewrite import index_size, next_filename, switch_files
+from naive_dynamic_ix.terms import is_plain_term, is_tier_key
+
+MINHASH = "minhash"
+TITLE = "title"
+ORDERS = (MINHASH, TITLE)
+NUM_PERM = 4  # length of the MinHash signatures sorted on
+NUM_HEAD_TERMS = 50  # queries are drawn from this many of the most frequent terms
+
+
+def sample_queries(ix: Index, num_queries: int, seed: int = 1) -> list:
+    '''
+    :return: List of num_queries two-term queries of frequent terms of the index.
+    '''
+    term_stats = ix.disk_segment.term_stats
+    terms = sorted((term for term in term_stats.terms() if is_plain_term(term)),
+                   key=lambda term: (-term_stats.doc_frequency(term), term))[:NUM_HEAD_TERMS]
+    rand = random.Random(seed)
+    return [rand.sample(terms, min(2, len(terms))) for _ in range(num_queries)]
+
+
+def measure(directory: str, queries: list, k: int = 10) -> dict:
+    '''
+    Times free text and top-k queries on an index directory.
+    :param directory: Index directory.
+    :param queries: List of lists of terms.
+    :param k: Number of results of the top-k queries.
+    :return: Dict with the index size in bytes and the mean and median latencies of each kind of query in ms.
+    '''
+    ix = Index.open(directory, read_only=True)
+    ix.segments()
+    report = {"bytes": index_size(directory)}
+    try:
+        for name, run in (("free_text", lambda terms: ix.do_free_text_query(terms)),
+                          ("top_k", lambda terms: ix.do_top_k_query(terms, k))):
+            latencies = []
+            for terms in queries:
+                start = time.perf_counter()
+                run(terms)
+                latencies.append((time.perf_counter() - start) * 1000)
+            latencies.sort()
+            report[name] = {"mean_ms": sum(latencies) / max(1, len(latencies)),
+                            "p50_ms": latencies[len(latencies) // 2] if latencies else 0.0}
+    finally:
+        ix.close()
+    return report
+
+
+def _sort_key(ix: Index, hasher: MinHasher, order: str, doc_id, doc: tuple):
+    doc_title, doc_body = doc
+    if order == TITLE:
+        return doc_title, repr(doc_id)
+    terms = ix.extract_terms(doc_title + " " + doc_body)
+    return tuple(hasher.signature(terms, shingle_size=1)), repr(doc_id)
+
+
+def _rewrite(ix: Index, order: str) -> tuple:
+    '''
+    Writes the reordered segment, document store and doc map of an index next to its files.
+    :return: (new segment name, new document store name, new doc map name), relative to the index directory.
+    '''
+    directory = ix.directory
+    manifest = ix.manifest
+    hasher = MinHasher(NUM_PERM)
+    # stored keys are ordinals if the index was reordered before. The sort keys end with the doc id, so they are
+    # unique and the stored keys are never compared.
+    order_keys = [(_sort_key(ix, hasher, order, ix.doc_map.doc_id(key) if ix.doc_map is not None else key, doc), key)
+                  for key, doc in ix.docstore.iter_documents()]
+    order_keys.sort()
+    stored = [key for sort_key, key in order_keys]  # stored keys by new ordinal
+    del order_keys
+    ordinals = {key: ordinal for ordinal, key in enumerate(stored)}
+
+    segment_name = next_filename(directory, manifest.segments[0]["file"], "segment.db")
+    segment = DiskSegment.from_file(os.path.join(directory, segment_name), tier_threshold=ix.tier_threshold,
+                                    backend=ix.storage)
+    for term in ix.disk_segment.keys():
+        if is_tier_key(term):
+            continue  # rewritten by merge_posting_list
+        posting_list = ix.disk_segment.get_posting_list(term)
+        segment.merge_posting_list(term, PostingList._from_pairs(
+            sorted((ordinals[posting.doc_id], posting.positions) for posting in posting_list.postings)))
+    segment.sync()
+    segment.close()
+
+    docstore_name = next_filename(directory, manifest.docstore, "docs.db")
+    docstore = DocumentStore.from_file(os.path.join(directory, docstore_name), backend=ix.storage)
+    for ordinal, key in enumerate(stored):
+        docstore.repo[ordinal] = ix.docstore.repo[key]
+    docstore.sync()
+    docstore.close()
+
+    doc_map_name = next_filename(directory, manifest.doc_map, "docmap.pickle")
+    DocMap([ix.doc_map.doc_id(key) for key in stored] if ix.doc_map is not None else stored).save(os.path.join(directory, doc_map_name))
+    return segment_name, docstore_name, doc_map_name
+
+
+def reorder(directory: str, order: str = MINHASH, num_queries: int = 100) -> dict:
+    '''
+    Reassigns the internal doc ordinals of an index directory and rewrites its segment and document store.
+    Any snapshot archive of the write-ahead log is dropped, so the next snapshot must be a full one.
+    :param directory: Index directory, see Index.open. It must not have delta segments.
+    :param order: MINHASH or TITLE.
+    :param num_queries: Number of queries timed before and after.
+    :return: Report dict with the number of documents and the index size and query latencies "before" and "after".
+    '''
+    if order not in ORDERS:
+        raise ValueError("Unknown order: " + repr(order))
+    ix = Index.open(directory)
+    try:
+        if ix.delta_filenames:
+            raise ValueError("Cannot reorder an index with delta segments")
+        ix.save()
+        queries = sample_queries(ix, num_queries)
+    finally:
+        ix.close()
+    report = {"order": order, "before": measure(directory, queries)}
+
+    ix = Index.open(directory)
+    try:
+        segment_name, docstore_name, doc_map_name = _rewrite(ix, order)
+        report["documents"] = ix.doc_count
+    finally:
+        ix.close()
+    switch_files(ix, segment_name, docstore_name, doc_map_name)
+
+    report["after"] = measure(directory, queries)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reorder the documents of an index directory that is not in use.")
+    parser.add_argument("index_dir")
+    parser.add_argument("--order", choices=ORDERS, default=MINHASH)
+    parser.add_argument("--queries", type=int, default=100, help="number of queries timed before and after")
+    args = parser.parse_args()
+    print(json.dumps(reorder(args.index_dir, args.order, args.queries), indent=2))
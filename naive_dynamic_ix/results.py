@@ -15,6 +15,32 @@ class Results:
         self.doc_ids = doc_ids
         self.doc_titles = doc_titles
         self.snippets = snippets
+        # scores of the documents, parallel to doc_ids, if the results are ranked.
+        self.scores = None
+        # metrics.Trace of the query, if it was traced.
+        self.trace = None
+
+    @staticmethod
+    def merge(results_list):
+        '''
+        Concatenates Results computed over disjoint sets of documents (e.g. the shards of a ShardedIndex).
+        If all of them are ranked, the merged results are ranked by score too.
+        :param results_list: Iterable of Results objects.
+        :return: Results object.
+        '''
+        results_list = list(results_list)
+        doc_ids, doc_titles, snippets, scores = [], [], [], []
+        for results in results_list:
+            doc_ids.extend(results.doc_ids)
+            doc_titles.extend(results.doc_titles)
+            snippets.extend(results.snippets)
+            scores.extend(results.scores or [])
+        if not results_list or any(results.scores is None for results in results_list):
+            return Results(doc_ids, doc_titles, snippets)
+        order = sorted(range(len(doc_ids)), key=lambda i: -scores[i])
+        merged = Results([doc_ids[i] for i in order], [doc_titles[i] for i in order], [snippets[i] for i in order])
+        merged.scores = [scores[i] for i in order]
+        return merged
 
     def __str__(self):
         return "(" + ",\n".join(
@@ -0,0 +1,105 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Helpers of the offline passes that rewrite the segment and document store of an index directory (see
+naive_dynamic_ix.reorder and naive_dynamic_ix.optimize). The new files are written next to the old ones under
+versioned names ("segment.1.db", "segment.2.db", ...), and switched to by replacing the manifest, which is atomic,
+so a crash leaves either the old or the new index. The old files are deleted afterwards.
+'''
+
+import glob
+import os
+import shutil
+from naive_dynamic_ix.index import Index
+from naive_dynamic_ix.manifest import MANIFEST_FILENAME
+from naive_dynamic_ix.snapshot import SEGMENT_SIDECARS
+
+
+def segment_files(filename: str) -> list:
+    '''
+    :param filename: Filename of a disk segment.
+    :return: The filenames of the segment and its sidecar files.
+    '''
+    return [filename] + [filename + suffix for suffix in SEGMENT_SIDECARS]
+
+
+def index_size(directory: str) -> int:
+    '''
+    :param directory: Index directory.
+    :return: Total size in bytes of the files of the index the manifest refers to.
+    '''
+    ix = Index.open(directory, read_only=True)
+    filenames = [os.path.join(directory, MANIFEST_FILENAME), ix.repo_filename] + segment_files(ix.ix_filename)
+    for segment_filename, docstore_filename in ix.delta_filenames:
+        filenames += segment_files(segment_filename) + [docstore_filename]
+    if ix.manifest.doc_map is not None:
+        filenames.append(os.path.join(directory, ix.manifest.doc_map))
+    ix.close()
+    return sum(os.path.getsize(filename) for filename in filenames if os.path.isfile(filename))
+
+
+def next_filename(directory: str, filename: str, default: str) -> str:
+    '''
+    Names the next version of a file of the index: "<stem>.<n + 1><ext>" for "<stem>.<n><ext>", or
+    "<stem>.1<ext>" for "<stem><ext>". Leftovers of a crashed rewrite under that name are deleted.
+    :param directory: Index directory.
+    :param filename: Current name of the file relative to the directory, or None to use the default.
+    :param default: Unversioned name, e.g. "segment.db".
+    :return: The new name, relative to the directory.
+    '''
+    stem, ext = os.path.splitext(filename or default)
+    base, dot, version = stem.rpartition(".")
+    if dot and version.isdigit():
+        name = base + "." + str(int(version) + 1) + ext
+    else:
+        name = stem + ".1" + ext
+    for leftover in segment_files(os.path.join(directory, name)) + [os.path.join(directory, name + ".tmp")]:
+        if os.path.isfile(leftover):
+            os.remove(leftover)
+    return name
+
+
+def switch_files(ix: Index, segment_name: str, docstore_name: str, doc_map_name: str = None,
+                 keep_wal_archive: bool = False, storage: str = None):
+    '''
+    Switches a closed index to a new segment and document store written next to its files, then deletes the old
+    files. The segment's LSH table is carried over.
+    :param ix: The Index the files were rewritten from, closed.
+    :param segment_name: New segment file, relative to the index directory.
+    :param docstore_name: New document store file, relative to the index directory.
+    :param doc_map_name: New doc map file, or None to keep the current one.
+    :param keep_wal_archive: Carry over the write-ahead log generations archived for incremental snapshots, if the
+        documents are still stored under the same ids. Otherwise they are dropped, and the next snapshot must be a
+        full one.
+    :param storage: Storage backend of the new files, or None if it is unchanged.
+    :return: None
+    '''
+    directory = ix.directory
+    manifest = ix.manifest
+    old_doc_map = manifest.doc_map
+    new_ix_filename = os.path.join(directory, segment_name)
+    if os.path.isfile(ix.ix_filename + ".lsh"):
+        shutil.copyfile(ix.ix_filename + ".lsh", new_ix_filename + ".lsh")
+    if keep_wal_archive and manifest.snapshot_wal_generation is not None:
+        for filename in glob.glob(glob.escape(ix.ix_filename) + ".wal-archive.*"):
+            shutil.copyfile(filename, new_ix_filename + filename[len(ix.ix_filename):])
+    else:
+        manifest.snapshot_wal_generation = None
+    manifest.segments[0]["file"] = segment_name
+    manifest.docstore = docstore_name
+    if doc_map_name is not None:
+        manifest.doc_map = doc_map_name
+    if storage is not None:
+        manifest.storage = storage
+    manifest.save(directory)
+
+    for filename in segment_files(ix.ix_filename) + [ix.repo_filename, ix.ix_filename + ".lsh"]:
+        if os.path.isfile(filename):
+            os.remove(filename)
+    for pattern in (".wal.*", ".wal-archive.*"):
+        for filename in glob.glob(glob.escape(ix.ix_filename) + pattern):
+            os.remove(filename)
+    if doc_map_name is not None and old_doc_map is not None:
+        os.remove(os.path.join(directory, old_doc_map))
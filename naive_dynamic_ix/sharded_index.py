@@ -0,0 +1,214 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+'''
+
+import os
+from multiprocessing import Pipe, Process
+from zlib import crc32
+from naive_dynamic_ix.index import Index
+from naive_dynamic_ix.results import Results
+
+# max number of unacknowledged add_document calls per shard before we wait on the worker.
+# keeps the pipe from filling up with replies (which would deadlock both ends).
+MAX_PENDING_ADDS = 256
+
+
+def shard_for(doc_id, num_shards: int) -> int:
+    '''
+    Returns the number of the shard that owns the given document.
+    Uses crc32 rather than hash() since str hashes are randomized per interpreter run.
+    :param doc_id: ID of the document
+    :param num_shards: int
+    :return: int in [0, num_shards)
+    '''
+    return crc32(repr(doc_id).encode("utf-8")) % num_shards
+
+
+def _serve_shard(conn, ix_filename, repo_filename):
+    '''
+    Main loop of a shard worker process. Receives (method, args) pairs over the pipe, calls the method
+    on the shard's Index and replies with (ok, value). A method of None closes the index and exits.
+    '''
+    ix = Index(ix_filename, repo_filename)
+    while True:
+        method, args = conn.recv()
+        if method is None:
+            ix.close()
+            conn.send((True, None))
+            return
+        try:
+            conn.send((True, getattr(ix, method)(*args)))
+        except Exception as e:
+            conn.send((False, e))
+
+
+class _LocalShard:
+    '''
+    Shard that lives in the calling process. Used when the ShardedIndex is created with processes=False.
+    '''
+    def __init__(self, ix_filename, repo_filename):
+        self.ix = Index(ix_filename, repo_filename)
+        self._result = None
+
+    def submit(self, method, *args):
+        self._result = getattr(self.ix, method)(*args)
+
+    def result(self):
+        return self._result
+
+    def close(self):
+        self.ix.close()
+
+
+class _ProcessShard:
+    '''
+    Shard that lives in its own worker process. submit() returns immediately; result() blocks until the
+    worker has replied to every submitted call and returns the reply to the last one.
+    Errors raised by an earlier (unwaited) add_document are re-raised by the next result().
+    '''
+    def __init__(self, ix_filename, repo_filename):
+        self.conn, child_conn = Pipe()
+        self.process = Process(target=_serve_shard, args=(child_conn, ix_filename, repo_filename))
+        self.process.daemon = True
+        self.process.start()
+        self._pending = 0
+
+    def submit(self, method, *args):
+        if self._pending >= MAX_PENDING_ADDS:
+            self._receive()
+        self.conn.send((method, args))
+        self._pending += 1
+
+    def _receive(self):
+        ok, value = self.conn.recv()
+        self._pending -= 1
+        if not ok:
+            raise value
+        return value
+
+    def result(self):
+        value = None
+        while self._pending > 0:
+            value = self._receive()
+        return value
+
+    def close(self):
+        self.submit(None)
+        self.result()
+        self.process.join()
+
+
+class ShardedIndex:
+    '''
+    Index that hash-partitions documents across several Index shards, each with its own disk segment and
+    document store files. Queries are scattered to every shard and the per-shard Results are gathered and merged.
+    By default each shard is served by its own worker process, so shards are queried in parallel.
+    '''
+    def __init__(self, ix_filename, repo_filename, num_shards: int = 4, processes: bool = True):
+        '''
+        Creates or opens a sharded index. Shard i stores its files at "<ix_filename>.<i>" and "<repo_filename>.<i>".
+        :param ix_filename: Base filename for the disk parts of the shard indexes.
+        :param repo_filename: Base filename for the shard document stores.
+        :param num_shards: Number of shards. Must match the number the index was created with.
+        :param processes: Serve each shard from a worker process (True) or from the calling process (False).
+        '''
+        if num_shards < 1:
+            raise ValueError("ShardedIndex needs at least one shard")
+        self._check_num_shards(ix_filename + ".shards", num_shards)
+        self.num_shards = num_shards
+        shard_cls = _ProcessShard if processes else _LocalShard
+        self.shards = [shard_cls(ix_filename + "." + str(i), repo_filename + "." + str(i))
+                       for i in range(num_shards)]
+
+    @staticmethod
+    def _check_num_shards(filename, num_shards):
+        '''
+        Records the shard count on creation and makes sure an existing index is reopened with the same count,
+        since documents are routed by doc_id modulo the shard count.
+        '''
+        if os.path.isfile(filename):
+            with open(filename, 'r') as f:
+                existing = int(f.read())
+            if existing != num_shards:
+                raise ValueError("Index was created with " + str(existing) + " shards, not " + str(num_shards))
+        else:
+            with open(filename, 'w') as f:
+                f.write(str(num_shards))
+
+    def _scatter_gather(self, method, *args) -> list:
+        for shard in self.shards:
+            shard.submit(method, *args)
+        return [shard.result() for shard in self.shards]
+
+    def add_document(self, doc_id, doc_title, doc_body):
+        '''
+        Adds the document to the shard that owns its doc id. With worker processes this does not wait for
+        the shard to finish indexing the document.
+        '''
+        self.shards[shard_for(doc_id, self.num_shards)].submit("add_document", doc_id, doc_title, doc_body)
+
+    def do_free_text_query(self, terms: list) -> Results:
+        '''
+        Executes a free text query (searches for documents containing ANY of the terms) on every shard.
+        :param terms: List of the terms to search for.
+        :return: Results object.
+        '''
+        return Results.merge(self._scatter_gather("do_free_text_query", terms))
+
+    def do_phrase_query(self, terms: list) -> Results:
+        '''
+        Executes a phrase query (searches for documents containing the EXACT phrase) on every shard.
+        :param terms: List of terms comprising the phrase to search for.
+        :return: Results object
+        '''
+        return Results.merge(self._scatter_gather("do_phrase_query", terms))
+
+    def do_proximity_query(self, terms: list, max_distance: int, ordered: bool = False) -> Results:
+        '''
+        Executes a proximity query (searches for documents with all the terms within max_distance words) on every shard.
+        :param terms: List of the terms to search for.
+        :param max_distance: Max distance in words between the first and last of the terms.
+        :param ordered: Whether the terms must occur in the given order.
+        :return: Results object
+        '''
+        return Results.merge(self._scatter_gather("do_proximity_query", terms, max_distance, ordered))
+
+    def do_top_k_query(self, terms: list, k: int = 10) -> Results:
+        '''
+        Finds the k documents with the highest score for the terms (see Index.do_top_k_query) among the top k
+        of every shard. Each shard scores its documents with its own document frequencies.
+        :param terms: List of the terms to search for.
+        :param k: Number of documents to return.
+        :return: Results object, best first, with the scores in Results.scores.
+        '''
+        merged = Results.merge(self._scatter_gather("do_top_k_query", terms, k))
+        results = Results(merged.doc_ids[:k], merged.doc_titles[:k], merged.snippets[:k])
+        results.scores = merged.scores[:k]
+        return results
+
+    def run_queries(self, batch: list) -> list:
+        '''
+        Executes a batch of queries (see Index.run_queries) on every shard in parallel, each shard sharing
+        posting list and document fetches across the batch.
+        :param batch: List of (query type, terms) or (query type, terms, options).
+        :return: List of Results, one per query.
+        '''
+        shard_results = self._scatter_gather("run_queries", batch)
+        return [Results.merge(results) for results in zip(*shard_results)]
+
+    def save(self):
+        '''
+        Saves any pending changes of every shard to disk.
+        :return: None
+        '''
+        self._scatter_gather("save")
+
+    def close(self):
+        '''
+        Saves and closes every shard, stopping any worker processes.
+        :return: None
+        '''
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,293 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Immutable snapshots of an index directory, for read-only replicas that serve queries while the index keeps taking
+documents. A snapshot is a directory "<snapshots_dir>/<id>", the id being a zero-padded sequence number, with a
+MANIFEST.json, the files it refers to and a SNAPSHOT.json holding the size and SHA-256 checksum of every file.
+Snapshots are written to a temporary directory that is renamed into place once complete, and their files are
+made read-only, so a snapshot never changes once it exists.
+A full snapshot is a copy of the saved segment, its term stats, Bloom filter, vocabulary and suggester, and the document
+store. An incremental snapshot only holds a delta segment, with its own document store, of the documents added
+since the previous snapshot. It is rebuilt from the write-ahead log generations archived since then, and its
+manifest refers to the files of the earlier snapshots (e.g. "../000001/segment.db"), so only the new directory
+has to be shipped to a replica's host.
+Snapshots must be taken by the process writing the index, between calls to add_document.
+'''
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import stat
+from naive_dynamic_ix.index import Index
+from naive_dynamic_ix.manifest import Manifest
+from naive_dynamic_ix.wal import WriteAheadLog
+
+SNAPSHOT_FILENAME = "SNAPSHOT.json"
+SEGMENT_FILENAME = "segment.db"
+DOCSTORE_FILENAME = "docs.db"
+DOC_MAP_FILENAME = "docmap.pickle"
+SEGMENT_SIDECARS = (".stats", ".bloom", ".vocab", ".suggest")
+_ID_WIDTH = 6
+_BLOCK_SIZE = 1 << 20
+
+
+def snapshot_path(snapshots_dir: str, snapshot_id: int) -> str:
+    return os.path.join(snapshots_dir, str(snapshot_id).zfill(_ID_WIDTH))
+
+
+def snapshot_ids(snapshots_dir: str) -> list:
+    '''
+    :param snapshots_dir: str
+    :return: Sorted list of the ids of the complete snapshots in the directory.
+    '''
+    if not os.path.isdir(snapshots_dir):
+        return []
+    return sorted(int(name) for name in os.listdir(snapshots_dir)
+                  if name.isdigit() and os.path.isfile(os.path.join(snapshots_dir, name, SNAPSHOT_FILENAME)))
+
+
+def latest_snapshot(snapshots_dir: str) -> str:
+    '''
+    :param snapshots_dir: str
+    :return: Path of the newest snapshot in the directory, or None if there is none.
+    '''
+    ids = snapshot_ids(snapshots_dir)
+    return snapshot_path(snapshots_dir, ids[-1]) if ids else None
+
+
+def load_snapshot_info(path: str) -> dict:
+    '''
+    :param path: Path of a snapshot.
+    :return: Contents of its SNAPSHOT.json: "id", "base" (id of the snapshot it extends, or None for a full
+        snapshot), "doc_count", "wal_generation" and "files" (file name -> {"size", "sha256"}).
+    '''
+    with open(os.path.join(path, SNAPSHOT_FILENAME), 'r') as f:
+        return json.load(f)
+
+
+def _checksum(filename: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(_BLOCK_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _copy(src: str, dst: str):
+    '''
+    Copies a file and fsyncs the copy.
+    :return: None
+    '''
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        shutil.copyfileobj(fsrc, fdst, _BLOCK_SIZE)
+        fdst.flush()
+        os.fsync(fdst.fileno())
+
+
+def verify_snapshot(path: str):
+    '''
+    Checks the sizes and checksums of the files of a snapshot and of the snapshots it is based on.
+    Raises a ValueError for the first missing or corrupt file.
+    :param path: Path of a snapshot.
+    :return: None
+    '''
+    snapshots_dir = os.path.dirname(os.path.normpath(path))
+    while path is not None:
+        info = load_snapshot_info(path)
+        for name, expected in sorted(info["files"].items()):
+            filename = os.path.join(path, name)
+            if not os.path.isfile(filename):
+                raise ValueError("Missing file in snapshot: " + filename)
+            if os.path.getsize(filename) != expected["size"] or _checksum(filename) != expected["sha256"]:
+                raise ValueError("Checksum mismatch in snapshot: " + filename)
+        path = snapshot_path(snapshots_dir, info["base"]) if info["base"] is not None else None
+
+
+def _rebase(filename: str, base_name: str) -> str:
+    '''
+    :return: The path, relative to a new snapshot, of a file of the manifest of the snapshot it extends.
+    '''
+    if filename.startswith(os.pardir):
+        return filename  # already in an older sibling snapshot
+    return "/".join([os.pardir, base_name, filename])
+
+
+def _remove_read_only(func, path, exc_info):
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
+
+
+def _write_full(ix: Index, path: str) -> tuple:
+    '''
+    Saves the index and copies its files into the snapshot directory.
+    :return: (Manifest of the snapshot, last write-ahead log generation included, or None if there is no log)
+    '''
+    ix.save()
+    ix.disk_segment.sync()
+    ix.docstore.sync()
+    _copy(ix.ix_filename, os.path.join(path, SEGMENT_FILENAME))
+    for suffix in SEGMENT_SIDECARS:
+        if os.path.isfile(ix.ix_filename + suffix):
+            _copy(ix.ix_filename + suffix, os.path.join(path, SEGMENT_FILENAME + suffix))
+    _copy(ix.repo_filename, os.path.join(path, DOCSTORE_FILENAME))
+    manifest = Manifest(ix.manifest.format_version, ix.manifest.analyzer, ix.manifest.stopwords, ix.doc_count,
+                        [{"name": "main", "file": SEGMENT_FILENAME}], DOCSTORE_FILENAME, storage=ix.manifest.storage)
+    if ix.manifest.doc_map is not None:
+        _copy(os.path.join(ix.directory, ix.manifest.doc_map), os.path.join(path, DOC_MAP_FILENAME))
+        manifest.doc_map = DOC_MAP_FILENAME
+    return manifest, ix.wal.generation - 1 if ix.wal is not None else None
+
+
+def _write_delta(ix: Index, path: str, base_path: str, name: str) -> tuple:
+    '''
+    Indexes the documents logged since the base snapshot into a delta segment in the snapshot directory.
+    :return: (Manifest of the snapshot, last write-ahead log generation included, number of documents in the delta)
+    '''
+    base_info = load_snapshot_info(base_path)
+    generation, documents = ix.logged_documents(base_info["wal_generation"])
+    delta = Index(os.path.join(path, SEGMENT_FILENAME), os.path.join(path, DOCSTORE_FILENAME),
+                  stopwords=ix.stopwords, wal=False)
+    delta.storage = ix.storage
+    delta.memory_limit = ix.memory_limit
+    delta.background_flush = False
+    for doc_id, doc_title, doc_body in documents:
+        delta.add_document(doc_id, doc_title, doc_body)
+    delta.close()
+
+    manifest = Manifest.load(base_path)
+    base_name = os.path.basename(os.path.normpath(base_path))
+    for segment in manifest.segments:
+        segment["file"] = _rebase(segment["file"], base_name)
+        if "docstore" in segment:
+            segment["docstore"] = _rebase(segment["docstore"], base_name)
+    manifest.docstore = _rebase(manifest.docstore, base_name)
+    manifest.segments.append({"name": name, "file": SEGMENT_FILENAME, "docstore": DOCSTORE_FILENAME})
+    manifest.doc_count += delta.doc_count
+    return manifest, generation, delta.doc_count
+
+
+def create_snapshot(ix: Index, snapshots_dir: str, incremental: bool = False) -> str:
+    '''
+    Takes a snapshot of an index opened with Index.open. From the first snapshot on, the index keeps the write-ahead
+    log generations of saved documents in an archive until they are included in a snapshot.
+    :param ix: Index object.
+    :param snapshots_dir: Directory of the snapshots, created if needed.
+    :param incremental: Only ship the documents added since the latest snapshot in snapshots_dir, which must have
+        been taken from this index. Otherwise the whole index is copied.
+    :return: Path of the new snapshot, or of the latest one if an incremental snapshot had no new documents.
+    '''
+    if ix.directory is None or ix.read_only:
+        raise ValueError("Only writable indexes opened with Index.open can be snapshotted")
+    if ix.delta_filenames:
+        raise ValueError("Cannot snapshot an index with delta segments")
+    ids = snapshot_ids(snapshots_dir)
+    base_path = snapshot_path(snapshots_dir, ids[-1]) if ids else None
+    if incremental:
+        if ix.doc_map is not None:
+            raise ValueError("Cannot take an incremental snapshot of a reordered index; take a full snapshot")
+        if base_path is None:
+            raise ValueError("No snapshot to base an incremental snapshot on in " + snapshots_dir)
+        if ix.manifest.snapshot_wal_generation is None or \
+                load_snapshot_info(base_path)["wal_generation"] != ix.manifest.snapshot_wal_generation:
+            raise ValueError("The latest snapshot in " + snapshots_dir + " was not taken from this index; "
+                             "take a full snapshot")
+
+    snapshot_id = ids[-1] + 1 if ids else 1
+    path = snapshot_path(snapshots_dir, snapshot_id)
+    tmp_path = path + ".tmp"
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path, onerror=_remove_read_only)  # left over from a crash
+    os.makedirs(tmp_path)
+    if incremental:
+        manifest, generation, doc_count = _write_delta(ix, tmp_path, base_path, os.path.basename(path))
+        if doc_count == 0:
+            shutil.rmtree(tmp_path)
+            return base_path
+    else:
+        manifest, generation = _write_full(ix, tmp_path)
+    manifest.save(tmp_path)
+
+    files = {}
+    for name in sorted(os.listdir(tmp_path)):
+        filename = os.path.join(tmp_path, name)
+        files[name] = {"size": os.path.getsize(filename), "sha256": _checksum(filename)}
+        os.chmod(filename, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    info = {"id": snapshot_id, "base": ids[-1] if incremental else None, "doc_count": manifest.doc_count,
+            "wal_generation": generation, "files": files}
+    with open(os.path.join(tmp_path, SNAPSHOT_FILENAME), 'w') as f:
+        json.dump(info, f, indent=2)
+    os.rename(tmp_path, path)
+
+    if generation is not None:
+        ix.manifest.snapshot_wal_generation = generation
+        ix.manifest.save(ix.directory)
+        ix.archive_wal()
+        WriteAheadLog(ix.wal.archive_prefix).truncate(generation)
+    return path
+
+
+class Replica:
+    '''
+    Read-only replica serving the latest snapshot in a snapshots directory. Queries go to replica.index.
+    refresh() opens a newer snapshot and then replaces replica.index in a single assignment, so every query runs
+    against either the old or the new snapshot. The replaced index stays open until the next switch, for queries
+    that were still running on it.
+    '''
+    def __init__(self, snapshots_dir: str, verify: bool = True):
+        '''
+        :param snapshots_dir: Directory of the snapshots.
+        :param verify: Check the checksums of a snapshot before switching to it.
+        '''
+        self.snapshots_dir = snapshots_dir
+        self.verify = verify
+        self.snapshot = None  # path of the snapshot being served
+        self.index = None
+        self._retired = None
+        self.refresh()
+
+    def refresh(self) -> bool:
+        '''
+        Switches to the latest snapshot, if it is newer than the one being served.
+        :return: Whether the replica switched to a new snapshot.
+        '''
+        path = latest_snapshot(self.snapshots_dir)
+        if path is None or path == self.snapshot:
+            return False
+        if self.verify:
+            verify_snapshot(path)
+        index = Index.open(path, read_only=True)
+        index.segments()  # open the segment files now rather than on the first query after the switch
+        if self._retired is not None:
+            self._retired.close()
+        self._retired = self.index
+        self.index = index
+        self.snapshot = path
+        return True
+
+    def close(self):
+        '''
+        Closes the served index and the replaced one.
+        :return: None
+        '''
+        for index in (self._retired, self.index):
+            if index is not None:
+                index.close()
+        self._retired = self.index = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Snapshot an index directory that is not being written to.")
+    parser.add_argument("index_dir")
+    parser.add_argument("snapshots_dir")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only ship the documents added since the latest snapshot")
+    args = parser.parse_args()
+    ix = Index.open(args.index_dir)
+    try:
+        print(create_snapshot(ix, args.snapshots_dir, args.incremental))
+    finally:
+        ix.close()
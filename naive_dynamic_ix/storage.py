@@ -0,0 +1,272 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Storage backends of the disk segments and document stores: key-value files mapping terms (or doc ids) to pickled
+values. BsddbStorage is the original Berkeley DB hash file; SqliteStorage keeps the values in a table of the stdlib
+sqlite3 module in WAL mode, which needs no C extension build and lets other processes read the file while it is
+being written. The backend of an existing file is recognized from its header, so indexes with files of either kind
+open the same way; new files get the backend asked for, by default Berkeley DB if bsddb3 is installed.
+'''
+
+import os
+import sqlite3
+from pickle import dumps, loads
+from urllib.parse import quote
+
+try:
+    import bsddb3
+except ImportError:
+    bsddb3 = None  # only RAM-only indexes (Index.in_memory) and SQLite files work without Berkeley DB
+
+BSDDB = "bsddb"
+SQLITE = "sqlite"
+BACKENDS = (BSDDB, SQLITE)
+DEFAULT_BACKEND = BSDDB if bsddb3 is not None else SQLITE
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+SQLITE_BATCH_SIZE = 1024  # number of buffered writes sent to SQLite in one executemany
+
+
+class Storage:
+    '''
+    Interface of a storage backend. Keys are terms or doc ids, values are bytes. Writes may be buffered until sync.
+    '''
+    def __getitem__(self, key) -> bytes:
+        '''
+        Raises a KeyError if the key is not in the storage.
+        '''
+        raise NotImplementedError
+
+    def __setitem__(self, key, value: bytes):
+        raise NotImplementedError
+
+    def has_key(self, key) -> bool:
+        raise NotImplementedError
+
+    def keys(self) -> list:
+        raise NotImplementedError
+
+    def get_many(self, keys: list) -> dict:
+        '''
+        Reads many keys, in one batch if the backend supports it.
+        :param keys: List of keys.
+        :return: Dict of key to value of the keys that are in the storage.
+        '''
+        values = {}
+        for key in keys:
+            try:
+                values[key] = self[key]
+            except KeyError:
+                pass
+        return values
+
+    def update(self, items):
+        '''
+        Writes many (key, value) pairs, in one batch if the backend supports it.
+        :param items: Iterable of (key, value) pairs.
+        :return: None
+        '''
+        for key, value in items:
+            self[key] = value
+
+    def range(self, start=None, stop=None):
+        '''
+        :param start: First key of the range, or None to start at the smallest key.
+        :param stop: Key the range stops before, or None to go to the largest key.
+        :return: Iterator over the (key, value) pairs with start <= key < stop, in key order.
+        '''
+        raise NotImplementedError
+
+    def sync(self):
+        '''
+        Flushes the pending writes to disk.
+        :return: None
+        '''
+        raise NotImplementedError
+
+    def close(self):
+        '''
+        Flushes and closes the file.
+        :return: None
+        '''
+        raise NotImplementedError
+
+
+class BsddbStorage(Storage):
+    '''
+    Berkeley DB hash file. The keys are stored pickled, so range scans sort all the keys in memory.
+    '''
+    def __init__(self, filename: str, read_only: bool = False, expected_keys: int = None):
+        '''
+        :param expected_keys: Number of keys a new file will hold, to size its hash table up front.
+        '''
+        if bsddb3 is None:
+            raise ImportError("bsddb3 is needed for Berkeley DB files; use the sqlite backend or Index.in_memory")
+        self.db = bsddb3.hashopen(filename, 'r' if read_only else 'c', nelem=expected_keys)
+
+    def __getitem__(self, key) -> bytes:
+        return self.db[dumps(key)]
+
+    def __setitem__(self, key, value: bytes):
+        self.db[dumps(key)] = value
+
+    def has_key(self, key) -> bool:
+        return self.db.has_key(dumps(key))
+
+    def keys(self) -> list:
+        return [loads(key) for key in self.db.keys()]
+
+    def range(self, start=None, stop=None):
+        for key in sorted(self.keys()):
+            if (start is None or key >= start) and (stop is None or key < stop):
+                yield key, self[key]
+
+    def sync(self):
+        self.db.sync()
+
+    def close(self):
+        self.db.close()
+
+
+def _encode_key(key):
+    '''
+    Strings and ints are stored as SQLite text and integers, so that the table sorts them naturally; other keys
+    are stored pickled, as blobs.
+    '''
+    return key if isinstance(key, (str, int)) else dumps(key)
+
+
+def _decode_key(key):
+    return loads(key) if isinstance(key, bytes) else key
+
+
+class SqliteStorage(Storage):
+    '''
+    SQLite file in WAL mode holding one table of (key, value BLOB) rows clustered by key (WITHOUT ROWID), so lookups
+    are a single B-tree search and range scans read the keys in order. Writes are buffered and sent in batches with
+    executemany inside a transaction that is committed on sync; readers in other processes see the file as of the
+    last sync. Lookups reuse the statements prepared by sqlite3's statement cache.
+    '''
+    def __init__(self, filename: str, read_only: bool = False):
+        self.read_only = read_only
+        self._pending = {}  # key -> value of the writes not yet sent to SQLite
+        if read_only:
+            uri = "file:" + quote(os.path.abspath(filename))
+            try:
+                self.db = sqlite3.connect(uri + "?mode=ro", uri=True, check_same_thread=False)
+                self.db.execute("SELECT 1 FROM kv LIMIT 1")
+            except sqlite3.OperationalError:
+                # no write access to the directory for the WAL index, e.g. a read-only snapshot
+                self.db = sqlite3.connect(uri + "?immutable=1", uri=True, check_same_thread=False)
+        else:
+            # access from several threads is serialized by the callers, e.g. DiskSegment.lock
+            self.db = sqlite3.connect(filename, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS kv (key PRIMARY KEY, value BLOB NOT NULL) WITHOUT ROWID")
+            self.db.commit()
+
+    def __getitem__(self, key) -> bytes:
+        value = self._pending.get(key)
+        if value is not None:
+            return value
+        row = self.db.execute("SELECT value FROM kv WHERE key = ?", (_encode_key(key),)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def __setitem__(self, key, value: bytes):
+        self._pending[key] = value
+        if len(self._pending) >= SQLITE_BATCH_SIZE:
+            self._flush()
+
+    def get_many(self, keys: list) -> dict:
+        '''
+        Reads the keys with one SELECT ... IN query per SQLITE_BATCH_SIZE keys.
+        '''
+        self._flush()
+        values = {}
+        encoded = {_encode_key(key): key for key in keys}
+        params = list(encoded)
+        for i in range(0, len(params), SQLITE_BATCH_SIZE):
+            chunk = params[i:i + SQLITE_BATCH_SIZE]
+            query = "SELECT key, value FROM kv WHERE key IN (" + ",".join("?" * len(chunk)) + ")"
+            for key, value in self.db.execute(query, chunk):
+                values[encoded[key]] = value
+        return values
+
+    def has_key(self, key) -> bool:
+        return key in self._pending or \
+            self.db.execute("SELECT 1 FROM kv WHERE key = ?", (_encode_key(key),)).fetchone() is not None
+
+    def keys(self) -> list:
+        self._flush()
+        return [_decode_key(key) for key, in self.db.execute("SELECT key FROM kv")]
+
+    def range(self, start=None, stop=None):
+        self._flush()
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("key >= ?")
+            params.append(_encode_key(start))
+        if stop is not None:
+            conditions.append("key < ?")
+            params.append(_encode_key(stop))
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        for key, value in self.db.execute("SELECT key, value FROM kv" + where + " ORDER BY key", params):
+            yield _decode_key(key), value
+
+    def _flush(self):
+        '''
+        Sends the buffered writes to SQLite in one executemany.
+        '''
+        if self._pending:
+            self.db.executemany("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+                                [(_encode_key(key), value) for key, value in self._pending.items()])
+            self._pending = {}
+
+    def sync(self):
+        '''
+        Commits the pending writes and checkpoints the WAL into the database file, so that a copy of the file alone
+        (e.g. in a snapshot) is complete.
+        '''
+        if self.read_only:
+            return
+        self._flush()
+        self.db.commit()
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        self.sync()
+        self.db.close()
+
+
+def detect_backend(filename: str) -> str:
+    '''
+    :param filename: str
+    :return: The backend of an existing file, or None if the file does not exist or is empty.
+    '''
+    if not os.path.isfile(filename) or os.path.getsize(filename) == 0:
+        return None
+    with open(filename, 'rb') as f:
+        return SQLITE if f.read(len(SQLITE_HEADER)) == SQLITE_HEADER else BSDDB
+
+
+def open_storage(filename: str, read_only: bool = False, backend: str = None, expected_keys: int = None) -> Storage:
+    '''
+    Opens a storage file, or creates it if it does not exist.
+    :param filename: str
+    :param read_only: Open an existing file read-only.
+    :param backend: BSDDB or SQLITE, the backend of a new file. None for DEFAULT_BACKEND. An existing file is
+        opened with the backend it was written with.
+    :param expected_keys: Number of keys a new file will hold, if known. Only used by Berkeley DB.
+    :return: Storage object.
+    '''
+    backend = detect_backend(filename) or backend or DEFAULT_BACKEND
+    if backend == BSDDB:
+        return BsddbStorage(filename, read_only, expected_keys)
+    if backend == SQLITE:
+        return SqliteStorage(filename, read_only)
+    raise ValueError("Unknown storage backend " + repr(backend) + ", expected one of " + repr(BACKENDS))
@@ -0,0 +1,114 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+'''
+
+import os
+from array import array
+from bisect import bisect_left
+from heapq import nlargest
+from pickle import dump, load, HIGHEST_PROTOCOL
+
+RANGE_LIMIT = 256  # prefixes matching more terms than this get their top terms precomputed
+CACHE_K = 16  # number of top terms precomputed per prefix
+_MAX_CHAR = "\U0010ffff"
+
+
+def prefix_range(terms: list, prefix: str, lo: int = 0, hi: int = None) -> tuple:
+    '''
+    :param terms: Sorted list of terms.
+    :param prefix: str
+    :param lo: Start of the slice of terms to search.
+    :param hi: End of the slice of terms to search, defaults to len(terms).
+    :return: (start, end) such that terms[start:end] are the terms of the slice starting with the prefix.
+    '''
+    start = bisect_left(terms, prefix, lo, len(terms) if hi is None else hi)
+    return start, bisect_left(terms, prefix + _MAX_CHAR, start, len(terms) if hi is None else hi)
+
+
+class Suggester:
+    '''
+    Prefix index over the terms of a segment for type-ahead suggestions: the terms sorted alphabetically, so the
+    terms starting with a prefix are a range found by binary search, and their frequencies in a parallel array.
+    The most frequent terms of a range are found by scanning it, except for the short prefixes matching more than
+    RANGE_LIMIT terms, whose CACHE_K most frequent terms are precomputed. Every prefix of such a prefix matches even
+    more terms, so there are at most len(terms) / RANGE_LIMIT of them per prefix length, which bounds the memory
+    used by the precomputed lists.
+    '''
+    def __init__(self, terms: list = None, frequencies: array = None, top: dict = None):
+        self.terms = terms if terms else []  # sorted
+        self.frequencies = frequencies if frequencies is not None else array('I')
+        self.top = top if top else {}  # prefix -> indexes of its CACHE_K most frequent terms, most frequent first
+
+    @classmethod
+    def build(cls, term_frequencies):
+        '''
+        :param term_frequencies: Iterable of (term, frequency) pairs, e.g. document frequencies.
+        :return: Suggester object.
+        '''
+        pairs = sorted(term_frequencies)
+        suggester = cls([term for term, frequency in pairs], array('I', [frequency for term, frequency in pairs]))
+        ranges = [(0, len(pairs), 0)]  # (start, end, length of the prefix shared by the terms in between)
+        while ranges:
+            lo, hi, depth = ranges.pop()
+            if hi - lo <= RANGE_LIMIT:
+                continue
+            suggester.top[suggester.terms[lo][:depth]] = suggester._scan(lo, hi, CACHE_K)
+            # split the range by the next character, skipping the prefix itself which sorts first
+            i = lo
+            while i < hi and len(suggester.terms[i]) == depth:
+                i += 1
+            while i < hi:
+                j = prefix_range(suggester.terms, suggester.terms[i][:depth + 1], i, hi)[1]
+                ranges.append((i, j, depth + 1))
+                i = j
+        return suggester
+
+    @classmethod
+    def from_file(cls, filename: str):
+        '''
+        Reads in a suggester file written by save().
+        :param filename: str
+        :return: Suggester object, or None if the file does not exist.
+        '''
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as f:
+            terms, frequencies, top = load(f)
+            return cls(terms, frequencies, top)
+
+    def save(self, filename: str):
+        '''
+        Writes the suggester to the given file, replacing it atomically.
+        :param filename: str
+        :return: None
+        '''
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, 'wb') as f:
+            dump((self.terms, self.frequencies, self.top), f, HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+
+    def _scan(self, lo: int, hi: int, k: int) -> list:
+        '''
+        :return: Indexes of the k most frequent terms between lo and hi, ties going to the alphabetically first term.
+        '''
+        frequencies = self.frequencies
+        return nlargest(k, range(lo, hi), key=lambda i: (frequencies[i], -i))
+
+    def suggest(self, prefix: str, k: int = 10) -> list:
+        '''
+        :param prefix: str
+        :param k: Max number of suggestions.
+        :return: List of (term, frequency) pairs of the k most frequent terms starting with the prefix, most frequent
+            first.
+        '''
+        lo, hi = prefix_range(self.terms, prefix)
+        if hi - lo > RANGE_LIMIT and k <= CACHE_K and prefix in self.top:
+            indexes = self.top[prefix][:k]
+        else:
+            indexes = self._scan(lo, hi, k)
+        return [(self.terms[i], self.frequencies[i]) for i in indexes]
+
+    def __len__(self):
+        return len(self.terms)
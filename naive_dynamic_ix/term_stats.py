@@ -0,0 +1,80 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+'''
+
+import os
+from pickle import dump, load, HIGHEST_PROTOCOL
+
+
+class TermStats:
+    '''
+    Term dictionary holding a (document frequency, collection frequency, byte length) tuple per term,
+    so document frequencies can be looked up without loading any posting lists.
+    Collection frequency is the total number of occurrences of the term. Byte length is the size of the
+    term's pickled posting list on disk, or 0 for terms that only live in memory.
+    '''
+    def __init__(self, stats: dict = None):
+        self.stats = stats if stats else {}
+
+    @classmethod
+    def from_file(cls, filename: str):
+        '''
+        Reads in a term stats file written by save().
+        :param filename: str
+        :return: TermStats object, or None if the file does not exist.
+        '''
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as f:
+            return cls(load(f))
+
+    def save(self, filename: str):
+        '''
+        Writes the term stats to the given file, replacing it atomically.
+        :param filename: str
+        :return: None
+        '''
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, 'wb') as f:
+            dump(self.stats, f, HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+
+    def get(self, term: str) -> tuple:
+        '''
+        :param term: str
+        :return: (document frequency, collection frequency, byte length) of the term, all 0 if the term is unknown.
+        '''
+        return self.stats.get(term, (0, 0, 0))
+
+    def doc_frequency(self, term: str) -> int:
+        return self.stats.get(term, (0, 0, 0))[0]
+
+    def collection_frequency(self, term: str) -> int:
+        return self.stats.get(term, (0, 0, 0))[1]
+
+    def byte_length(self, term: str) -> int:
+        return self.stats.get(term, (0, 0, 0))[2]
+
+    def add_occurrences(self, term: str, new_docs: int, occurrences: int):
+        '''
+        Updates the stats of a term that occurs in new_docs more documents and occurrences more times.
+        '''
+        df, cf, nbytes = self.stats.get(term, (0, 0, 0))
+        self.stats[term] = (df + new_docs, cf + occurrences, nbytes)
+
+    def set(self, term: str, df: int, cf: int, nbytes: int):
+        self.stats[term] = (df, cf, nbytes)
+
+    def terms(self):
+        '''
+        :return: An iterable over the terms.
+        '''
+        return self.stats.keys()
+
+    def __contains__(self, term):
+        return term in self.stats
+
+    def __len__(self):
+        return len(self.stats)
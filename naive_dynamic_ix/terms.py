@@ -0,0 +1,64 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Encoding of the keys of the posting lists in a segment. Plain terms index the full text of a document, its title
+followed by its body. The terms of a single field are kept alongside them in the same segment, under
+"<field>:<term>" keys, so a title-only lookup only reads the (much smaller) title posting lists.
+Pairs of adjacent words of which at least one is a stopword are kept under "<word> <word>" keys, with the
+positions of the first word counted with stopwords included, so phrases made of common words can be matched.
+Disk segments keep the high-impact tier of a long posting list under "tier:<key>", see DiskSegment.get_impacts.
+'''
+
+import re
+
+TEXT = "text"  # full text of the document: title followed by body
+TITLE = "title"
+FIELDS = (TEXT, TITLE)
+
+TIER_PREFIX = "tier:"
+
+_PLAIN_TERM_RE = re.compile(r'[a-z0-9]+\Z')
+
+
+def field_key(field: str, term: str) -> str:
+    '''
+    :param field: One of FIELDS.
+    :param term: Preprocessed term.
+    :return: The key of the term's posting list in the given field.
+    '''
+    if field == TEXT:
+        return term
+    if field not in FIELDS:
+        raise ValueError("Unknown field: " + repr(field))
+    return field + ":" + term
+
+
+def bigram_key(first: str, second: str) -> str:
+    '''
+    :param first: Stopword, or preprocessed term.
+    :param second: Stopword, or preprocessed term.
+    :return: The key of the posting list of the word pair.
+    '''
+    return first + " " + second
+
+
+def tier_key(key: str) -> str:
+    '''
+    :param key: Key of a posting list.
+    :return: The key of the high-impact tier of the posting list.
+    '''
+    return TIER_PREFIX + key
+
+
+def is_tier_key(key: str) -> bool:
+    return key.startswith(TIER_PREFIX)
+
+
+def is_plain_term(key: str) -> bool:
+    '''
+    :param key: Key of a posting list.
+    :return: Whether the key is a term of the full text, as opposed to e.g. a field or bigram key.
+    '''
+    return _PLAIN_TERM_RE.match(key) is not None
@@ -0,0 +1,115 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+'''
+
+import os
+from collections import Counter
+from pickle import dump, load, HIGHEST_PROTOCOL
+
+N = 3  # length of the character n-grams
+
+
+def ngrams(term: str) -> set:
+    '''
+    :param term: str
+    :return: Set of the character n-grams of the term padded with "$", e.g. {"$ca", "cat", "at$"} for "cat".
+    '''
+    padded = "$" + term + "$"
+    return set(padded[i:i + N] for i in range(len(padded) - N + 1))
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    '''
+    Levenshtein distance between a and b, giving up once it is known to be over max_distance.
+    :return: The distance, or max_distance + 1 if it is larger than max_distance.
+    '''
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > max_distance:
+            return max_distance + 1
+        prev = cur
+    return min(prev[-1], max_distance + 1)
+
+
+class Vocabulary:
+    '''
+    Character n-gram index over the terms of a segment, for finding the terms within a small edit distance of a
+    (possibly misspelled) query term without scanning every term.
+    An edit changes at most N of a term's n-grams, so a term within d edits of the query shares at least
+    len(ngrams(query)) - N * d n-grams with it. Candidates are found by counting shared n-grams and then verified
+    with edit_distance. Query terms too short for the n-gram filter fall back to the terms of similar length.
+    '''
+    def __init__(self, grams: dict = None, by_length: dict = None):
+        self.grams = grams if grams else {}  # n-gram -> set of terms
+        self.by_length = by_length if by_length else {}  # term length -> set of terms
+
+    @classmethod
+    def from_file(cls, filename: str):
+        '''
+        Reads in a vocabulary file written by save().
+        :param filename: str
+        :return: Vocabulary object, or None if the file does not exist.
+        '''
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as f:
+            grams, by_length = load(f)
+            return cls(grams, by_length)
+
+    def save(self, filename: str):
+        '''
+        Writes the vocabulary to the given file, replacing it atomically.
+        :param filename: str
+        :return: None
+        '''
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, 'wb') as f:
+            dump((self.grams, self.by_length), f, HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+
+    def add(self, term: str):
+        '''
+        Adds a term to the vocabulary.
+        :param term: str
+        :return: None
+        '''
+        for gram in ngrams(term):
+            self.grams.setdefault(gram, set()).add(term)
+        self.by_length.setdefault(len(term), set()).add(term)
+
+    def __contains__(self, term):
+        return term in self.by_length.get(len(term), ())
+
+    def __len__(self):
+        return sum(len(terms) for terms in self.by_length.values())
+
+    def search(self, term: str, max_edits: int) -> list:
+        '''
+        Finds the terms within max_edits edits of the given term.
+        :param term: str
+        :param max_edits: Max Levenshtein distance.
+        :return: List of (distance, term) pairs, closest first.
+        '''
+        query_grams = ngrams(term)
+        min_shared = len(query_grams) - N * max_edits
+        if min_shared > 0:
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self.grams.get(gram, ()))
+            candidates = [t for t, count in shared.items() if count >= min_shared]
+        else:
+            candidates = [t for length in range(len(term) - max_edits, len(term) + max_edits + 1)
+                          for t in self.by_length.get(length, ())]
+        matches = []
+        for candidate in candidates:
+            distance = edit_distance(term, candidate, max_edits)
+            if distance <= max_edits:
+                matches.append((distance, candidate))
+        return sorted(matches)
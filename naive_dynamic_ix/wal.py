@@ -0,0 +1,151 @@
+'''
+Author: Andrew Chan
+Contact: andrewkchan@berkeley.edu
+License: MIT License
+
+Write-ahead log of the documents added to the memory segment, so it can be rebuilt after a crash.
+The log is split into generations, "<prefix>.<generation>", one per memory segment: when a memory segment is
+frozen for a flush the log is rotated, and the generations it covered are deleted once the flush is durable.
+Each record is a (length, crc32) header followed by the pickled (doc_id, doc_title, doc_body). Records are
+group committed: they are buffered and written with a single fsync once group_size records are buffered, or by a
+timer max_delay seconds after the first record of the group was buffered, whichever comes first.
+Once an index is snapshotted, deleted generations are moved to "<archive_prefix>.<generation>" instead, so the
+next incremental snapshot can ship the documents added since the last one (see naive_dynamic_ix.snapshot).
+'''
+
+import glob
+import os
+import struct
+import threading
+import zlib
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+
+_HEADER = struct.Struct("<II")  # payload length, crc32 of the payload
+
+
+class WriteAheadLog:
+    def __init__(self, prefix: str, group_size: int = 128, max_delay: float = 0.05):
+        '''
+        :param prefix: Filename prefix of the log files.
+        :param group_size: Max number of records per group commit.
+        :param max_delay: Max age in seconds of a buffered record before a timer thread commits the group.
+        '''
+        self.prefix = prefix
+        self.group_size = group_size
+        self.max_delay = max_delay
+        existing = self.generations()
+        self.generation = existing[-1] + 1 if existing else 0  # generation appended to
+        self.archive_prefix = None  # if set, truncated generations are moved to "<archive_prefix>.<generation>"
+        self._file = None
+        self._buffer = []
+        self._timer = None  # commits the buffered records max_delay seconds after the first one
+        self._lock = threading.Lock()  # guards the buffer and the file against the timer thread
+
+    def generations(self) -> list:
+        '''
+        :return: Sorted list of the generations that have a log file.
+        '''
+        generations = []
+        for filename in glob.glob(glob.escape(self.prefix) + ".*"):
+            suffix = filename[len(self.prefix) + 1:]
+            if suffix.isdigit():
+                generations.append(int(suffix))
+        return sorted(generations)
+
+    def _filename(self, generation: int) -> str:
+        return self.prefix + "." + str(generation)
+
+    def replay(self, after: int = -1):
+        '''
+        Reads the records of the older generations, stopping at the first torn or corrupt record of a generation.
+        :param after: Only read the generations newer than this one.
+        :return: Generator of (doc_id, doc_title, doc_body).
+        '''
+        for generation in self.generations():
+            if generation >= self.generation or generation <= after:
+                continue
+            with open(self._filename(generation), 'rb') as f:
+                data = f.read()
+            pos = 0
+            while pos + _HEADER.size <= len(data):
+                length, crc = _HEADER.unpack_from(data, pos)
+                payload = data[pos + _HEADER.size:pos + _HEADER.size + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                yield loads(payload)
+                pos += _HEADER.size + length
+
+    def append(self, doc_id, doc_title, doc_body):
+        '''
+        Adds a document to the log. It is durable once its group is committed.
+        :return: None
+        '''
+        payload = dumps((doc_id, doc_title, doc_body), HIGHEST_PROTOCOL)
+        record = _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) >= self.group_size:
+                self._commit()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.max_delay, self.commit)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def commit(self):
+        '''
+        Writes the buffered records to the current generation and fsyncs it.
+        :return: None
+        '''
+        with self._lock:
+            self._commit()
+
+    def _commit(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._buffer:
+            return
+        if self._file is None:
+            self._file = open(self._filename(self.generation), 'ab')
+        self._file.write(b"".join(self._buffer))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer = []
+
+    def rotate(self) -> int:
+        '''
+        Commits and closes the current generation; later records go to the next one.
+        :return: The generation that was closed.
+        '''
+        with self._lock:
+            self._commit()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.generation += 1
+            return self.generation - 1
+
+    def truncate(self, up_to: int):
+        '''
+        Deletes (or archives) the log files of the generations up to and including up_to, whose documents are
+        durable elsewhere.
+        :return: None
+        '''
+        for generation in self.generations():
+            if generation > up_to:
+                continue
+            if self.archive_prefix is not None:
+                os.replace(self._filename(generation), self.archive_prefix + "." + str(generation))
+            else:
+                os.remove(self._filename(generation))
+
+    def close(self):
+        '''
+        Commits the buffered records and closes the log file.
+        :return: None
+        '''
+        with self._lock:
+            self._commit()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
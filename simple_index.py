@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 
-import sys
-import re
-from porter_stemmer import PorterStemmer
+from naive_dynamic_ix.index import Index
 
-porter = PorterStemmer()
 stopwords = ["the", "an", "and", "or", "where", "there", "in", "a", "that", "of", "it", "its", "to", "as", "by", "who", "what", "when", "with"]
 
+def new_index(filename=None):
+    '''
+    Creates an empty index, or loads the one saved in the given file.
+    @param
+        filename: str, or None for an index that is never saved
+    @return
+        naive_dynamic_ix.index.Index in RAM-only mode, see Index.in_memory
+    '''
+    return Index.in_memory(filename, stopwords=stopwords)
+
 def index_document(index, doc_id, docstring):
     '''
     Indexes the single given document, adding its entries to the existing index.
@@ -25,9 +32,30 @@ def index_document(index, doc_id, docstring):
             index[term].append(doc_id)
     return index
 
+def add_document(index, doc_id, docstring):
+    '''
+    Indexes the single given document in an index from new_index().
+    @param
+        index: Index from new_index()
+        doc_id: int
+        docstring: str
+    '''
+    index.add_document(doc_id, "", docstring)
+    return index
+
+def search(index, query):
+    '''
+    Returns the ids of the documents containing any of the terms of the query, best matches first.
+    @param
+        index: Index from new_index()
+        query: str
+    '''
+    return index.do_free_text_query(index.tokenize(query)).doc_ids
+
+_analyzer = None # empty index whose analyzer get_terms uses, created on first use
+
 def get_terms(docstring):
-    docstring = docstring.lower()
-    docstring = re.sub(r'[^a-z0-9 ]', ' ', docstring) # replace non-alphanumeric characters with whitespace
-    terms = docstring.split()
-    terms = [word for word in terms if word not in stopwords]
-    return [porter.stem(word, 0, len(word) - 1) for word in terms] # return stemmed words
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = new_index()
+    return _analyzer.extract_terms(docstring) # parse docstring, normalize terms
@@ -0,0 +1,58 @@
+import unittest
+import shutil
+import tempfile
+import threading
+import os
+
+from naive_dynamic_ix.index import Index
+
+EINSTEIN = ("einstein", "Albert Einstein", "I know not with what weapons World War III will be fought, but World War "
+                                           "IV will be fought with sticks and stones. The atomic bomb changed "
+                                           "everything.")
+OPPENHEIMER = ("oppenheimer", "J. Robert Oppenheimer", "Now I am become Death, the destroyer of worlds. The bomb was "
+                                                       "built at Los Alamos.")
+CURIE = ("curie", "Marie Curie", "Nothing in life is to be feared, it is only to be understood.")
+FERMI = ("fermi", "Enrico Fermi", "Whatever Nature has in store for mankind.")
+BOHR = ("bohr", "Niels Bohr", "Einstein, stop telling God what to do.")
+
+class IndexTestCase(unittest.TestCase):
+    '''
+    Base of the tests of an Index: self.ix holds EINSTEIN, OPPENHEIMER and CURIE in its memory segment, and its files
+    are in the temporary directory self.dir.
+    '''
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.held = []
+        self.ix = self.new_index("test")
+        for doc in (EINSTEIN, OPPENHEIMER, CURIE):
+            self.ix.add_document(*doc)
+
+    def new_index(self, name: str) -> Index:
+        '''
+        :param name: Prefix of the index's files in self.dir. The same name opens the same files again.
+        :return: Index
+        '''
+        return Index(os.path.join(self.dir, name + "_ix.db"), os.path.join(self.dir, name + "_docs.db"))
+
+    def hold_merge(self, ix: Index, term: str = None) -> threading.Event:
+        '''
+        Holds up the merge of a term into an index's disk segment until the returned event is set. The event is set
+        in tearDown at the latest, so that a failed test does not hang on a flush.
+        :param term: Term to hold up, or None to hold up every merge.
+        :return: threading.Event
+        '''
+        release = threading.Event()
+        self.held.append(release)
+        merge_posting_list = ix.disk_segment.merge_posting_list
+        def slow_merge(merged_term, posting_list):
+            if term is None or merged_term == term:
+                release.wait()
+            merge_posting_list(merged_term, posting_list)
+        ix.disk_segment.merge_posting_list = slow_merge
+        return release
+
+    def tearDown(self):
+        for release in self.held:
+            release.set()
+        self.ix.close()
+        shutil.rmtree(self.dir)
@@ -0,0 +1,39 @@
+import unittest
+import os
+
+from naive_dynamic_ix.index import Index
+from naive_dynamic_ix import dedup
+from test.naive_dynamic_ix.fixtures import IndexTestCase, FERMI
+
+class TestDedup(IndexTestCase):
+    def test_dedup(self):
+        quote = ("Imagination is more important than knowledge. For knowledge is limited to all we now know and "
+                 "understand, while imagination embraces the entire world, and all there ever will be to know and "
+                 "understand.")
+        self.ix.enable_dedup(threshold=0.7, action=dedup.LINK)
+        self.assertIsNone(self.ix.add_document("imagination", "Imagination", quote))
+        self.assertEqual(self.ix.add_document("imagination2", "Imagination", quote + " Albert Einstein"),
+                         "imagination")
+        self.assertIsNone(self.ix.add_document(*FERMI))
+        self.assertEqual(sorted(self.ix.do_free_text_query(["imagination", "nature"]).doc_ids),
+                         ["fermi", "imagination"])
+        self.ix.save()
+
+        # the LSH table is persisted with the index
+        ix = Index(os.path.join(self.dir, "test_ix.db"), os.path.join(self.dir, "other_docs.db"))
+        ix.enable_dedup(threshold=0.7)
+        self.assertEqual(ix.duplicates_of("imagination"), ["imagination2"])
+        self.assertEqual(ix.add_document("imagination3", "Imagination!", quote), "imagination")
+
+class TestMinHasher(unittest.TestCase):
+    def test_without_numpy(self):
+        terms = ["term" + str(i) for i in range(50)]
+        hasher = dedup.MinHasher(32)
+        np, dedup.np = dedup.np, None
+        try:
+            self.assertEqual(dedup.MinHasher(32).signature(terms), hasher.signature(terms))
+        finally:
+            dedup.np = np
+
+if __name__ == '__main__':
+    unittest.main()
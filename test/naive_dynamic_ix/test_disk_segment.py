@@ -3,12 +3,10 @@ import os
 
 from naive_dynamic_ix.disk_segment import DiskSegment
 from naive_dynamic_ix.memory_segment import Posting, PostingList
-from pickle import loads
 
 class TestDiskSegment(unittest.TestCase):
     def setUp(self):
-        if os.path.isfile("test_ix.db"):
-            os.remove("test_ix.db")
+        self.remove_files()
         self.disk_ix = DiskSegment.from_file("test_ix.db")
 
     def test_merge_and_queries(self):
@@ -37,7 +35,7 @@ class TestDiskSegment(unittest.TestCase):
         res = self.disk_ix.do_one_word_query("bus")
         self.assertEqual(res, ["bus.com"])
 
-        keys = set(loads(k) for k in self.disk_ix.keys())
+        keys = set(self.disk_ix.keys())
         self.assertIn("bus", keys)
         self.assertIn("car", keys)
         self.assertIn("truck", keys)
@@ -67,6 +65,108 @@ class TestDiskSegment(unittest.TestCase):
         self.assertEqual(pq_result, ["hbo.com"])
         pq_empty_result = self.disk_ix.do_phrase_query(["coming", "is", "winter"])
         self.assertEqual(pq_empty_result, [])
+        prox_result = self.disk_ix.do_proximity_query(["winter", "coming"], 2, ordered=True)
+        self.assertEqual(prox_result, ["hbo.com", "patagonia.com"])
+        prox_empty_result = self.disk_ix.do_proximity_query(["winter", "plane"], 10)
+        self.assertEqual(prox_empty_result, [])
+
+    def test_term_stats(self):
+        self.disk_ix.merge_posting_list("vehicle", PostingList([Posting("bus.com", [0, 1]), Posting("van.com", [7])]))
+        self.disk_ix.merge_posting_list("vehicle", PostingList([Posting("car.com", [3, 4])]))
+        self.assertEqual(self.disk_ix.doc_frequency("vehicle"), 3)
+        self.assertEqual(self.disk_ix.term_stats.collection_frequency("vehicle"), 5)
+        self.assertEqual(self.disk_ix.doc_frequency("plane"), 0)
+        self.disk_ix.close()
+
+        # stats are read back from the stats file, or rebuilt from the posting lists if it is missing
+        for remove_stats in (False, True):
+            if remove_stats:
+                os.remove("test_ix.db.stats")
+            self.disk_ix = DiskSegment.from_file("test_ix.db")
+            nbytes = len(self.disk_ix.index["vehicle"])
+            self.assertEqual(self.disk_ix.term_stats.get("vehicle"), (3, 5, nbytes))
+            self.disk_ix.close()
+
+    def test_bloom_filter(self):
+        # more terms than the initial filter has room for, so it gets rebuilt along the way
+        terms = ["term" + str(i) for i in range(500)]
+        for term in terms:
+            self.disk_ix.merge_posting_list(term, PostingList([Posting("bus.com", [0])]))
+        self.disk_ix.close()
+
+        self.disk_ix = DiskSegment.from_file("test_ix.db")
+        self.assertTrue(os.path.isfile("test_ix.db.bloom"))
+        self.assertTrue(all(self.disk_ix.has_key(term) for term in terms))
+        self.assertEqual(self.disk_ix.do_one_word_query("term42"), ["bus.com"])
+        # absent terms are answered by the filter alone, without touching the database
+        index, self.disk_ix.index = self.disk_ix.index, None
+        self.assertEqual(self.disk_ix.do_one_word_query("plane"), [])
+        self.assertEqual(self.disk_ix.do_phrase_query(["term1", "plane"]), [])
+        self.disk_ix.index = index
+        self.disk_ix.close()
+
+    def test_vocabulary(self):
+        for term in ("vehicle", "vehicles", "vessel", "bus"):
+            self.disk_ix.merge_posting_list(term, PostingList([Posting("bus.com", [0])]))
+        self.disk_ix.close()
+        self.disk_ix = DiskSegment.from_file("test_ix.db")
+        self.assertEqual(self.disk_ix.vocabulary.search("vehicel", 2), [(2, "vehicle"), (2, "vehicles")])
+        self.assertEqual(self.disk_ix.vocabulary.search("bus", 1), [(0, "bus")])
+        self.assertEqual(self.disk_ix.vocabulary.search("plane", 2), [])
+        self.disk_ix.close()
+
+    def test_tiers(self):
+        self.disk_ix.tier_threshold = 4
+        self.disk_ix.tier_size = 2
+        postings = [Posting("doc" + str(i), list(range(i + 1))) for i in range(5)]
+        self.disk_ix.merge_posting_list("vehicle", PostingList(postings))
+        self.disk_ix.merge_posting_list("bus", PostingList(postings[:3]))
+        # only the tier of the long posting list is read, and the other postings are bounded by its max
+        self.assertEqual(self.disk_ix.get_impacts("vehicle"), ([("doc4", 5), ("doc3", 4)], 3))
+        self.assertEqual(self.disk_ix.get_impacts("vehicle", tiered=False),
+                         ([("doc0", 1), ("doc1", 2), ("doc2", 3), ("doc3", 4), ("doc4", 5)], 0))
+        self.assertEqual(self.disk_ix.get_impacts("bus"), ([("doc0", 1), ("doc1", 2), ("doc2", 3)], 0))
+
+        # a tier that a merge did not rewrite is out of date and skipped
+        self.disk_ix.tier_threshold = None
+        self.disk_ix.merge_posting_list("vehicle", PostingList([Posting("doc5", list(range(6)))]))
+        impacts, max_tail_impact = self.disk_ix.get_impacts("vehicle")
+        self.assertEqual(len(impacts), 6)
+        self.assertEqual(max_tail_impact, 0)
+
+    def test_suggest(self):
+        for term, num_docs in (("vehicle", 3), ("vessel", 1), ("van", 2), ("bus", 4)):
+            self.disk_ix.merge_posting_list(term, PostingList([Posting("doc" + str(i), [0]) for i in range(num_docs)]))
+        self.assertEqual(self.disk_ix.suggest("v"), [("vehicle", 3), ("van", 2), ("vessel", 1)])
+        self.disk_ix.close()
+        self.disk_ix = DiskSegment.from_file("test_ix.db")
+        self.assertTrue(os.path.isfile("test_ix.db.suggest"))
+        self.assertEqual(self.disk_ix.suggest("v", 2), [("vehicle", 3), ("van", 2)])
+        self.assertEqual(self.disk_ix.suggest("x"), [])
+        self.disk_ix.close()
+
+    def test_adopt_sidecars(self):
+        for term in ("vehicle", "vessel", "bus"):
+            self.disk_ix.merge_posting_list(term, PostingList([Posting("bus.com", [0]), Posting("van.com", [1])]))
+        copy = DiskSegment.from_file("test_copy.db")
+        for key in self.disk_ix.keys():
+            copy.index[key] = self.disk_ix.index[key]
+        copy.adopt_sidecars(self.disk_ix)
+        copy.close()
+
+        copy = DiskSegment.from_file("test_copy.db")
+        self.assertEqual(copy.term_stats.stats, self.disk_ix.term_stats.stats)
+        self.assertTrue(os.path.isfile("test_copy.db.bloom"))
+        self.assertEqual(copy.do_one_word_query("vessel"), ["bus.com", "van.com"])
+        self.assertEqual(copy.vocabulary.search("vesel", 1), [(1, "vessel")])
+        self.assertEqual(copy.suggest("v"), [("vehicle", 2), ("vessel", 2)])
+        copy.close()
+
+    def remove_files(self):
+        for name in ("test_ix.db", "test_copy.db"):
+            for filename in (name, name + ".stats", name + ".bloom", name + ".vocab", name + ".suggest"):
+                if os.path.isfile(filename):
+                    os.remove(filename)
 
     def tearDown(self):
-        os.remove("test_ix.db")
\ No newline at end of file
+        self.remove_files()
\ No newline at end of file
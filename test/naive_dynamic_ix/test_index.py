@@ -1,9 +1,333 @@
 import unittest
 import os
+import math
+import random
+import time
 
 from naive_dynamic_ix.index import Index
+from naive_dynamic_ix import metrics
+from test.naive_dynamic_ix.fixtures import IndexTestCase, FERMI, BOHR
+
+class TestIndex(IndexTestCase):
 
-class TestIndex(unittest.TestCase):
     def test_add_document(self):
-        # TODO
-        pass
\ No newline at end of file
+        res = self.ix.do_free_text_query(["bomb"])
+        self.assertEqual(sorted(res.doc_ids), ["einstein", "oppenheimer"])
+        res = self.ix.do_phrase_query(["Albert", "Einstein"])
+        self.assertEqual(res.doc_ids, ["einstein"])
+        self.assertEqual(res.doc_titles, ["Albert Einstein"])
+
+        # queries see the same documents once they are saved to disk
+        self.ix.save()
+        res = self.ix.do_free_text_query(["bomb", "feared"])
+        self.assertEqual(sorted(res.doc_ids), ["curie", "einstein", "oppenheimer"])
+        res = self.ix.do_phrase_query(["Albert", "Einstein"])
+        self.assertEqual(res.doc_ids, ["einstein"])
+
+    def test_proximity_query(self):
+        res = self.ix.do_proximity_query(["bomb", "war"], 12)
+        self.assertEqual(res.doc_ids, ["einstein"])
+        res = self.ix.do_proximity_query(["bomb", "war"], 5)
+        self.assertEqual(res.doc_ids, [])
+        res = self.ix.do_proximity_query(["destroyer", "death"], 1)
+        self.assertEqual(res.doc_ids, ["oppenheimer"])
+        res = self.ix.do_proximity_query(["destroyer", "death"], 1, ordered=True)
+        self.assertEqual(res.doc_ids, [])
+        # a repeated term needs as many occurrences
+        self.assertEqual(self.ix.do_proximity_query(["bomb", "bomb"], 0).doc_ids, [])
+        self.assertEqual(self.ix.do_proximity_query(["bomb", "bomb"], 50).doc_ids, [])
+        self.assertEqual(self.ix.do_proximity_query(["war", "war"], 12).doc_ids, ["einstein"])
+        self.ix.save()
+        res = self.ix.do_proximity_query(["bomb", "alamos"], 3, ordered=True)
+        self.assertEqual(res.doc_ids, ["oppenheimer"])
+
+    def test_boolean_query(self):
+        res = self.ix.do_boolean_query('"albert einstein" AND (bomb OR atomic) -movie')
+        self.assertEqual(res.doc_ids, ["einstein"])
+        res = self.ix.do_boolean_query('bomb -"world war"')
+        self.assertEqual(res.doc_ids, ["oppenheimer"])
+        self.ix.save()
+        self.ix.add_document("fermi", "Enrico Fermi", "The atomic bomb and the world war.")
+        res = self.ix.do_boolean_query('bomb OR feared')
+        self.assertEqual(res.doc_ids, ["curie", "einstein", "fermi", "oppenheimer"])
+        res = self.ix.do_boolean_query('"world war" bomb')
+        self.assertEqual(res.doc_ids, ["einstein", "fermi"])
+        res = self.ix.do_boolean_query('"war world" bomb')
+        self.assertEqual(res.doc_ids, [])
+        with self.assertRaises(ValueError):
+            self.ix.do_boolean_query('-bomb')
+
+        # the rarest term is intersected first, and the phrase is only checked on what is left
+        explanation = self.ix.explain('"albert einstein" bomb')
+        lines = explanation.splitlines()
+        self.assertTrue(lines[0].startswith("INTERSECT"))
+        self.assertIn("VERIFY", explanation)
+        self.assertEqual(lines[-1], "postings touched: 4")
+
+    def test_trace(self):
+        self.ix.save()
+        res = self.ix.do_phrase_query(["Albert", "Einstein"], trace=True)
+        self.assertEqual(res.trace.counters["documents_fetched"], 1)
+        self.assertEqual(res.trace.counters["postings_decoded"], 2)
+        self.assertIn("disk_segment.lookup", res.trace.stages)
+        self.assertIn("find_phrases", res.trace.stages)
+        self.assertIsNone(self.ix.do_phrase_query(["Albert", "Einstein"]).trace)
+
+    def test_fields(self):
+        self.ix.add_document(*BOHR)
+        res = self.ix.do_free_text_query(["einstein"])
+        self.assertEqual(sorted(res.doc_ids), ["bohr", "einstein"])
+        res = self.ix.do_free_text_query(["einstein"], fields=["title"])
+        self.assertEqual(res.doc_ids, ["einstein"])
+        self.ix.save()
+        res = self.ix.do_phrase_query(["albert", "einstein"], fields=["title"])
+        self.assertEqual(res.doc_ids, ["einstein"])
+        res = self.ix.do_boolean_query("title:einstein OR title:curie")
+        self.assertEqual(res.doc_ids, ["curie", "einstein"])
+
+        # title-only lookups only read the title posting list
+        res = self.ix.do_free_text_query(["bomb"], fields=["title"], trace=True)
+        self.assertEqual(res.doc_ids, [])
+        self.assertNotIn("postings_decoded", res.trace.counters)
+
+        res = self.ix.do_free_text_query(["einstein", "god"], fields=["text", "title"], boosts={"title": 3.0})
+        self.assertEqual(res.doc_ids, ["einstein", "bohr"])
+        self.assertEqual(res.scores, [4.0, 2.0])
+        with self.assertRaises(ValueError):
+            self.ix.do_free_text_query(["einstein"], fields=["abstract"])
+
+    def test_background_flush(self):
+        # hold the flush up until the test lets it go
+        release = self.hold_merge(self.ix)
+        self.ix.memory_limit = 1
+        self.ix.add_document(*FERMI)
+        self.assertIsNotNone(self.ix.frozen_segment)
+        # the frozen segment is searched while it is flushed, and new documents go to a fresh memory segment
+        self.ix.memory_limit = float("inf")
+        self.ix.add_document(*BOHR)
+        res = self.ix.do_free_text_query(["nature", "god", "bomb"])
+        self.assertEqual(sorted(res.doc_ids), ["bohr", "einstein", "fermi", "oppenheimer"])
+        self.assertEqual(sorted(self.ix.memory_segment.do_one_word_query("god")), ["bohr"])
+
+        release.set()
+        self.ix.save()
+        self.assertIsNone(self.ix.frozen_segment)
+        res = self.ix.do_free_text_query(["nature", "god", "bomb"])
+        self.assertEqual(sorted(res.doc_ids), ["bohr", "einstein", "fermi", "oppenheimer"])
+
+    def test_background_flush_overlap(self):
+        # hold the flush up halfway, once "nature" is merged into the disk segment but "mankind" is not
+        release = self.hold_merge(self.ix, "mankind")
+        self.ix.save()
+
+        self.ix.memory_limit = 1
+        self.ix.add_document(*FERMI)
+        self.ix.memory_limit = float("inf")
+        while not self.ix.disk_segment.do_one_word_query("natur"):
+            time.sleep(0.001)
+        # the postings of "fermi" merged so far are ignored in the disk segment, only the frozen segment counts
+        res = self.ix.do_top_k_query(["nature"], 3)
+        self.assertEqual(res.doc_ids, ["fermi"])
+        df = sum(segment.doc_frequency("natur") for segment in self.ix.segments())
+        self.assertAlmostEqual(res.scores[0], math.log(1 + 4 / df))
+        self.assertEqual(self.ix.do_boolean_query("nature -mankind").doc_ids, [])
+        self.assertEqual(self.ix.do_boolean_query("nature mankind").doc_ids, ["fermi"])
+        release.set()
+        self.ix.save()
+        self.assertEqual(self.ix.do_top_k_query(["nature"], 3).doc_ids, ["fermi"])
+        self.assertEqual(self.ix.do_boolean_query("nature -mankind").doc_ids, [])
+
+    def test_background_flush_error(self):
+        merge_posting_list = self.ix.disk_segment.merge_posting_list
+        def failing_merge(term, posting_list):
+            raise IOError("disk full")
+        self.ix.disk_segment.merge_posting_list = failing_merge
+        self.ix.memory_limit = 1
+        self.ix.add_document(*FERMI)
+        self.ix._flush_thread.join()
+        # the error of the background flush is raised by the next commit, and the frozen segment stays searchable
+        with self.assertRaises(IOError):
+            self.ix.commit()
+        self.ix.commit()
+        self.assertEqual(self.ix.do_free_text_query(["nature"]).doc_ids, ["fermi"])
+
+        self.ix.memory_limit = float("inf")
+        self.ix.add_document(*BOHR)
+        # the next save retries the merge on its own thread
+        with self.assertRaises(IOError):
+            self.ix.save()
+        self.assertIsNotNone(self.ix.frozen_segment)
+        self.ix.disk_segment.merge_posting_list = merge_posting_list
+        self.ix.save()
+        self.assertIsNone(self.ix.frozen_segment)
+        res = self.ix.do_free_text_query(["nature", "god", "bomb"])
+        self.assertEqual(sorted(res.doc_ids), ["bohr", "einstein", "fermi", "oppenheimer"])
+
+    def test_stopword_phrase_query(self):
+        self.ix.add_document("hamlet", "Hamlet", "To be, or not to be, that is the question.")
+        self.ix.add_document("macbeth", "Macbeth", "What's done cannot be undone. To bed, to bed, to bed!")
+        for save in (False, True):
+            if save:
+                self.ix.save()
+            self.assertEqual(self.ix.do_phrase_query(["to", "be", "or", "not", "to", "be"]).doc_ids, ["hamlet"])
+            self.assertEqual(self.ix.do_phrase_query(["not", "to", "be", "or"]).doc_ids, [])
+            self.assertEqual(self.ix.do_phrase_query(["the", "destroyer", "of", "worlds"]).doc_ids, ["oppenheimer"])
+            self.assertEqual(self.ix.do_phrase_query(["the", "world", "war"]).doc_ids, [])
+            self.assertEqual(self.ix.do_phrase_query(["world", "war", "iv", "will"]).doc_ids, ["einstein"])
+            self.assertEqual(self.ix.do_phrase_query(["Albert", "Einstein"]).doc_ids, ["einstein"])
+            # nothing is left of a phrase of a single stopword
+            self.assertEqual(self.ix.do_phrase_query(["the"]).doc_ids, [])
+            self.assertEqual(self.ix.do_phrase_query(["the"], fields=["title"]).doc_ids, [])
+            self.assertEqual(self.ix.do_phrase_query([]).doc_ids, [])
+
+    def test_stopword_phrase_boolean_query(self):
+        self.ix.add_document("hamlet", "Hamlet", "To be, or not to be, that is the question.")
+        self.ix.add_document("macbeth", "Macbeth", "What's done cannot be undone. To bed, to bed, to bed!")
+        for save in (False, True):
+            if save:
+                self.ix.save()
+            self.assertEqual(self.ix.do_boolean_query('"to be or not to be"').doc_ids, ["hamlet"])
+            self.assertEqual(self.ix.do_boolean_query('"not to be or"').doc_ids, [])
+            self.assertEqual(self.ix.do_boolean_query('"to be" question').doc_ids, ["hamlet"])
+            self.assertEqual(self.ix.do_boolean_query('bed -"to be"').doc_ids, ["macbeth"])
+            # the stopwords are part of the phrase, it does not degrade to its content words
+            self.assertEqual(self.ix.do_boolean_query('"the destroyer of worlds"').doc_ids, ["oppenheimer"])
+            self.assertEqual(self.ix.do_boolean_query('"the world war"').doc_ids, [])
+            self.assertEqual(self.ix.do_boolean_query('"the world war" OR bed').doc_ids, ["macbeth"])
+
+    def test_stopword_phrase_positions(self):
+        # every piece of these phrases occurs, but not at the right positions
+        ix = self.new_index("phrase")
+        ix.add_document("notes", "Notes", "Albert Einstein Bohr and stuff. Later Einstein and Bohr met.")
+        ix.add_document("wells", "Wells", "The world is big. War of the worlds. World and war and world.")
+        for save in (False, True):
+            if save:
+                ix.save()
+            self.assertEqual(ix.do_phrase_query(["albert", "einstein", "and", "bohr"]).doc_ids, [])
+            self.assertEqual(ix.do_phrase_query(["later", "einstein", "and", "bohr"]).doc_ids, ["notes"])
+            self.assertEqual(ix.do_phrase_query(["the", "world", "war", "of", "the", "worlds"]).doc_ids, [])
+            self.assertEqual(ix.do_phrase_query(["war", "of", "the", "worlds", "world"]).doc_ids, ["wells"])
+        ix.close()
+
+    def test_run_queries(self):
+        self.ix.save()
+        self.ix.add_document("fermi", "Enrico Fermi", "The atomic bomb and the world war.")
+        batch = [("free_text", ["bomb"]), ("phrase", ["world", "war"]), ("free_text", ["bomb", "feared"]),
+                 ("phrase", ["the", "atomic", "bomb"]), ("free_text", ["fermi"], {"fields": ["title"]}),
+                 ("free_text", ["einstein", "bomb"], {"fields": ["text", "title"], "boosts": {"title": 3.0}})]
+        expected = [self.ix.do_free_text_query(["bomb"]), self.ix.do_phrase_query(["world", "war"]),
+                    self.ix.do_free_text_query(["bomb", "feared"]), self.ix.do_phrase_query(["the", "atomic", "bomb"]),
+                    self.ix.do_free_text_query(["fermi"], fields=["title"]),
+                    self.ix.do_free_text_query(["einstein", "bomb"], fields=["text", "title"], boosts={"title": 3.0})]
+        for res, exp in zip(self.ix.run_queries(batch), expected):
+            self.assertEqual(sorted(res.doc_ids), sorted(exp.doc_ids))
+            self.assertEqual(sorted(res.doc_titles), sorted(exp.doc_titles))
+        self.assertEqual(self.ix.run_queries(batch)[-1].scores, expected[-1].scores)
+
+        # "bomb" is read from the disk segment once for the whole batch, and the matching documents in one bulk read
+        metrics.enable()
+        try:
+            metrics.REGISTRY.reset()
+            self.ix.run_queries(batch)
+            self.assertGreater(metrics.REGISTRY.counters[("posting_list_cache_hits_total", ())], 0)
+            bulk_reads = metrics.REGISTRY.histograms[("stage_seconds", (("stage", "docstore.get_documents"),))]
+            self.assertEqual(bulk_reads.count, 1)
+        finally:
+            metrics.enable(False)
+            metrics.REGISTRY.reset()
+        with self.assertRaises(ValueError):
+            self.ix.run_queries([("boolean", ["bomb"])])
+
+    def test_top_k_query(self):
+        self.ix.tier_threshold = 20
+        self.ix.disk_segment.tier_size = 5
+        rand = random.Random(7)
+        words = ["alpha", "beta", "gamma", "delta", "omega"]
+        for i in range(300):
+            body = " ".join(w for w in words for _ in range(rand.randint(0, 6)))
+            self.ix.add_document(i, "doc " + str(i), body)
+            if i in (100, 200):
+                self.ix.save()
+        for i, tf in enumerate([20, 15, 12]):
+            self.ix.add_document(1000 + i, "alpha " + str(tf), " ".join(["alpha"] * tf))
+        self.ix.save()
+        self.ix.add_document(2000, "in memory", "alpha beta beta")
+
+        for _ in range(50):
+            terms = rand.sample(words, rand.randint(1, 3))
+            k = rand.choice([1, 3, 10, 50])
+            res = self.ix.do_top_k_query(terms, k)
+            exhaustive = self.ix.do_top_k_query(terms, k, tiered=False)
+            self.assertEqual(res.doc_ids, exhaustive.doc_ids)
+            self.assertEqual(res.scores, exhaustive.scores)
+            self.assertEqual(len(res.doc_ids), k)
+
+        # the top 3 are in the high-impact tier, and every other posting has a lower impact
+        res = self.ix.do_top_k_query(["alpha"], 3, trace=True)
+        self.assertEqual(res.doc_ids, [1000, 1001, 1002])
+        self.assertNotIn("tail_posting_lists_read", res.trace.counters)
+        self.assertEqual(self.ix.do_top_k_query(["alpha"], 3, tiered=False).doc_ids, [1000, 1001, 1002])
+
+    def test_fuzzy_query(self):
+        self.assertEqual(self.ix.do_free_text_query(["openheimer"]).doc_ids, [])
+        res = self.ix.do_free_text_query(["openheimer"], fuzzy=True)
+        self.assertEqual(res.doc_ids, ["oppenheimer"])
+        self.ix.save()
+        self.ix.add_document(*FERMI)
+        res = self.ix.do_free_text_query(["einstien", "fermy"], fuzzy=True, max_edits=2)
+        self.assertEqual(sorted(res.doc_ids), ["einstein", "fermi"])
+        self.assertEqual(self.ix.expand_term("bomb", max_edits=2, max_expansions=1), ["bomb"])
+
+    def test_suggest(self):
+        self.assertEqual(self.ix.suggest("W"), ["world", "war", "weapon"])
+        self.ix.save()
+        self.ix.add_document(*FERMI)
+        self.ix.add_document("bohr", "Niels Bohr", "An expert is a person who has made all the mistakes in a field.")
+        # "war", "weapon" and "whatev" occur in one document each, ties go to the first term
+        self.assertEqual(self.ix.suggest("w", 4), ["world", "war", "weapon", "whatev"])
+        self.assertEqual(self.ix.suggest("wo"), ["world"])
+        self.assertEqual(self.ix.suggest("x"), [])
+        self.ix.close()
+        self.assertTrue(os.path.isfile(os.path.join(self.dir, "test_ix.db.suggest")))
+        self.ix = self.new_index("test")
+        self.assertEqual(self.ix.suggest("w", 4), ["world", "war", "weapon", "whatev"])
+
+        # the merged suggestions of the disk and memory segments agree with the total document frequencies
+        rand = random.Random(0)
+        ix = self.new_index("suggest")
+        for i in range(400):
+            if i == 300:
+                ix.save()
+            ix.add_document(i, "", " ".join("".join(rand.choice("pqr") for _ in range(rand.randint(2, 4)))
+                                            for _ in range(rand.randint(1, 20 if i < 300 else 3))))
+        for prefix in ["", "p", "pq", "rrr"]:
+            for k in [1, 5, 20]:
+                expected = sorted((-sum(s.doc_frequency(t) for s in ix.segments()), t)
+                                  for s in ix.segments() for t, df in s.suggest(prefix, 1000))
+                expected = [t for df, t in sorted(set(expected))][:k]
+                self.assertEqual(ix.suggest(prefix, k), expected)
+        ix.close()
+
+    def test_open(self):
+        directory = os.path.join(self.dir, "ix")
+        cwd = os.getcwd()
+        os.chdir(self.dir) # stopwords.dat must not be looked up in the working directory
+        try:
+            ix = Index.open(directory)
+            ix.add_document("curie", "Marie Curie", "Nothing in life is to be feared, it is only to be understood.")
+            ix.close()
+        finally:
+            os.chdir(cwd)
+
+        ix = Index.open(directory)
+        self.assertEqual(ix.doc_count, 1)
+        self.assertIn("the", ix.stopwords)
+        # nothing but the manifest is opened until the index is used
+        self.assertIsNone(ix._disk_segment)
+        self.assertIsNone(ix._docstore)
+        res = ix.do_free_text_query(["feared"])
+        self.assertEqual(res.doc_titles, ["Marie Curie"])
+        ix.close()
+
+if __name__ == '__main__':
+    unittest.main()
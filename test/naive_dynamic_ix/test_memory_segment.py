@@ -1,5 +1,7 @@
 import unittest
+import random
 
+from naive_dynamic_ix import posting_arrays
 from naive_dynamic_ix.memory_segment import Posting, PostingList, MemorySegment
 
 
@@ -76,6 +78,80 @@ class TestPostingList(unittest.TestCase):
         self.assertEqual(phrase_plist.postings[0].doc_id, "hbo.com")
         self.assertEqual(phrase_plist.postings[0].positions, [0])
 
+    def test_find_near(self):
+        # einstein
+        plist1 = PostingList([Posting("bio.com", [3, 40]), Posting("news.com", [0]), Posting("wiki.org", [10])])
+        # bomb
+        plist2 = PostingList([Posting("bio.com", [20, 44]), Posting("news.com", [2]), Posting("wiki.org", [4])])
+
+        near = PostingList.find_near([plist1, plist2], 5)
+        self.assertEqual([p.doc_id for p in near.postings], ["bio.com", "news.com"])
+        self.assertEqual(near.postings[0].positions, [40])
+        near = PostingList.find_near([plist1, plist2], 6)
+        self.assertEqual([p.doc_id for p in near.postings], ["bio.com", "news.com", "wiki.org"])
+        self.assertEqual(near.postings[2].positions, [4])
+
+        # wiki.org has bomb before einstein
+        near = PostingList.find_near([plist1, plist2], 6, ordered=True)
+        self.assertEqual([p.doc_id for p in near.postings], ["bio.com", "news.com"])
+        near = PostingList.find_near([plist1, plist2], 1, ordered=True)
+        self.assertEqual(near.postings, [])
+
+        # an ordered query with no slack is an exact phrase query
+        plist3 = PostingList([Posting("bio.com", [41]), Posting("news.com", [1])])
+        near = PostingList.find_near([plist1, plist3, plist2], 2, ordered=True)
+        self.assertEqual([p.doc_id for p in near.postings], ["news.com"])
+        self.assertEqual(near.postings, PostingList.find_phrases([plist1, plist3, plist2]).postings)
+
+        # a repeated term must occur at distinct positions, as many times as it is repeated
+        near = PostingList.find_near([plist1, plist1], 0)
+        self.assertEqual(near.postings, [])
+        near = PostingList.find_near([plist1, plist2, plist1], 37)
+        self.assertEqual([p.doc_id for p in near.postings], ["bio.com"])
+        self.assertEqual(near.postings[0].positions, [3])
+
+    def test_intersect_and_union_doc_ids(self):
+        plist1 = PostingList([Posting("a", [0]), Posting("b", [1]), Posting("c", [2])])
+        plist2 = PostingList([Posting("b", [3]), Posting("c", [4]), Posting("d", [5])])
+        self.assertEqual(PostingList.intersect_doc_ids([plist1, plist2]), ["b", "c"])
+        self.assertEqual(PostingList.intersect_doc_ids([plist1, PostingList()]), [])
+        self.assertEqual(PostingList.union_doc_ids([plist1, plist2]), ["a", "b", "c", "d"])
+
+
+@unittest.skipIf(posting_arrays.np is None, "NumPy is not installed")
+class TestVectorizedPostingList(TestPostingList):
+    '''
+    Runs the PostingList tests again with the NumPy code paths forced on, and checks them against the Python ones.
+    '''
+    def setUp(self):
+        self.thresholds = (posting_arrays.MIN_VECTORIZE_POSTINGS, posting_arrays.MIN_VECTORIZE_POSITIONS)
+        posting_arrays.MIN_VECTORIZE_POSTINGS, posting_arrays.MIN_VECTORIZE_POSITIONS = 0, 0
+
+    def tearDown(self):
+        posting_arrays.MIN_VECTORIZE_POSTINGS, posting_arrays.MIN_VECTORIZE_POSITIONS = self.thresholds
+
+    def random_posting_list(self, rand, doc_ids):
+        postings = [Posting(doc_id, sorted(rand.sample(range(50), rand.randint(1, 10))))
+                    for doc_id in sorted(rand.sample(doc_ids, rand.randint(0, len(doc_ids))))]
+        return PostingList(postings)
+
+    def test_matches_python(self):
+        rand = random.Random(0)
+        for doc_ids in (["doc" + str(i) for i in range(40)], list(range(40))):
+            for trial in range(20):
+                plists = [self.random_posting_list(rand, doc_ids) for _ in range(3)]
+                vectorized = (PostingList.merge_lists(plists[0], plists[1]).postings,
+                              PostingList.find_phrases(plists[:2]).postings,
+                              PostingList.intersect_doc_ids(plists),
+                              PostingList.union_doc_ids(plists))
+                self.tearDown()
+                python = (PostingList.merge_lists(plists[0], plists[1]).postings,
+                          PostingList.find_phrases(plists[:2]).postings,
+                          PostingList.intersect_doc_ids(plists),
+                          PostingList.union_doc_ids(plists))
+                self.setUp()
+                self.assertEqual(vectorized, python)
+
 class TestMemorySegment(unittest.TestCase):
     def test_add_posting_and_clear(self):
         ix = MemorySegment()
@@ -92,6 +168,23 @@ class TestMemorySegment(unittest.TestCase):
         ix.clear()
         self.assertEqual(len(ix.index.items()), 0)
 
+    def test_suggest(self):
+        ix = MemorySegment()
+        ix.add_token("title:winter", "hbo.com", 0)
+        self.assertEqual(ix.suggest("", 10), [])
+        # the suggestions follow the added tokens, compared against a scan of the term stats
+        rand = random.Random(0)
+        for i in range(2000):
+            term = "".join(rand.choice("abc") for _ in range(rand.randint(1, 4)))
+            ix.add_token(term, rand.randrange(50), i)
+            if i % 100 == 0:
+                for prefix in ["", "a", "ab", "cba"]:
+                    expected = sorted((-ix.doc_frequency(t), t) for t in ix.term_stats.terms()
+                                      if t.startswith(prefix) and not t.startswith("title:"))[:5]
+                    self.assertEqual(ix.suggest(prefix, 5), [(t, -df) for df, t in expected])
+        ix.clear()
+        self.assertEqual(ix.suggest("a", 5), [])
+
     def test_queries(self):
         ix = MemorySegment()
         # winter
@@ -116,6 +209,10 @@ class TestMemorySegment(unittest.TestCase):
         ix.add_posting("coming", p3_0)
         ix.add_posting("coming", p3_1)
 
+        self.assertEqual(ix.doc_frequency("winter"), 3)
+        self.assertEqual(ix.term_stats.collection_frequency("winter"), 5)
+        self.assertEqual(ix.doc_frequency("frozen"), 0)
+
         # one word query
         owq_result = ix.do_one_word_query("winter")
         self.assertEqual(owq_result, ["disney.com", "hbo.com", "patagonia.com"])
@@ -126,6 +223,17 @@ class TestMemorySegment(unittest.TestCase):
         self.assertEqual(pq_result, ["hbo.com"])
         pq_empty_result = ix.do_phrase_query(["coming", "is", "winter"])
         self.assertEqual(pq_empty_result, [])
+        # proximity query
+        prox_result = ix.do_proximity_query(["winter", "coming"], 1)
+        self.assertEqual(prox_result, ["hbo.com"])
+        prox_result = ix.do_proximity_query(["winter", "coming"], 2)
+        self.assertEqual(prox_result, ["hbo.com", "patagonia.com"])
+        prox_result = ix.do_proximity_query(["winter", "coming"], 1, ordered=True)
+        self.assertEqual(prox_result, [])
+        prox_result = ix.do_proximity_query(["coming", "winter"], 1, ordered=True)
+        self.assertEqual(prox_result, ["hbo.com"])
+        prox_empty_result = ix.do_proximity_query(["winter", "frozen"], 10)
+        self.assertEqual(prox_empty_result, [])
         ix.clear()
 
 
@@ -0,0 +1,48 @@
+import unittest
+import json
+
+from naive_dynamic_ix import metrics
+from naive_dynamic_ix.results import Results
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.REGISTRY.reset()
+
+    def test_disabled(self):
+        with metrics.timer("stage"):
+            metrics.count("bytes_read", 10)
+        self.assertEqual(metrics.REGISTRY.counters, {})
+        self.assertEqual(metrics.REGISTRY.histograms, {})
+
+    def test_trace(self):
+        with metrics.query("free_text", trace=True) as q:
+            with metrics.timer("disk_segment.lookup"):
+                metrics.count("bytes_read", 10)
+            with metrics.timer("disk_segment.lookup"):
+                metrics.count("bytes_read", 5)
+            results = q.attach(Results([], [], []))
+        self.assertEqual(results.trace.counters, {"bytes_read": 15})
+        self.assertEqual(results.trace.stages["disk_segment.lookup"][1], 2)
+        self.assertGreater(results.trace.total_seconds, 0)
+        # tracing a query does not touch the process-wide metrics, and stops with the query
+        self.assertEqual(metrics.REGISTRY.counters, {})
+        self.assertIsNone(metrics.current_trace())
+
+    def test_registry(self):
+        metrics.enable()
+        try:
+            with metrics.query("phrase"):
+                metrics.count("postings_decoded", 3)
+        finally:
+            metrics.enable(False)
+        dump = json.loads(metrics.REGISTRY.to_json())
+        counters = {(c["name"], tuple(sorted(c["labels"].items()))): c["value"] for c in dump["counters"]}
+        self.assertEqual(counters[("postings_decoded_total", ())], 3)
+        self.assertEqual(counters[("queries_total", (("type", "phrase"),))], 1)
+
+        text = metrics.REGISTRY.to_prometheus()
+        self.assertIn("# TYPE naive_ix_queries_total counter", text)
+        self.assertIn('naive_ix_queries_total{type="phrase"} 1', text)
+        self.assertIn('naive_ix_query_seconds_bucket{type="phrase",le="+Inf"} 1', text)
+        self.assertIn('naive_ix_query_seconds_count{type="phrase"} 1', text)
@@ -0,0 +1,65 @@
+import unittest
+import shutil
+import tempfile
+import os
+
+from naive_dynamic_ix.index import Index
+from naive_dynamic_ix.optimize import optimize
+from naive_dynamic_ix.snapshot import create_snapshot, Replica
+
+class TestOptimize(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.ix_dir = os.path.join(self.dir, "ix")
+        ix = Index.open(self.ix_dir)
+        ix.tier_threshold = 2
+        ix.add_document("einstein", "Albert Einstein", "The atomic bomb changed everything.")
+        ix.add_document("oppenheimer", "J. Robert Oppenheimer", "Now I am become Death, the destroyer of worlds. "
+                                                                "The bomb was built at Los Alamos.")
+        ix.save()
+        ix.disk_segment.tier_threshold = None  # the next merge leaves the tier of "bomb" stale
+        ix.add_document("fermi", "Enrico Fermi", "The atomic pile went critical before the bomb.")
+        ix.close()
+
+    def queries(self, ix):
+        return (sorted(ix.do_free_text_query(["bomb", "death"]).doc_ids),
+                ix.do_phrase_query(["atomic", "pile"]).doc_titles,
+                ix.do_free_text_query(["einstein"], fields=["title"]).doc_ids,
+                ix.do_top_k_query(["bomb"], 2).doc_ids,
+                ix.suggest("a"))
+
+    def test_optimize(self):
+        ix = Index.open(self.ix_dir)
+        expected = self.queries(ix)
+        snapshots_dir = os.path.join(self.dir, "snapshots")
+        create_snapshot(ix, snapshots_dir)
+        ix.add_document("curie", "Marie Curie", "Nothing in life is to be feared, it is only to be understood.")
+        ix.close()
+
+        report = optimize(self.ix_dir)
+        self.assertEqual(report["documents"], 4)
+        self.assertEqual(report["dropped_tiers"], 1)
+        self.assertNotIn("segment.db", os.listdir(self.ix_dir))
+        self.assertIn("segment.1.db", os.listdir(self.ix_dir))
+
+        ix = Index.open(self.ix_dir)
+        self.assertEqual(self.queries(ix), expected)
+        self.assertEqual(ix.do_free_text_query(["feared"]).doc_ids, ["curie"])
+        # documents saved before the optimize are still shipped by the next incremental snapshot
+        create_snapshot(ix, snapshots_dir, incremental=True)
+        ix.close()
+        replica = Replica(snapshots_dir)
+        self.assertEqual(replica.index.do_free_text_query(["feared"]).doc_ids, ["curie"])
+        replica.close()
+
+        optimize(self.ix_dir)
+        self.assertIn("segment.2.db", os.listdir(self.ix_dir))
+        ix = Index.open(self.ix_dir)
+        self.assertEqual(self.queries(ix), expected)
+        ix.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+if __name__ == '__main__':
+    unittest.main()
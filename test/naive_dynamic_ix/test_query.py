@@ -0,0 +1,20 @@
+import unittest
+
+from naive_dynamic_ix.query import parse, QueryParseError, Term, Phrase, And, Or, Not
+
+
+class TestParse(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse('"albert einstein" AND (bomb OR atomic) -movie'),
+                         And([Phrase(["albert", "einstein"]), Or([Term("bomb"), Term("atomic")]), Not(Term("movie"))]))
+        # AND is implied and binds tighter than OR
+        self.assertEqual(parse("winter coming OR summer"),
+                         Or([And([Term("winter"), Term("coming")]), Term("summer")]))
+        self.assertEqual(parse("NOT x-ray scan"), And([Not(Term("x-ray")), Term("scan")]))
+        self.assertEqual(parse("-(a OR b) c"), And([Not(Or([Term("a"), Term("b")])), Term("c")]))
+        self.assertEqual(parse("   "), None)
+
+    def test_parse_errors(self):
+        for query in ['"unterminated', "(a OR b", "a OR", "a )", "AND"]:
+            with self.assertRaises(QueryParseError):
+                parse(query)
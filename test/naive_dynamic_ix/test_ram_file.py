@@ -0,0 +1,38 @@
+import unittest
+import os
+
+from naive_dynamic_ix.index import Index
+from test.naive_dynamic_ix.fixtures import IndexTestCase, EINSTEIN, OPPENHEIMER, CURIE, FERMI
+
+class TestRamFile(IndexTestCase):
+    def test_in_memory(self):
+        filename = os.path.join(self.dir, "ram.ix")
+        ix = Index.in_memory(filename)
+        for doc in (EINSTEIN, OPPENHEIMER, CURIE):
+            ix.add_document(*doc)
+        ix.add_document(7, *FERMI[1:])
+
+        def queries(ix):
+            return (ix.do_free_text_query(["bomb", "feared"]).doc_ids,
+                    ix.do_phrase_query(["to", "be", "feared"]).doc_ids,
+                    ix.do_phrase_query(["Albert"], fields=["title"]).doc_titles,
+                    ix.do_proximity_query(["bomb", "war"], 12).doc_ids,
+                    ix.do_boolean_query("bomb AND NOT alamos").doc_ids,
+                    ix.do_top_k_query(["bomb"], 1).doc_ids,
+                    ix.do_free_text_query(["mankind"]).doc_ids,
+                    ix.do_free_text_query(["openheimer"], fuzzy=True).doc_ids)
+
+        expected = queries(ix)
+        self.assertEqual(expected[:6], queries(self.ix)[:6])
+        self.assertEqual(expected[6:], ([7], ["oppenheimer"]))
+        ix.save()
+        self.assertEqual(os.listdir(self.dir).count("ram.ix"), 1)
+        self.assertIsNone(ix._disk_segment)
+
+        ix = Index.in_memory(filename)
+        self.assertEqual(ix.doc_count, 4)
+        self.assertEqual(queries(ix), expected)
+        self.assertEqual(ix.get_document(7), FERMI[1:])
+
+if __name__ == '__main__':
+    unittest.main()
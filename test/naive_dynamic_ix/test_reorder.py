@@ -0,0 +1,71 @@
+import unittest
+import shutil
+import tempfile
+import os
+
+from naive_dynamic_ix.index import Index
+from naive_dynamic_ix.reorder import reorder, TITLE, MINHASH
+from naive_dynamic_ix.snapshot import create_snapshot, Replica
+
+class TestReorder(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.ix_dir = os.path.join(self.dir, "ix")
+        ix = Index.open(self.ix_dir)
+        ix.add_document("oppenheimer", "J. Robert Oppenheimer", "Now I am become Death, the destroyer of worlds.")
+        ix.add_document("einstein", "Albert Einstein", "The atomic bomb changed everything.")
+        ix.save()
+        ix.add_document("curie", "Marie Curie", "Nothing in life is to be feared, it is only to be understood.")
+        ix.close()
+
+    def queries(self, ix):
+        return (sorted(ix.do_free_text_query(["bomb", "feared", "death"]).doc_ids),
+                ix.do_phrase_query(["to", "be", "feared"]).doc_titles,
+                ix.do_free_text_query(["einstein"], fields=["title"]).doc_ids,
+                sorted(ix.do_boolean_query("bomb OR worlds").doc_ids),
+                ix.do_top_k_query(["bomb"], 1).doc_ids)
+
+    def test_reorder(self):
+        ix = Index.open(self.ix_dir)
+        expected = self.queries(ix)
+        ix.close()
+
+        report = reorder(self.ix_dir, TITLE, num_queries=5)
+        self.assertEqual(report["documents"], 3)
+        self.assertGreater(report["before"]["bytes"], 0)
+        self.assertIn("p50_ms", report["after"]["free_text"])
+        self.assertNotIn("segment.db", os.listdir(self.ix_dir))
+
+        ix = Index.open(self.ix_dir)
+        # ordinals follow the titles
+        self.assertEqual(ix.doc_map.doc_ids, ["einstein", "oppenheimer", "curie"])
+        self.assertEqual(self.queries(ix), expected)
+        self.assertEqual(ix.get_document("curie")[0], "Marie Curie")
+        # new documents get the next ordinals, and are replayed from the log after a crash
+        ix.add_document("fermi", "Enrico Fermi", "The atomic pile went critical.")
+        ix.wal.commit()
+        ix.wal.close()
+        ix = Index.open(self.ix_dir)
+        self.assertEqual(sorted(ix.do_free_text_query(["atomic"]).doc_ids), ["einstein", "fermi"])
+        ix.close()
+
+        reorder(self.ix_dir, MINHASH, num_queries=5)
+        ix = Index.open(self.ix_dir)
+        self.assertEqual(sorted(ix.doc_map.doc_ids), ["curie", "einstein", "fermi", "oppenheimer"])
+        self.assertEqual(sorted(ix.do_free_text_query(["atomic"]).doc_ids), ["einstein", "fermi"])
+        self.assertEqual(self.queries(ix)[1:], expected[1:])
+
+        snapshots_dir = os.path.join(self.dir, "snapshots")
+        create_snapshot(ix, snapshots_dir)
+        with self.assertRaises(ValueError):
+            create_snapshot(ix, snapshots_dir, incremental=True)
+        ix.close()
+        replica = Replica(snapshots_dir)
+        self.assertEqual(replica.index.do_phrase_query(["atomic", "pile"]).doc_ids, ["fermi"])
+        replica.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+if __name__ == '__main__':
+    unittest.main()
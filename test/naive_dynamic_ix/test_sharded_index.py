@@ -0,0 +1,58 @@
+import unittest
+import shutil
+import tempfile
+import os
+
+from naive_dynamic_ix.sharded_index import ShardedIndex, shard_for
+
+
+class TestShardedIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.ix_filename = os.path.join(self.dir, "test_ix.db")
+        self.repo_filename = os.path.join(self.dir, "test_docs.db")
+
+    def add_documents(self, ix):
+        ix.add_document("hbo.com", "HBO", "winter is coming")
+        ix.add_document("disney.com", "Disney", "let it go, the cold never bothered me anyway")
+        ix.add_document("patagonia.com", "Patagonia", "winter jackets coming soon")
+        ix.add_document("wikipedia.org", "Wikipedia", "winter is the coldest season of the year")
+
+    def check_queries(self, ix):
+        res = ix.do_free_text_query(["winter"])
+        self.assertEqual(sorted(res.doc_ids), ["hbo.com", "patagonia.com", "wikipedia.org"])
+        res = ix.do_phrase_query(["winter", "is", "coming"])
+        self.assertEqual(res.doc_ids, ["hbo.com"])
+        self.assertEqual(res.doc_titles, ["HBO"])
+        free_text, phrase = ix.run_queries([("free_text", ["winter"]), ("phrase", ["winter", "is", "coming"])])
+        self.assertEqual(sorted(free_text.doc_ids), ["hbo.com", "patagonia.com", "wikipedia.org"])
+        self.assertEqual(phrase.doc_ids, ["hbo.com"])
+        res = ix.do_top_k_query(["winter", "coming"], 2)
+        self.assertEqual(sorted(res.doc_ids), ["hbo.com", "patagonia.com"])
+        self.assertEqual(res.scores, sorted(res.scores, reverse=True))
+
+    def test_routing_is_stable(self):
+        self.assertEqual(shard_for("hbo.com", 4), shard_for("hbo.com", 4))
+        self.assertTrue(0 <= shard_for("hbo.com", 4) < 4)
+
+    def test_local_shards(self):
+        ix = ShardedIndex(self.ix_filename, self.repo_filename, num_shards=3, processes=False)
+        self.add_documents(ix)
+        self.check_queries(ix)
+        ix.close()
+
+    def test_process_shards(self):
+        ix = ShardedIndex(self.ix_filename, self.repo_filename, num_shards=3)
+        self.add_documents(ix)
+        self.check_queries(ix)
+        ix.close()
+
+        # documents survive a reopen, but only with the same shard count
+        ix = ShardedIndex(self.ix_filename, self.repo_filename, num_shards=3, processes=False)
+        self.check_queries(ix)
+        ix.close()
+        with self.assertRaises(ValueError):
+            ShardedIndex(self.ix_filename, self.repo_filename, num_shards=2, processes=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
@@ -0,0 +1,89 @@
+import unittest
+import shutil
+import tempfile
+import os
+
+from naive_dynamic_ix.index import Index
+from naive_dynamic_ix.snapshot import create_snapshot, verify_snapshot, load_snapshot_info, Replica
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.snapshots_dir = os.path.join(self.dir, "snapshots")
+        self.ix = Index.open(os.path.join(self.dir, "ix"))
+        self.ix.add_document("einstein", "Albert Einstein", "The atomic bomb changed everything.")
+        self.ix.add_document("oppenheimer", "J. Robert Oppenheimer", "Now I am become Death, the destroyer of worlds.")
+
+    def test_full_snapshot(self):
+        path = create_snapshot(self.ix, self.snapshots_dir)
+        verify_snapshot(path)
+        self.assertIsNone(load_snapshot_info(path)["base"])
+
+        replica = Replica(self.snapshots_dir)
+        res = replica.index.do_phrase_query(["atomic", "bomb"])
+        self.assertEqual(res.doc_titles, ["Albert Einstein"])
+        with self.assertRaises(ValueError):
+            replica.index.add_document("curie", "Marie Curie", "Nothing in life is to be feared.")
+
+        # the replica keeps serving its snapshot while the index takes documents
+        self.ix.add_document("curie", "Marie Curie", "Nothing in life is to be feared, it is only to be understood.")
+        self.ix.save()
+        self.assertEqual(replica.index.do_free_text_query(["feared"]).doc_ids, [])
+        self.assertFalse(replica.refresh())
+        replica.close()
+
+    def test_incremental_snapshot(self):
+        base = create_snapshot(self.ix, self.snapshots_dir)
+        with self.assertRaises(ValueError):
+            create_snapshot(self.ix, os.path.join(self.dir, "other"), incremental=True)
+        replica = Replica(self.snapshots_dir)
+
+        self.ix.add_document("curie", "Marie Curie", "Nothing in life is to be feared, it is only to be understood.")
+        self.ix.save()  # saved documents are shipped from the archived log
+        self.ix.add_document("fermi", "Enrico Fermi", "The atomic pile went critical.")
+        path = create_snapshot(self.ix, self.snapshots_dir, incremental=True)
+        info = load_snapshot_info(path)
+        self.assertEqual(info["base"], load_snapshot_info(base)["id"])
+        self.assertEqual(info["doc_count"], 4)
+
+        self.assertTrue(replica.refresh())
+        # the new snapshot only holds the documents added since the base snapshot
+        delta_segments = replica.index.delta_segments
+        self.assertEqual(len(delta_segments), 1)
+        self.assertEqual(len(delta_segments[0][1].keys()), 2)
+        res = replica.index.do_free_text_query(["atomic", "feared"])
+        self.assertEqual(sorted(res.doc_titles), ["Albert Einstein", "Enrico Fermi", "Marie Curie"])
+        res = replica.index.do_phrase_query(["to", "be", "feared"])
+        self.assertEqual(res.doc_ids, ["curie"])
+        res = replica.index.do_free_text_query(["fermi"], fields=["title"])
+        self.assertEqual(res.doc_ids, ["fermi"])
+
+        # nothing new to ship
+        self.assertEqual(create_snapshot(self.ix, self.snapshots_dir, incremental=True), path)
+        self.ix.close()
+        self.ix = Index.open(os.path.join(self.dir, "ix"))
+        self.ix.add_document("bohr", "Niels Bohr", "Prediction is very difficult, especially about the future.")
+        self.assertNotEqual(create_snapshot(self.ix, self.snapshots_dir, incremental=True), path)
+        self.assertTrue(replica.refresh())
+        self.assertEqual(replica.index.do_free_text_query(["predict"]).doc_ids, ["bohr"])
+        self.assertEqual(replica.index.do_free_text_query(["critical"]).doc_ids, ["fermi"])
+        replica.close()
+
+    def test_verify_snapshot(self):
+        path = create_snapshot(self.ix, self.snapshots_dir)
+        filename = os.path.join(path, "docs.db")
+        os.chmod(filename, 0o644)
+        with open(filename, 'r+b') as f:
+            f.seek(100)
+            byte = f.read(1)
+            f.seek(100)
+            f.write(bytes([byte[0] ^ 0xff]))
+        with self.assertRaises(ValueError):
+            verify_snapshot(path)
+
+    def tearDown(self):
+        self.ix.close()
+        shutil.rmtree(self.dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import shutil
+import tempfile
+import os
+
+from naive_dynamic_ix.index import Index
+from naive_dynamic_ix.optimize import optimize
+from naive_dynamic_ix.storage import open_storage, detect_backend, BSDDB, SQLITE, SQLITE_BATCH_SIZE, bsddb3
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def check_backend(self, backend):
+        filename = os.path.join(self.dir, backend + ".db")
+        storage = open_storage(filename, backend=backend)
+        storage["bomb"] = b"1"
+        storage.update([("atomic", b"2"), ("worlds", b"3")])
+        storage["bomb"] = b"5"
+        self.assertEqual(storage["bomb"], b"5")
+        self.assertTrue(storage.has_key("atomic"))
+        self.assertFalse(storage.has_key("death"))
+        with self.assertRaises(KeyError):
+            storage["death"]
+        self.assertEqual(list(storage.range("atomic", "c")), [("atomic", b"2"), ("bomb", b"5")])
+        storage.close()
+
+        self.assertEqual(detect_backend(filename), backend)
+        storage = open_storage(filename, read_only=True)
+        self.assertEqual(sorted(storage.keys()), ["atomic", "bomb", "worlds"])
+        self.assertEqual(storage["worlds"], b"3")
+        storage.close()
+
+    def test_sqlite(self):
+        self.check_backend(SQLITE)
+
+    @unittest.skipIf(bsddb3 is None, "bsddb3 is not installed")
+    def test_bsddb(self):
+        self.check_backend(BSDDB)
+
+    def test_sqlite_readers(self):
+        # a reader sees the file as of the writer's last sync
+        filename = os.path.join(self.dir, "ix.db")
+        writer = open_storage(filename, backend=SQLITE)
+        writer["bomb"] = b"1"
+        writer.sync()
+        reader = open_storage(filename, read_only=True)
+        for i in range(SQLITE_BATCH_SIZE + 1):
+            writer[str(i)] = b""
+        self.assertEqual(reader.keys(), ["bomb"])
+        writer.sync()
+        self.assertEqual(len(reader.keys()), SQLITE_BATCH_SIZE + 2)
+        reader.close()
+        writer.close()
+
+    def test_index(self):
+        ix_dir = os.path.join(self.dir, "ix")
+        ix = Index.open(ix_dir, storage=SQLITE)
+        ix.add_document("einstein", "Albert Einstein", "The atomic bomb changed everything.")
+        ix.save()
+        ix.add_document("oppenheimer", "J. Robert Oppenheimer", "Now I am become Death, the destroyer of worlds.")
+        ix.close()
+        self.assertEqual(detect_backend(os.path.join(ix_dir, "segment.db")), SQLITE)
+        with self.assertRaises(ValueError):
+            Index.open(ix_dir, storage=BSDDB)
+
+        ix = Index.open(ix_dir)
+        self.assertEqual(sorted(ix.do_free_text_query(["bomb", "death"]).doc_ids), ["einstein", "oppenheimer"])
+        self.assertEqual([key for key, value in ix.disk_segment.scan("b", "c")], ["becom", "bomb"])
+        ix.close()
+
+        if bsddb3 is not None:
+            optimize(ix_dir, backend=BSDDB)
+            self.assertEqual(detect_backend(os.path.join(ix_dir, "segment.1.db")), BSDDB)
+            ix = Index.open(ix_dir)
+            self.assertEqual(ix.storage, BSDDB)
+            self.assertEqual(ix.get_document("oppenheimer")[0], "J. Robert Oppenheimer")
+            ix.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+import unittest
+import random
+
+from naive_dynamic_ix.suggest import Suggester
+
+class TestSuggester(unittest.TestCase):
+    def test_precomputed_top(self):
+        # the precomputed suggestions of prefixes matching many terms agree with a scan
+        rand = random.Random(0)
+        terms = set("".join(rand.choice("abc") for _ in range(rand.randint(1, 8))) for _ in range(30000))
+        suggester = Suggester.build((term, rand.randint(1, 50)) for term in terms)
+        self.assertIn("ab", suggester.top)
+        for prefix in ["", "a", "ab", "abc", "abca", "cccc"]:
+            expected = sorted((-frequency, term) for term, frequency in
+                              ((t, suggester.frequencies[i]) for i, t in enumerate(suggester.terms))
+                              if term.startswith(prefix))[:10]
+            self.assertEqual(suggester.suggest(prefix, 10), [(term, -frequency) for frequency, term in expected])
+
+if __name__ == '__main__':
+    unittest.main()
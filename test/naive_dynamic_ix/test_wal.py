@@ -0,0 +1,80 @@
+import unittest
+import shutil
+import tempfile
+import time
+import os
+
+from naive_dynamic_ix.index import Index
+from naive_dynamic_ix.manifest import Manifest
+from naive_dynamic_ix.storage import detect_backend, SQLITE
+from naive_dynamic_ix.wal import WriteAheadLog
+from test.naive_dynamic_ix.fixtures import IndexTestCase, EINSTEIN, CURIE, FERMI
+
+class TestWriteAheadLog(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.dir, "ix.wal")
+
+    def test_group_size(self):
+        wal = WriteAheadLog(self.prefix, group_size=2, max_delay=60)
+        wal.append("einstein", "Albert Einstein", "The atomic bomb changed everything.")
+        self.assertEqual(list(WriteAheadLog(self.prefix).replay()), [])
+        wal.append("fermi", "Enrico Fermi", "Whatever Nature has in store for mankind.")
+        self.assertEqual([doc_id for doc_id, title, body in WriteAheadLog(self.prefix).replay()],
+                         ["einstein", "fermi"])
+        wal.close()
+
+    def test_idle_writer(self):
+        # the group is committed max_delay after its first record, even if nothing else is appended
+        wal = WriteAheadLog(self.prefix, group_size=128, max_delay=0.01)
+        wal.append("einstein", "Albert Einstein", "The atomic bomb changed everything.")
+        deadline = time.monotonic() + 5
+        while not list(WriteAheadLog(self.prefix).replay()) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(list(WriteAheadLog(self.prefix).replay()),
+                         [("einstein", "Albert Einstein", "The atomic bomb changed everything.")])
+        wal.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+class TestReplay(IndexTestCase):
+    def test_replay(self):
+        ix = self.new_index("wal")
+        ix.add_document(*EINSTEIN)
+        ix.save()
+        ix.add_document(*FERMI)
+        ix.commit()
+        # crash: the memory segment is lost
+        ix.disk_segment.close()
+        ix.docstore.close()
+
+        ix = self.new_index("wal")
+        res = ix.do_free_text_query(["bomb", "nature"])
+        self.assertEqual(sorted(res.doc_ids), ["einstein", "fermi"])
+        self.assertEqual(sorted(ix.memory_segment.do_one_word_query("natur")), ["fermi"])
+        ix.close()
+        # the log is truncated once its documents are saved
+        self.assertEqual(ix.wal.generations(), [])
+
+    def test_replay_open(self):
+        ix_dir = os.path.join(self.dir, "ix")
+        ix = Index.open(ix_dir, storage=SQLITE)
+        ix.add_document(*EINSTEIN)
+        ix.save()
+        ix.add_document(*FERMI)
+        ix.add_document(*CURIE)
+        ix.commit()
+        ix.disk_segment.close()
+        ix.docstore.close()
+
+        # the replayed documents are counted on top of the saved ones, and stored with the index's backend
+        ix = Index.open(ix_dir)
+        self.assertEqual(ix.doc_count, 3)
+        self.assertEqual(detect_backend(ix.repo_filename), SQLITE)
+        ix.close()
+        self.assertEqual(Manifest.load(ix_dir).doc_count, 3)
+        self.assertEqual(Index.open(ix_dir).doc_count, 3)
+
+if __name__ == '__main__':
+    unittest.main()